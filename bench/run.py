@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""Offline benchmarks for the PGenerator+ ICC builder hot paths.
+
+Usage:
+    python3 bench/run.py [--repeat N] [--only NAME[,NAME...]] [--output FILE]
+    python3 bench/run.py --compare OLD.json NEW.json
+    python3 bench/run.py --record
+
+Each benchmark runs in its own forked process, so its peak RSS (including
+any tool it starts) is its own and not the high-water mark of an earlier
+one. Setup (building the synthetic profiles) is not timed. Function
+benchmarks call the hot paths directly on a synthetic 600 cd/m2 P3 HDR
+profile; build benchmarks run icc_profile_builder.build() end to end for
+every payload in bench/payloads with the stub Argyll tools in bench/stubs,
+so no ArgyllCMS install, Patch Companion or display is needed.
+
+bench/payloads holds frozen synthetic SDR matrix, SDR cLUT, KDE HDR and
+Windows HDR (MHC2) requests, written by --record. A request recorded from
+a real session (the builder's INPUT.json) can be dropped in next to them.
+
+The JSON report carries the commit, interpreter and worker settings, so
+reports from two commits can be compared with --compare. PGEN_ICC_WORKERS
+and PGEN_ICC_NUMPY apply as they do in the builder.
+"""
+
+import argparse
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PAYLOAD_DIR = os.path.join(BENCH_DIR, "payloads")
+STUB_DIR = os.path.join(BENCH_DIR, "stubs")
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+from synthetic import builder  # noqa: E402
+import icc_companion_lut  # noqa: E402
+import icc_mft2  # noqa: E402
+import icc_parallel  # noqa: E402
+
+
+SCHEMA = 1
+HDR_WHITE_NITS = 600.0
+STUB_TOOLS = {"PGEN_COLPROF": "colprof", "PGEN_PROFCHECK": "profcheck",
+              "PGEN_TARGEN": "targen", "PGEN_APPLYCAL": "applycal"}
+
+
+def hdr_profile():
+    return synthetic.clut_profile(synthetic.SyntheticDisplay("hdr"), a2b_grid=17, b2a_grid=33)
+
+
+def identity_curves(entries=256):
+    return [[index / (entries - 1.0) for index in range(entries)] for unused in range(3)]
+
+
+def setup_reshape():
+    profile = hdr_profile()
+    return lambda: builder.reshape_hdr_b2a_for_pq(profile, HDR_WHITE_NITS, grid_size=65)
+
+
+def setup_reshape_calibrated():
+    profile = hdr_profile()
+    calibration = [[min(1.0, (index / 255.0) ** 1.02) for index in range(256)]
+                   for unused in range(3)]
+    return lambda: builder.reshape_hdr_b2a_for_pq(
+        profile, HDR_WHITE_NITS, calibration, grid_size=65)
+
+
+def setup_refine():
+    profile = hdr_profile()
+    reshaped = builder.reshape_hdr_b2a_for_pq(profile, HDR_WHITE_NITS, grid_size=65)
+    return lambda: builder.refine_hdr_b2a_from_forward_model(reshaped, profile, HDR_WHITE_NITS)
+
+
+def setup_refine_continuation():
+    profile = hdr_profile()
+    reshaped = builder.reshape_hdr_b2a_for_pq(profile, HDR_WHITE_NITS, grid_size=65)
+    return lambda: builder.refine_hdr_b2a_from_forward_model(
+        reshaped, profile, HDR_WHITE_NITS, continuation=True)
+
+
+def setup_calibration():
+    profile = hdr_profile()
+    rows = synthetic.hdr_calibration_rows()
+    fallback = identity_curves()
+    return lambda: builder.hdr_profile_calibration_from_a2b(profile, rows, fallback)
+
+
+def setup_rebuild():
+    # A 65-grid HDR profile is the largest the builder rewrites tag by tag.
+    profile = builder.reshape_hdr_b2a_for_pq(hdr_profile(), HDR_WHITE_NITS, grid_size=65)
+    replacements = {b"vcgt": builder.vcgt_tag(identity_curves()),
+                    b"lumi": builder.xyz_tag((0.0, HDR_WHITE_NITS, 0.0))}
+    return lambda: builder.rebuild_icc(profile, replacements)
+
+
+def setup_companion(signal_mode):
+    def setup():
+        directory = tempfile.mkdtemp()
+        profile_path = os.path.join(directory, "source.icc")
+        with open(profile_path, "wb") as handle:
+            handle.write(hdr_profile())
+        output_path = os.path.join(directory, "correction.pglt")
+        return lambda: icc_companion_lut.build(profile_path, "clut", signal_mode, output_path)
+    return setup
+
+
+def setup_cube(size):
+    def setup():
+        directory = tempfile.mkdtemp()
+        profile_path = os.path.join(directory, "source.icc")
+        with open(profile_path, "wb") as handle:
+            handle.write(hdr_profile())
+        output_path = os.path.join(directory, "correction.cube")
+        return lambda: icc_companion_lut.build_cube(profile_path, "clut", "hdr10", output_path, size)
+    return setup
+
+
+def setup_build(path):
+    def setup():
+        with io.open(path, "r", encoding="utf-8") as handle:
+            payload = json.load(handle)
+        os.environ["PGEN_BENCH_DISPLAY"] = (
+            "hdr" if str(payload.get("signal_mode", "")).lower() == "hdr10" else "sdr")
+        directory = tempfile.mkdtemp()
+
+        def run():
+            result = builder.build(payload, directory)
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+            return result
+        return run
+    return setup
+
+
+def benchmarks():
+    """Ordered (name, setup) pairs; setup returns the callable to time."""
+    entries = [
+        ("reshape_hdr_b2a_for_pq", setup_reshape),
+        ("reshape_hdr_b2a_for_pq[calibrated]", setup_reshape_calibrated),
+        ("refine_hdr_b2a_from_forward_model", setup_refine),
+        ("refine_hdr_b2a_from_forward_model[continuation]", setup_refine_continuation),
+        ("hdr_profile_calibration_from_a2b", setup_calibration),
+        ("rebuild_icc", setup_rebuild),
+        ("icc_companion_lut.build[sdr]", setup_companion("sdr")),
+        ("icc_companion_lut.build[hdr10]", setup_companion("hdr10")),
+        ("icc_companion_lut.build_cube[33]", setup_cube(33)),
+        ("icc_companion_lut.build_cube[65]", setup_cube(65)),
+        ("icc_companion_lut.build_cube[129]", setup_cube(129)),
+    ]
+    for path in sorted(glob.glob(os.path.join(PAYLOAD_DIR, "*.json"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        entries.append(("build[{}]".format(name), setup_build(path)))
+    return entries
+
+
+def stage_seconds(result):
+    """Per-stage seconds from a build result, summed over repeated stages."""
+    timing = result.get("validation", {}).get("timing") if isinstance(result, dict) else None
+    if not isinstance(timing, dict):
+        return None
+    stages = {}
+    for stage in timing.get("stages", []):
+        stages[stage["stage"]] = round(stages.get(stage["stage"], 0.0) + stage["seconds"], 3)
+    return stages
+
+
+def measure(setup, repeat):
+    """Run in the forked child: set up once, then time repeat calls."""
+    function = setup()
+    report = {"setup_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    seconds = []
+    result = None
+    for unused in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(round(time.perf_counter() - start, 4))
+    if isinstance(result, dict) and result.get("status") not in (None, "ok"):
+        raise ValueError(result.get("message") or "Build failed")
+    report["seconds"] = seconds
+    report["best_seconds"] = min(seconds)
+    report["median_seconds"] = sorted(seconds)[len(seconds) // 2]
+    stages = stage_seconds(result)
+    if stages is not None:
+        report["stages"] = stages
+    return report
+
+
+def run_forked(setup, repeat):
+    scratch = tempfile.mkdtemp(prefix="pgen_bench_")
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(reader)
+        # Everything the benchmark and the builder write goes here.
+        tempfile.tempdir = scratch
+        try:
+            report = measure(setup, repeat)
+        except BaseException as error:
+            report = {"error": "{}: {}".format(type(error).__name__, error),
+                      "traceback": traceback.format_exc()}
+        with os.fdopen(writer, "w") as handle:
+            json.dump(report, handle)
+        os._exit(0)
+    os.close(writer)
+    with os.fdopen(reader, "r") as handle:
+        text = handle.read()
+    _, status, usage = os.wait4(pid, 0)
+    shutil.rmtree(scratch, ignore_errors=True)
+    try:
+        report = json.loads(text)
+    except ValueError:
+        report = {"error": "Benchmark process exited with status {}".format(status)}
+    # Linux reports the larger of the child's own peak and that of the
+    # processes it waited for, so tool subprocesses are included.
+    report["peak_rss_kb"] = usage.ru_maxrss
+    return report
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "-C", BENCH_DIR, "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+        dirty = subprocess.call(
+            ["git", "-C", BENCH_DIR, "diff", "--quiet", "HEAD", "--", "..", ":!bench"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def use_stub_tools():
+    for variable, tool in STUB_TOOLS.items():
+        os.environ[variable] = os.path.join(STUB_DIR, tool)
+    # Never hand a benchmark build to a Patch Companion that happens to be
+    # registered on this machine.
+    os.environ["PGEN_ICC_NO_OFFLOAD"] = "1"
+    # Repeated builds must fit every time, not replay the first fit.
+    os.environ["PGEN_COLPROF_CACHE"] = "0"
+    os.environ.pop("PGEN_ICC_REQUIRE_OFFLOAD", None)
+
+
+def run(arguments):
+    use_stub_tools()
+    selected = [name for name in (arguments.only or "").split(",") if name]
+    report = {
+        "schema": SCHEMA,
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "workers": icc_parallel.worker_count(),
+        "numpy": icc_mft2.numpy_enabled(),
+        "repeat": arguments.repeat,
+        "benchmarks": {},
+    }
+    for name, setup in benchmarks():
+        if selected and not any(name == item or name.startswith(item + "[") for item in selected):
+            continue
+        result = run_forked(setup, arguments.repeat)
+        report["benchmarks"][name] = result
+        if "error" in result:
+            print("{:<44} ERROR {}".format(name, result["error"]), file=sys.stderr)
+        else:
+            print("{:<44} {:>9.3f} s {:>9} KB".format(
+                name, result["best_seconds"], result["peak_rss_kb"]), file=sys.stderr)
+    text = json.dumps(report, indent=1, sort_keys=True) + "\n"
+    if arguments.output:
+        with io.open(arguments.output, "w", encoding="utf-8") as handle:
+            handle.write(text)
+    else:
+        sys.stdout.write(text)
+    return 1 if any("error" in item for item in report["benchmarks"].values()) else 0
+
+
+def compare(old_path, new_path):
+    with io.open(old_path, "r", encoding="utf-8") as handle:
+        old = json.load(handle)
+    with io.open(new_path, "r", encoding="utf-8") as handle:
+        new = json.load(handle)
+    print("{} -> {}".format(old.get("commit"), new.get("commit")))
+    for key in ("python", "workers", "numpy", "cpu_count"):
+        if old.get(key) != new.get(key):
+            print("  note: {} differs ({} -> {})".format(key, old.get(key), new.get(key)))
+    print("{:<44} {:>10} {:>10} {:>8} {:>10} {:>10}".format(
+        "benchmark", "old s", "new s", "change", "old KB", "new KB"))
+    for name in list(old["benchmarks"]) + [name for name in new["benchmarks"] if name not in old["benchmarks"]]:
+        before = old["benchmarks"].get(name, {})
+        after = new["benchmarks"].get(name, {})
+        if "best_seconds" not in before or "best_seconds" not in after:
+            print("{:<44} {}".format(name, "missing or failed in one report"))
+            continue
+        change = ((after["best_seconds"] / before["best_seconds"] - 1.0) * 100.0
+                  if before["best_seconds"] > 0 else 0.0)
+        print("{:<44} {:>10.3f} {:>10.3f} {:>+7.1f}% {:>10} {:>10}".format(
+            name, before["best_seconds"], after["best_seconds"], change,
+            before["peak_rss_kb"], after["peak_rss_kb"]))
+    return 0
+
+
+def record():
+    if not os.path.isdir(PAYLOAD_DIR):
+        os.makedirs(PAYLOAD_DIR)
+    for scenario in sorted(synthetic.SCENARIOS):
+        path = os.path.join(PAYLOAD_DIR, scenario + ".json")
+        payload = synthetic.payload(scenario)
+        for row in payload["readings"]:
+            for axis in ("X", "Y", "Z"):
+                row[axis] = float("{:.7g}".format(row[axis]))
+        with io.open(path, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, indent=None, separators=(",", ":"), sort_keys=True)
+            handle.write("\n")
+        print(path)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ICC builder hot paths.")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per benchmark")
+    parser.add_argument("--only", help="comma-separated benchmark names to run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports")
+    parser.add_argument("--record", action="store_true",
+                        help="rewrite the synthetic payloads in bench/payloads")
+    arguments = parser.parse_args()
+    if arguments.compare:
+        return compare(*arguments.compare)
+    if arguments.record:
+        return record()
+    if arguments.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    return run(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Synthetic displays, measurements and ICC profiles for the ICC benchmarks.
+
+A SyntheticDisplay is a deterministic RGB-to-XYZ model: an SDR gamma 2.2
+sRGB panel, or a P3 HDR panel that follows PQ up to its white and rolls off
+into it, with a small loading non-additivity so cLUT stages have real
+chromatic work to do. readings() measures it the way a WebUI series does and
+payload() wraps the readings in a build request. clut_profile() and
+matrix_profile() write the profile colprof would fit from those readings;
+the stub tools in bench/stubs serve them to the builder.
+"""
+
+import math
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "usr", "bin"))
+
+import icc_profile_builder as builder  # noqa: E402
+from icc_mft2 import XYZ_TO_MFT  # noqa: E402
+
+
+D50 = (0.9642, 1.0, 0.8249)
+# Bradford D65 -> D50, as colprof writes into chad.
+BRADFORD_D65_TO_D50 = (
+    (1.0478112, 0.0228866, -0.0501270),
+    (0.0295424, 0.9904844, -0.0170491),
+    (-0.0092345, 0.0150436, 0.7521316),
+)
+SRGB_TO_XYZ = ((0.4124, 0.3576, 0.1805), (0.2126, 0.7152, 0.0722),
+               (0.0193, 0.1192, 0.9505))
+P3_TO_XYZ = ((0.48657, 0.26567, 0.19822), (0.22897, 0.69174, 0.07929),
+             (0.0, 0.04511, 1.04394))
+
+SCENARIOS = {
+    "sdr-matrix": {"display": "sdr", "profile_type": "sdr",
+                   "profile_model": "matrix", "quality": "medium",
+                   "patches": 95},
+    "sdr-clut": {"display": "sdr", "profile_type": "sdr",
+                 "profile_model": "clut", "quality": "medium",
+                 "patches": 425},
+    "kde-hdr": {"display": "hdr", "profile_type": "kde-hdr",
+                "profile_model": "clut", "quality": "medium",
+                "calibration_mode": "vcgt", "patches": 425},
+    "windows-hdr": {"display": "hdr", "profile_type": "windows-hdr",
+                    "profile_model": "clut", "quality": "medium",
+                    "calibration_mode": "profile", "patches": 425},
+}
+
+
+class SyntheticDisplay:
+    """Deterministic RGB (0..1) to absolute XYZ (cd/m2) display model."""
+
+    def __init__(self, kind, white_nits=None, black_nits=None):
+        if kind not in ("sdr", "hdr"):
+            raise ValueError("Unknown synthetic display kind")
+        self.kind = kind
+        self.white_nits = white_nits or (600.0 if kind == "hdr" else 120.0)
+        self.black_nits = black_nits if black_nits is not None else (
+            0.0005 if kind == "hdr" else 0.08)
+        self.matrix = P3_TO_XYZ if kind == "hdr" else SRGB_TO_XYZ
+        self.input_max = 1023 if kind == "hdr" else 255
+
+    def channel_linear(self, value):
+        """Relative linear light of one channel, 1.0 at display white."""
+        value = max(0.0, min(1.0, value))
+        if self.kind == "sdr":
+            return value ** 2.2
+        relative = builder.pq_to_nits(value) / self.white_nits
+        if relative <= 0.75:
+            return relative
+        # Soft shoulder from 75% of white into a hard plateau.
+        excess = relative - 0.75
+        return 0.75 + 0.25 * (1.0 - math.exp(-excess / 0.25))
+
+    def loading(self, linear):
+        if self.kind == "sdr":
+            return 1.0
+        return 1.0 - 0.06 * (sum(linear) / 3.0) ** 2 - 0.02 * linear[0] * linear[2]
+
+    def relative_xyz(self, rgb):
+        """D65-relative XYZ with display white at Y = 1, without black."""
+        linear = [self.channel_linear(value) for value in rgb]
+        scale = self.loading(linear)
+        return [value * scale for value in builder.mat_vec_mul(self.matrix, linear)]
+
+    def xyz(self, rgb):
+        black = [value * self.black_nits for value in builder.mat_vec_mul(self.matrix, (1.0, 1.0, 1.0))]
+        return [black[axis] + value * self.white_nits
+                for axis, value in enumerate(self.relative_xyz(rgb))]
+
+    def pcs(self, rgb):
+        """D50-adapted relative PCS XYZ, as an A2B table stores it."""
+        return builder.mat_vec_mul(BRADFORD_D65_TO_D50, self.relative_xyz(rgb))
+
+
+def readings(display, count, seed=1, metadata_white=False):
+    """Measure a WebUI-style characterization set of about count patches."""
+    maximum = display.input_max
+    rnd = random.Random(seed)
+    rows = []
+
+    def add(rgb, name):
+        codes = [int(round(max(0.0, min(1.0, value)) * maximum)) for value in rgb]
+        xyz = display.xyz([code / float(maximum) for code in codes])
+        rows.append({"name": name, "r_code": codes[0], "g_code": codes[1],
+                     "b_code": codes[2], "input_max": maximum,
+                     "X": xyz[0], "Y": xyz[1], "Z": xyz[2]})
+
+    for unused in range(4):
+        add((1.0, 1.0, 1.0), "ICC White")
+        add((0.0, 0.0, 0.0), "ICC Black")
+    grey_steps = 65 if display.kind == "hdr" else 33
+    for step in range(1, grey_steps - 1):
+        level = step / (grey_steps - 1.0)
+        add((level, level, level), "ICC Grey {}".format(int(round(level * 100))))
+    for channel, label in enumerate(("Red", "Green", "Blue")):
+        for step in range(1, 17):
+            rgb = [0.0, 0.0, 0.0]
+            rgb[channel] = step / 16.0
+            add(rgb, "ICC {} {}".format(label, int(round(step * 100 / 16.0))))
+    index = 1
+    while len(rows) < count:
+        add([rnd.random() for unused in range(3)], "ICC Optimized {}".format(index))
+        index += 1
+    if metadata_white:
+        add((1.0, 1.0, 1.0), "ICC HDR Metadata White")
+    return rows
+
+
+def payload(scenario, name=None):
+    """A complete build request for one of SCENARIOS."""
+    settings = SCENARIOS[scenario]
+    display = SyntheticDisplay(settings["display"])
+    request = {
+        "name": name or "Bench {}".format(scenario),
+        "profile_type": settings["profile_type"],
+        "profile_model": settings["profile_model"],
+        "quality": settings["quality"],
+        "signal_mode": "hdr10" if display.kind == "hdr" else "sdr",
+        "code_min": 0,
+        "code_max": display.input_max,
+        "readings": readings(
+            display, settings["patches"],
+            metadata_white=settings["profile_type"] == "windows-hdr"),
+    }
+    if "calibration_mode" in settings:
+        request["calibration_mode"] = settings["calibration_mode"]
+    return request
+
+
+def quantize(value):
+    return max(0, min(65535, int(round(value * 65535.0))))
+
+
+def mft2_tag(in_tables, grid, clut_function, out_tables):
+    data = bytearray(b"mft2\0\0\0\0")
+    data.extend(bytes((3, 3, grid, 0)))
+    data.extend(struct.pack(">9i", 65536, 0, 0, 0, 65536, 0, 0, 0, 65536))
+    data.extend(struct.pack(">HH", len(in_tables[0]), len(out_tables[0])))
+    for table in in_tables:
+        data.extend(struct.pack(">{}H".format(len(table)), *[quantize(v) for v in table]))
+    denominator = float(grid - 1)
+    for red in range(grid):
+        for green in range(grid):
+            for blue in range(grid):
+                data.extend(struct.pack(">3H", *[quantize(v) for v in clut_function(
+                    red / denominator, green / denominator, blue / denominator)]))
+    for table in out_tables:
+        data.extend(struct.pack(">{}H".format(len(table)), *[quantize(v) for v in table]))
+    return bytes(data)
+
+
+def curve_tag(table):
+    return (b"curv\0\0\0\0" + struct.pack(">I", len(table))
+            + struct.pack(">{}H".format(len(table)), *[quantize(v) for v in table]))
+
+
+def description_tag(text):
+    text = text.encode("ascii", "replace") + b"\0"
+    return (b"desc\0\0\0\0" + struct.pack(">I", len(text)) + text
+            + struct.pack(">IIHB", 0, 0, 0, 0) + b"\0" * 67)
+
+
+def header(version):
+    data = bytearray(128)
+    data[4:8] = b"argl"
+    data[8:12] = b"\x04\x40\0\0" if version == "4.4" else b"\x02\x20\0\0"
+    data[12:16] = b"mntr"
+    data[16:20] = b"RGB "
+    data[20:24] = b"XYZ "
+    data[36:40] = b"acsp"
+    data[68:80] = struct.pack(">3i", *[int(round(v * 65536)) for v in D50])
+    data[80:84] = b"argl"
+    return bytes(data) + b"\0\0\0\0"
+
+
+def inverse_table(function, entries):
+    """Invert a monotonic 0..1 channel response into a device table."""
+    table = []
+    for index in range(entries):
+        target = index / (entries - 1.0)
+        low, high = 0.0, 1.0
+        for unused in range(40):
+            middle = (low + high) / 2.0
+            if function(middle) < target:
+                low = middle
+            else:
+                high = middle
+        table.append((low + high) / 2.0)
+    return table
+
+
+def common_tags(display, description, white_nits):
+    pcs_matrix = builder.mat_mul(BRADFORD_D65_TO_D50, display.matrix)
+    entries = 1024
+    ramp = [index / (entries - 1.0) for index in range(entries)]
+    trc = curve_tag([display.channel_linear(value) for value in ramp])
+    tags = {
+        b"desc": description_tag(description),
+        b"cprt": b"text\0\0\0\0Created by the PGenerator+ benchmark stub\0",
+        b"wtpt": builder.xyz_tag(D50),
+        b"lumi": builder.xyz_tag((0.0, white_nits, 0.0)),
+        b"chad": b"sf32\0\0\0\0" + b"".join(
+            struct.pack(">i", int(round(value * 65536)))
+            for row in BRADFORD_D65_TO_D50 for value in row),
+        b"rXYZ": builder.xyz_tag([pcs_matrix[row][0] for row in range(3)]),
+        b"gXYZ": builder.xyz_tag([pcs_matrix[row][1] for row in range(3)]),
+        b"bXYZ": builder.xyz_tag([pcs_matrix[row][2] for row in range(3)]),
+        b"rTRC": trc,
+        b"gTRC": trc,
+        b"bTRC": trc,
+    }
+    return tags
+
+
+def matrix_profile(display, description="Synthetic matrix display",
+                   white_nits=None, version="2.2"):
+    tags = common_tags(display, description, white_nits or display.white_nits)
+    return builder.rebuild_icc(header(version), tags)
+
+
+def clut_profile(display, description="Synthetic cLUT display", white_nits=None,
+                 version="2.2", a2b_grid=17, b2a_grid=17, entries=1024):
+    """A colprof-like XYZ cLUT profile with matrix fallback tags."""
+    tags = common_tags(display, description, white_nits or display.white_nits)
+    ramp = [index / (entries - 1.0) for index in range(entries)]
+    linear_tables = [[display.channel_linear(value) for value in ramp]] * 3
+
+    def a2b_node(red, green, blue):
+        # The input tables already linearize each channel; the cLUT applies
+        # the primaries and the loading non-additivity in linear light.
+        linear = (red, green, blue)
+        xyz = builder.mat_vec_mul(BRADFORD_D65_TO_D50, builder.mat_vec_mul(display.matrix, linear))
+        scale = display.loading(linear)
+        return [max(0.0, value * scale) * XYZ_TO_MFT for value in xyz]
+
+    a2b = mft2_tag(linear_tables, a2b_grid, a2b_node, [ramp] * 3)
+    pcs_to_linear = builder.mat_inv(builder.mat_mul(BRADFORD_D65_TO_D50, display.matrix))
+
+    def b2a_node(x, y, z):
+        linear = builder.mat_vec_mul(pcs_to_linear, [x / XYZ_TO_MFT, y / XYZ_TO_MFT, z / XYZ_TO_MFT])
+        return [max(0.0, min(1.0, value)) for value in linear]
+
+    device_tables = [inverse_table(display.channel_linear, entries)] * 3
+    b2a = mft2_tag([ramp] * 3, b2a_grid, b2a_node, device_tables)
+    tags.update({b"A2B0": a2b, b"A2B1": a2b, b"B2A0": b2a, b"B2A1": b2a, b"B2A2": b2a})
+    return builder.rebuild_icc(header(version), tags)
+
+
+def hdr_calibration_rows(display=None):
+    """Normalized builder rows for hdr_profile_calibration_from_a2b."""
+    display = display or SyntheticDisplay("hdr")
+    request = {"code_max": display.input_max,
+               "readings": readings(display, 425)}
+    return builder.normalize_measurements(request)
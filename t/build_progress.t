@@ -0,0 +1,89 @@
+use strict;
+use warnings;
+use Test::More;
+use FindBin qw($Bin);
+use File::Temp qw(tempdir);
+
+# The builder streams Argyll's output while the tool runs and appends NDJSON
+# progress events to a status file, which /api/icc/progress answers from. A
+# stand-in targen prints Argyll-style "\r NN%" progress before writing its
+# chart.
+
+my $bin="$Bin/../usr/bin";
+plan skip_all=>'python3 is not available' if(system("python3 -c 1 >/dev/null 2>&1")!=0);
+
+$ENV{PYTHONDONTWRITEBYTECODE}=1;
+$ENV{PGEN_ICC_NO_OFFLOAD}=1;
+
+my $root=tempdir(CLEANUP=>1);
+my $progress="$root/progress.ndjson";
+$ENV{PGEN_ICC_PROGRESS}=$progress;
+$ENV{PGEN_TARGEN}="$root/targen";
+
+sub write_file {
+ my ($path,$content)=@_;
+ open(my $fh,">",$path) or die "Unable to write $path: $!";
+ print $fh $content;
+ close($fh);
+}
+
+sub read_file {
+ my ($path)=@_;
+ open(my $fh,"<",$path) or return "";
+ local $/;
+ my $data=<$fh>;
+ close($fh);
+ return $data;
+}
+
+write_file("$root/targen",<<'SH');
+#!/bin/sh
+[ $# -gt 0 ] || { echo 'Argyll targen Version 3.3.0'; exit 0; }
+for arg; do base=$arg; done
+echo 'Placing points'
+sleep 1.2; printf '\r 10%%'; sleep 1.2; printf '\r 60%%'; sleep 1.2; printf '\r100%%\n'
+if [ -n "$PGEN_TEST_TARGEN_FAIL" ]; then echo 'targen: Error - out of memory'; exit 1; fi
+cat > "$base.ti1" <<'TI1'
+CTI1
+
+BEGIN_DATA_FORMAT
+SAMPLE_ID RGB_R RGB_G RGB_B
+END_DATA_FORMAT
+BEGIN_DATA
+1 100 100 100
+2 0 0 0
+3 50 20 10
+END_DATA
+TI1
+SH
+chmod(0755,"$root/targen");
+
+write_file("$root/patches.json",'{"profile_type":"sdr","patch_count":64,"white_patches":1,"black_patches":1,"single_channel_steps":0,"gray_steps":8}');
+my $result=`python3 "$bin/icc_profile_builder.py" --patches "$root/patches.json" "$root"`;
+like($result,qr/"status":"ok".*"count":3/,'patches still come from the streamed targen run');
+
+my @events=map { eval { require JSON::PP; JSON::PP::decode_json($_) } || {} } grep { /\S/ } split(/\n/,read_file($progress));
+is($events[0]{stage},'start','the build opens the progress file with a start event');
+is($events[0]{operation},'patches','and names the operation');
+my @percents=map { $_->{percent} } grep { ($_->{stage}||"") eq 'targen' && defined($_->{percent}) } @events;
+ok(scalar(grep { $_==10 } @percents) && scalar(grep { $_==60 } @percents),'Argyll percentages are published while targen runs')
+ or diag(read_file($progress));
+is($events[-1]{stage},'finished','the last event ends the build');
+is($events[-1]{status},'ok','with its outcome');
+is(scalar(keys(%{{map { ($_->{build}||"")=>1 } @events}})),1,'every event names the same build');
+
+{
+ local $ENV{PGEN_TEST_TARGEN_FAIL}=1;
+ $result=`python3 "$bin/icc_profile_builder.py" --patches "$root/patches.json" "$root"`;
+ like($result,qr/patch generation failed: targen: Error - out of memory/,'the last line of streamed output still explains a failure');
+ like((split(/\n/,read_file($progress)))[-1],qr/"stage":"finished","status":"error"/,'and the progress file records it');
+}
+
+our $_icc_build_progress_file=$progress;
+require "$Bin/../usr/share/PGenerator/PGICCProfile.pm";
+write_file($progress,'{"stage":"start"}'."\n".'{"percent":42.0,"stage":"colprof"}'."\n".'{"stage":"col');
+is(&webui_icc_build_progress(),'{"status":"ok","progress":{"percent":42.0,"stage":"colprof"}}','the endpoint answers the newest complete event');
+$_icc_build_progress_file="$root/missing";
+is(&webui_icc_build_progress(),'{"status":"idle"}','and reports idle without a progress file');
+
+done_testing();
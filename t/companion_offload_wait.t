@@ -0,0 +1,319 @@
+use strict;
+use warnings;
+use Test::More;
+use FindBin qw($Bin);
+use File::Temp qw(tempdir);
+use Time::HiRes qw(time sleep);
+use Digest::SHA qw(sha256_hex);
+
+# The builder's Companion offload queues a job in its own directory under
+# jobs/ and waits for the WebUI to rename result.icc or error.txt into it. A
+# forked stand-in plays the WebUI and Companion side of that handshake: it
+# claims each queued job, answers it and clears the job files the way
+# webui_icc_companion_build_result does.
+
+my $bin="$Bin/../usr/bin";
+plan skip_all=>'python3 is not available' if(system("python3 -c 1 >/dev/null 2>&1")!=0);
+
+$ENV{PYTHONDONTWRITEBYTECODE}=1;
+delete $ENV{PGEN_ICC_NO_OFFLOAD};
+delete $ENV{PGEN_ICC_NO_INOTIFY};
+
+my $revision=`python3 "$bin/icc_stage_job.py" --revision`;
+chomp($revision);
+
+our ($_icc_companion_build_jobs,$_icc_companion_build_queue,$_icc_companion_build_offered);
+require "$Bin/../usr/share/PGenerator/PGICCProfile.pm";
+
+my $driver=<<'PY';
+import os, sys, time
+sys.path.insert(0, sys.argv[1])
+import icc_profile_builder as builder
+from icc_dirwatch import DirectoryWatch
+build_dir, operation, output = sys.argv[2:5]
+builder.COMPANION_BUILD_DIR = build_dir
+# Shorter than the seven seconds a "running" stand-in keeps a job alive.
+builder.COMPANION_STAGE_IDLE_SECONDS = 3
+with DirectoryWatch(build_dir, 1) as watch:
+    active = watch.active
+try:
+    if operation == "stage":
+        # Stands in for the stage itself, so a local run is recognisable.
+        builder.local_python_stage = lambda stage, arguments: "local"
+        ok = builder.python_stage("reshape", profile=b"ICC", white_y=1.0)
+    elif operation == "colprof":
+        ok = builder.companion_build_offload(
+            "CTI3\n", [os.environ["PGEN_COLPROF"], "-qh", "-O", output, output[:-4]], output, 30)
+    else:
+        ok = builder.companion_targen_offload(["targen", "-v", output[:-4]], output, 30)
+    outcome = ok if operation == "stage" else "ok" if ok else "local"
+except ValueError as error:
+    outcome = "error: {}".format(error)
+print("{}\t{:.6f}\t{}".format(outcome, time.time(), int(active)))
+PY
+
+sub write_atomic {
+ my ($path,$content)=@_;
+ open(my $fh,">",$path.".tmp") or die "Unable to write $path: $!";
+ binmode($fh);
+ print $fh $content;
+ close($fh);
+ rename($path.".tmp",$path) or die "Unable to rename $path: $!";
+}
+
+sub read_file {
+ my ($path)=@_;
+ open(my $fh,"<",$path) or return "";
+ binmode($fh);
+ local $/;
+ my $data=<$fh>;
+ close($fh);
+ return $data;
+}
+
+# Stand-in Companion: claim and answer $count queued jobs, every claimed job
+# running at once. $answer may hold "%s", which is replaced by the job id.
+# "running" keeps polling for seven seconds, listing its jobs the way a
+# Companion with build threads does, before it answers.
+sub companion {
+ my ($root,$dir,$count,$reply,$answer)=@_;
+ my $give_up=time()+10;
+ my %claimed=();
+ while(keys(%claimed)<$count && time()<$give_up) {
+  my $queue=read_file("$dir/queue.json");
+  while($queue=~/"job"\s*:\s*"([0-9]+-[0-9]+)"/g) {
+   my $id=$1;
+   next if($claimed{$id} || !-f "$dir/jobs/$id/job.json");
+   $claimed{$id}=1;
+   sleep(0.2);
+   write_atomic("$dir/jobs/$id/claim.json",'{"job":"'.$id.'","seen":'.int(time()).'}');
+  }
+  sleep(0.02);
+ }
+ sleep(0.5);
+ if($reply=~/running/) {
+  $_icc_companion_build_jobs="$dir/jobs";
+  for (1..28) { &webui_icc_companion_build_running(join(",",sort(keys(%claimed)))); sleep(0.25); }
+ }
+ # "stall" claims the jobs and then never answers.
+ %claimed=() if($reply eq "stall");
+ for my $id (sort(keys(%claimed))) {
+  my $text=$answer;
+  $text=~s/%s/$id/g;
+  if($reply=~/^stage/) {
+   # A result document answering the job document in job.input; "stage-forged"
+   # answers some other job.
+   my ($revision)=(read_file("$dir/jobs/$id/job.json")=~/"revision":"([0-9a-f]{64})"/);
+   my $job_sha=($reply ne "stage-forged") ? sha256_hex(read_file("$dir/jobs/$id/job.input")) : "0" x 64;
+   $text='{"format":1,"job_sha256":"'.$job_sha.'","output":"'.$answer.'","output_sha256":"'.sha256_hex('"'.$answer.'"').'","revision":"'.($revision||"").'"}';
+  }
+  write_atomic("$dir/jobs/$id/".($reply eq "error" ? "error.txt" : "result.icc"),$text);
+  unlink("$dir/jobs/$id/job.json","$dir/jobs/$id/job.ti3","$dir/jobs/$id/job.input","$dir/jobs/$id/claim.json");
+ }
+ write_atomic("$root/answered",sprintf("%.6f",time()));
+}
+
+# Run $count concurrent offloads against a stand-in that answers $jobs of them
+# (all by default) with $reply: "result", "error", "stall", "running", or for
+# a Python stage "stage", "stage-running" or "stage-forged". Returns the first
+# builder's outcome, its pickup latency after the answers were written,
+# whether inotify was in use, its output file contents, what was left in the
+# build directory, and the outcomes and outputs of every builder.
+sub offload {
+ my ($operation,$reply,$answer,$count,$jobs)=@_;
+ $count||=1;
+ $jobs=$count unless(defined($jobs));
+ my $root=tempdir(CLEANUP=>1);
+ my $dir="$root/build";
+ mkdir($dir) or die "mkdir $dir: $!";
+ # A fit run here, in the race, takes PGEN_TEST_COLPROF_SECONDS, writes
+ # "local profile" to its -O output and touches PGEN_TEST_COLPROF_DONE.
+ for my $tool ("colprof","targen") {
+  write_atomic("$root/$tool","#!/bin/sh\necho 'Argyll $tool Version 3.3.0'\n"
+   ."[ \$# -gt 0 ] || exit 0\nsleep \${PGEN_TEST_COLPROF_SECONDS:-0}\n"
+   ."[ -z \"\$PGEN_TEST_COLPROF_DONE\" ] || : > \"\$PGEN_TEST_COLPROF_DONE\"\n"
+   ."while [ \$# -gt 0 ]; do [ \"\$1\" = -O ] && printf 'local profile' > \"\$2\"; shift; done\n");
+  chmod(0755,"$root/$tool");
+ }
+ local $ENV{PGEN_COLPROF}="$root/colprof";
+ local $ENV{PGEN_TARGEN}="$root/targen";
+ write_atomic("$dir/companion.json",'{"connected":true,"argyll_version":"3.3.0","targen":true,"stages":"'.$revision.'","seen":'.int(time()).'}');
+ my $pid=fork();
+ die "fork: $!" unless(defined($pid));
+ if($pid==0) {
+  companion($root,$dir,$jobs,$reply,$answer);
+  POSIX::_exit(0);
+ }
+ my (@handles,@outputs);
+ for my $index (1..$count) {
+  my $output="$root/out$index.".($operation eq "colprof" ? "icc" : "ti1");
+  open(my $ph,"-|","python3","-c",$driver,$bin,$dir,$operation,$output) or die "python3: $!";
+  push(@handles,$ph);
+  push(@outputs,$output);
+ }
+ my @lines=map { my $ph=$_; my $line=<$ph>; close($ph); chomp($line) if(defined($line)); $line||"" } @handles;
+ waitpid($pid,0);
+ my ($outcome,$finished,$active)=split(/\t/,$lines[0]);
+ my $answered=read_file("$root/answered");
+ my $latency=($answered ne "" && defined($finished)) ? $finished-$answered : undef;
+ my @left=();
+ if(opendir(my $dh,"$dir/jobs")) {
+  @left=grep { !/^\./ } readdir($dh);
+  closedir($dh);
+ }
+ push(@left,"queue.json") if(read_file("$dir/queue.json")=~/"job"/);
+ return ($outcome||"",$latency,$active,read_file($outputs[0]),\@left,
+         [map { (split(/\t/,$_))[0]||"" } @lines],[map { read_file($_) } @outputs]);
+}
+
+require POSIX;
+require File::Path;
+
+my $profile=pack("N",160)."\0" x 32 ."acsp"."\0" x 120;
+my ($outcome,$latency,$active,$output,$left)=offload("colprof","result",$profile);
+is($outcome,'ok','a claimed colprof job returns the Companion profile');
+is($output,$profile,'the profile is copied byte for byte');
+is_deeply($left,[],'no job directory or queue entry is left behind');
+SKIP: {
+ skip 'inotify is unavailable here',1 unless($active);
+ cmp_ok($latency,'<',1.0,'the result is picked up without waiting for a poll tick');
+}
+
+my $chart="CTI1\n\nBEGIN_DATA_FORMAT\nSAMPLE_ID RGB_R RGB_G RGB_B\nEND_DATA_FORMAT\nBEGIN_DATA\nEND_DATA\n";
+($outcome,$latency,$active,$output)=offload("targen","result",$chart);
+is($outcome,'ok','a claimed targen job returns the Companion chart');
+is($output,$chart,'the chart is copied byte for byte');
+
+($outcome)=offload("targen","error","targen: no memory");
+is($outcome,'error: Patch Companion chart generation failed: targen: no memory','a Companion targen error is reported, not retried locally');
+
+($outcome)=offload("colprof","error","colprof failed");
+is($outcome,'local','a Companion colprof error falls back to the local fit');
+
+my ($outcomes,$outputs);
+($outcome,$latency,$active,$output,$left,$outcomes,$outputs)=offload("colprof","result",$profile."%s",2);
+is_deeply($outcomes,['ok','ok'],'two builders queue colprof jobs side by side');
+isnt($outputs->[0],$outputs->[1],'each builder collects the answer to its own job');
+is_deeply($left,[],'both job directories are removed');
+
+{
+ my $root=tempdir(CLEANUP=>1);
+ my $orphan="$root/jobs/1-999999999";
+ mkdir("$root/jobs") or die "mkdir: $!";
+ mkdir($orphan) or die "mkdir: $!";
+ write_atomic("$orphan/job.json",'{"job":"1-999999999","operation":"colprof"}');
+ write_atomic("$root/queue.json",'{"jobs":[{"job":"1-999999999","operation":"colprof"}]}');
+ system("python3","-c","import sys; sys.path.insert(0, sys.argv[1]); import icc_profile_builder as b; b.COMPANION_BUILD_DIR = sys.argv[2]\nwith b.companion_queue() as queue: pass",$bin,$root);
+ ok(!-e $orphan,'a job whose builder has exited is removed');
+ unlike(read_file("$root/queue.json"),qr/1-999999999/,'and leaves the queue');
+}
+
+{
+ # The id names this test's own, running, pid, as a reused one would; no
+ # builder holds the job's lock.
+ my $root=tempdir(CLEANUP=>1);
+ my $orphan="$root/jobs/1-$$";
+ File::Path::make_path($orphan);
+ write_atomic("$orphan/owner.lock","");
+ write_atomic("$orphan/job.json",'{"job":"1-'.$$.'","operation":"colprof"}');
+ write_atomic("$root/queue.json",'{"jobs":[{"job":"1-'.$$.'","operation":"colprof"}]}');
+ system("python3","-c","import sys; sys.path.insert(0, sys.argv[1]); import icc_profile_builder as b; b.COMPANION_BUILD_DIR = sys.argv[2]\nwith b.companion_queue() as queue: pass",$bin,$root);
+ ok(!-e $orphan,'a job whose lock nobody holds is removed though its pid is running');
+}
+
+{
+ local $ENV{PGEN_ICC_OFFLOAD_RACE}=1;
+ my $started=time();
+ ($outcome,$latency,$active,$output,$left)=offload("colprof","stall","");
+ is($outcome,'ok','a stalled Companion loses the race to a local fit');
+ is($output,'local profile','the local fit is used');
+ cmp_ok(time()-$started,'<',10,'without waiting out the Companion deadline');
+ is_deeply($left,[],'the abandoned Companion job is withdrawn');
+
+ local $ENV{PGEN_ICC_OFFLOAD_RACE}=3;
+ ($outcome,$latency,$active,$output)=offload("colprof","running",$profile);
+ is($output,$profile,'a Companion that keeps reporting its fit running is not raced');
+
+ my $root=tempdir(CLEANUP=>1);
+ my $job="$root/jobs/1-100";
+ File::Path::make_path($job);
+ write_atomic("$job/claim.json",'{"job":"1-100"}');
+ write_atomic("$job/progress","");
+ utime(time()-10,time()-10,"$job/progress");
+ $_icc_companion_build_jobs="$root/jobs";
+ open(my $wh,"-|","python3","-c","import sys, time; sys.path.insert(0, sys.argv[1]); from icc_dirwatch import DirectoryWatch\nwith DirectoryWatch(sys.argv[2], 3) as watch:\n    print(int(watch.active), flush=True); started = time.time(); watch.wait(3); print('%.2f' % (time.time() - started))",$bin,$job) or die "python3: $!";
+ my $watching=<$wh>;
+ sleep(0.5);
+ &webui_icc_companion_build_running("1-100");
+ my $age=time()-(stat("$job/progress"))[9];
+ my $waited=<$wh>;
+ close($wh);
+ cmp_ok($age,'<',2,'the poll refreshes the progress of a job it lists');
+ SKIP: {
+  skip 'inotify is unavailable here',1 unless($watching=~/1/);
+  cmp_ok($waited,'>=',2.9,'without waking the builder watching the job');
+ }
+
+ local $ENV{PGEN_ICC_OFFLOAD_RACE}=0.1;
+ local $ENV{PGEN_TEST_COLPROF_SECONDS}=3;
+ local $ENV{PGEN_TEST_COLPROF_DONE}=tempdir(CLEANUP=>1)."/done";
+ ($outcome,$latency,$active,$output)=offload("colprof","result",$profile);
+ is($outcome,'ok','a Companion that answers first wins the race');
+ is($output,$profile,'its profile is used');
+ sleep(3.5);
+ ok(!-e $ENV{PGEN_TEST_COLPROF_DONE},'and the local fit is killed, not left running');
+}
+
+($outcome,$latency,$active,$output,$left)=offload("stage","stage","companion");
+is($outcome,'companion','a Python stage runs on a Companion with the same stage revision');
+is_deeply($left,[],'the stage job is removed');
+
+($outcome)=offload("stage","stage-forged","companion");
+is($outcome,'local','a stage result answering another job is rejected and the stage runs here');
+
+($outcome)=offload("stage","stage-running","companion");
+is($outcome,'companion','a stage kept alive only by the Companion listing it outlasts the idle window');
+
+{
+ my $started=time();
+ ($outcome,$latency,$active,$output,$left)=offload("stage","stall","companion");
+ is($outcome,'local','a stage the Companion claims and then stalls on runs here');
+ cmp_ok(time()-$started,'<',10,'once the job shows no progress, not at the stage timeout');
+ is_deeply($left,[],'and the stalled stage job is withdrawn');
+}
+
+{
+ my $local_revision=$revision;
+ $revision="0" x 64;
+ ($outcome,$latency,$active,$output,$left)=offload("stage","stage","companion",1,0);
+ $revision=$local_revision;
+ is($outcome,'local','a different stage revision is never offered the job');
+ is_deeply($left,[],'and no job is queued for it');
+}
+
+{
+ local $ENV{PGEN_ICC_NO_INOTIFY}=1;
+ ($outcome,$latency,$active,$output)=offload("targen","result",$chart);
+ is($active,0,'PGEN_ICC_NO_INOTIFY=1 turns the watch off');
+ is($outcome,'ok','the polling fallback still collects the result');
+ is($output,$chart,'the polling fallback copies the chart');
+}
+
+{
+ my $root=tempdir(CLEANUP=>1);
+ ($_icc_companion_build_jobs,$_icc_companion_build_queue,$_icc_companion_build_offered)=
+  ("$root/jobs","$root/queue.json","$root/offered.json");
+ mkdir("$root/jobs") or die "mkdir: $!";
+ for my $job ("1-100","2-200") {
+  mkdir("$root/jobs/$job") or die "mkdir: $!";
+  write_atomic("$root/jobs/$job/job.json",'{"job":"'.$job.'"}');
+ }
+ write_atomic("$root/queue.json",'{"jobs":[{"job":"1-100"},{"job":"2-200"}]}');
+ is(&webui_icc_companion_build_job_dir("job=2-200"),"$root/jobs/2-200",'a request naming its job goes to that job');
+ is(&webui_icc_companion_build_job_dir("status=ok"),"",'an id-less request is refused while two jobs are queued');
+ write_atomic("$root/offered.json",'{"job":"2-200"}');
+ write_atomic("$root/queue.json",'{"jobs":[{"job":"1-100"}]}');
+ is(&webui_icc_companion_build_job_dir("status=ok"),"$root/jobs/2-200",'and goes to the job it was offered, not the queue head');
+}
+
+done_testing();
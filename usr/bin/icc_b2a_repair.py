@@ -15,13 +15,22 @@ rebuilds that region from the profile's embedded characterization rows:
    display can sustain at the correct white, and requests beyond it are the
    display's own tone mapping to perform.
 
+The builder calls repair_profile() on profile bytes in process; the command
+line below is a thin wrapper that reads its options from the environment.
+
 Usage: icc_b2a_repair.py input.icc output.icc [measurements.ti3]
 Without a TI3 argument the embedded targ tag is used.
 """
-import struct, sys
+import os, struct, sys, time
+from array import array
+from icc_curves import PiecewiseLinearCurve
 
 def read_profile(path):
-    d = bytearray(open(path, 'rb').read())
+    with open(path, 'rb') as handle:
+        return parse_profile(handle.read())
+
+def parse_profile(data):
+    d = bytearray(data)
     count = struct.unpack('>I', d[128:132])[0]
     tags = {}
     for i in range(count):
@@ -29,6 +38,29 @@ def read_profile(path):
         tags[sig.decode('latin1')] = (off, size)
     return d, tags
 
+def read_u16_table(d, offset, count):
+    """count big-endian uint16 entries at offset, decoded once into array('H')."""
+    table = array('H', bytes(d[offset:offset+count*2]))
+    if sys.byteorder == 'little':
+        table.byteswap()
+    return table
+
+def write_u16_table(d, offset, table):
+    """Store a table decoded by read_u16_table() back at offset."""
+    if sys.byteorder == 'little':
+        table = array('H', table)
+        table.byteswap()
+    d[offset:offset+len(table)*2] = table.tobytes()
+
+def lut16_tables(d, offset):
+    """(grid, input curves, cLUT, output curves, cLUT offset) of a 3-channel lut16Type."""
+    grid = d[offset+10]; ine, oute = struct.unpack('>HH', bytes(d[offset+48:offset+52]))
+    inoff = offset+52; clutoff = inoff+3*ine*2; outoff = clutoff+grid**3*3*2
+    inputs = [read_u16_table(d, inoff+ch*ine*2, ine) for ch in range(3)]
+    clut = read_u16_table(d, clutoff, grid**3*3)
+    outputs = [read_u16_table(d, outoff+ch*oute*2, oute) for ch in range(3)]
+    return grid, inputs, clut, outputs, clutoff
+
 def parse_ti3(text):
     fmt, rows, in_data, take_fmt = None, [], False, False
     for ln in text.splitlines():
@@ -49,7 +81,7 @@ def minv3(m):
 BRAD_M = [[0.8951,0.2664,-0.1614],[-0.7502,1.7135,0.0367],[0.0389,-0.0685,1.0296]]
 def mmul_b(m, v): return [sum(m[r][k]*v[k] for k in range(3)) for r in range(3)]
 
-def analyse_measurements(fmt, rows, target=(0.3127, 0.3290)):
+def analyse_measurements(fmt, rows, target=(0.3127, 0.3290), log=print):
     ri, gi, bi = fmt.index('RGB_R'), fmt.index('RGB_G'), fmt.index('RGB_B')
     xi, yi, zi = fmt.index('XYZ_X'), fmt.index('XYZ_Y'), fmt.index('XYZ_Z')
     f = lambda r, i: float(r[i])
@@ -97,7 +129,7 @@ def analyse_measurements(fmt, rows, target=(0.3127, 0.3290)):
     ybal = sum(M[1][k]*s[k] for k in range(3))
     prim_sum = M[1][0]+M[1][1]+M[1][2]
     luma_w = (M[1][0]/prim_sum, M[1][1]/prim_sum, M[1][2]/prim_sum)
-    print("balanced peak: scales R={:.4f} G={:.4f} B={:.4f}, Y={:.2f}% of native white, codes R={:.2f}% G={:.2f}% B={:.2f}%".format(
+    log("balanced peak: scales R={:.4f} G={:.4f} B={:.4f}, Y={:.2f}% of native white, codes R={:.2f}% G={:.2f}% B={:.2f}%".format(
         s[0], s[1], s[2], ybal, balanced[0]*100, balanced[1]*100, balanced[2]*100))
     return curve, ymax, plateau_pct, balanced, luma_w
 
@@ -108,31 +140,33 @@ D50 = (0.9642, 1.0, 0.8249)
 def a2b_evaluator(d, tags):
     if 'A2B0' not in tags:
         return None
-    o,_ = tags['A2B0']
-    grid = d[o+10]; ine, oute = struct.unpack('>HH', bytes(d[o+48:o+52]))
-    inoff = o+52; clutoff = inoff+3*ine*2; outoff = clutoff+grid**3*3*2
-    def be16(p): return (d[p]<<8)|d[p+1]
-    def ts(base, count, v):
+    grid, inputs, clut, outputs, _ = lut16_tables(d, tags['A2B0'][0])
+    def ts(table, v):
+        count = len(table)
         v = max(0.0, min(1.0, v))*(count-1); lo = min(int(v), count-2); fr = v-lo
-        return (be16(base+lo*2)*(1-fr)+be16(base+(lo+1)*2)*fr)/65535.0
+        return (table[lo]*(1-fr)+table[lo+1]*fr)/65535.0
     def ev(rgb):
-        co = [ts(inoff+ch*ine*2, ine, rgb[ch]) for ch in range(3)]
+        co = [ts(inputs[ch], rgb[ch]) for ch in range(3)]
         b=[0]*3; f=[0.0]*3
         for r in range(3):
             p=max(0.0,min(1.0,co[r]))*(grid-1); b[r]=min(int(p),grid-2); f[r]=p-b[r]
+        # The eight cell corners as (cLUT index, weight), shared by all channels.
+        corners = []
+        for rr in range(2):
+            for gg in range(2):
+                for bb in range(2):
+                    w=(f[0] if rr else 1-f[0])*(f[1] if gg else 1-f[1])*(f[2] if bb else 1-f[2])
+                    corners.append(((((b[0]+rr)*grid+(b[1]+gg))*grid+(b[2]+bb))*3, w))
         out=[0.0]*3
         for ch in range(3):
             a=0.0
-            for rr in range(2):
-                for gg in range(2):
-                    for bb in range(2):
-                        w=(f[0] if rr else 1-f[0])*(f[1] if gg else 1-f[1])*(f[2] if bb else 1-f[2])
-                        a+=be16(clutoff+((((b[0]+rr)*grid+(b[1]+gg))*grid+(b[2]+bb))*3+ch)*2)/65535.0*w
+            for index, w in corners:
+                a+=clut[index+ch]/65535.0*w
             out[ch]=a
-        return [ts(outoff+ch*oute*2, oute, out[ch])*2.0 for ch in range(3)]
+        return [ts(outputs[ch], out[ch])*2.0 for ch in range(3)]
     return ev
 
-def refine_balance_with_a2b(d, tags, balanced, plateau_dev, native_white_xy, target=(0.3127, 0.3290)):
+def refine_balance_with_a2b(d, tags, balanced, plateau_dev, native_white_xy, target=(0.3127, 0.3290), log=print):
     """Newton-refine the balanced peak through the profile's forward model.
 
     The additive primary solve over-corrects when channels interact near full
@@ -158,7 +192,7 @@ def refine_balance_with_a2b(d, tags, balanced, plateau_dev, native_white_xy, tar
     txyz = mmul_b(AD, d65)
     ts_ = sum(txyz)
     tx, ty = txyz[0]/ts_, txyz[1]/ts_
-    print("PCS target for absolute D65: xy ({:.4f},{:.4f}) [native white {:.4f},{:.4f}]".format(tx, ty, nx, ny))
+    log("PCS target for absolute D65: xy ({:.4f},{:.4f}) [native white {:.4f},{:.4f}]".format(tx, ty, nx, ny))
     lock = balanced.index(max(balanced))
     free = [ch for ch in range(3) if ch != lock]
     codes = list(balanced)
@@ -181,7 +215,7 @@ def refine_balance_with_a2b(d, tags, balanced, plateau_dev, native_white_xy, tar
         d1 = (-ey*jac[0][0] + ex*jac[0][1])/det
         codes[free[0]] = min(plateau_dev, max(0.5, codes[free[0]] + max(-0.01, min(0.01, d0))))
         codes[free[1]] = min(plateau_dev, max(0.5, codes[free[1]] + max(-0.01, min(0.01, d1))))
-    print("A2B-refined balance: R={:.2f}% G={:.2f}% B={:.2f}% (model xy {:.4f},{:.4f})".format(
+    log("A2B-refined balance: R={:.2f}% G={:.2f}% B={:.2f}% (model xy {:.4f},{:.4f})".format(
         codes[0]*100, codes[1]*100, codes[2]*100, xyz[0]/s, xyz[1]/s))
     return codes
 
@@ -194,14 +228,16 @@ def load_calibration_curves():
     luminance range. This is the ICC-native equivalent of evaluating a 1D
     calibration curve at source codes, which is how MHC2 tracks a grey axis.
     """
-    import os
     path = os.environ.get('PGEN_CAL_JSON', '')
     if not path:
         return None
     import json as _json
     with open(path) as handle:
-        curves = _json.load(handle)
-    if not (isinstance(curves, list) and len(curves) == 3 and
+        return _json.load(handle)
+
+def calibration_curves(curves):
+    """curves when they are three per-channel curves of two or more entries."""
+    if not (isinstance(curves, (list, tuple)) and len(curves) == 3 and
             all(len(c) >= 2 for c in curves)):
         return None
     return curves
@@ -224,7 +260,7 @@ def sample_curve(curve, position):
     fraction = position-low
     return curve[low]*(1.0-fraction)+curve[low+1]*fraction
 
-def choose_anchor_mode(cal, plateau_pct):
+def choose_anchor_mode(cal, plateau_pct, forced=None):
     """Pick the corridor's calibration anchor from panel geometry.
 
     The measured-code anchor is stable when a panel's plateau sits near the
@@ -235,8 +271,6 @@ def choose_anchor_mode(cal, plateau_pct):
     breaks that equivalence, and the measured-code anchor under-drives the
     whole rolloff by tens of percent. Search the request domain there.
     """
-    import os as _os
-    forced = _os.environ.get('PGEN_CAL_ANCHOR', '')
     if forced in ('simple', 'luma'):
         return forced
     if not cal:
@@ -246,8 +280,8 @@ def choose_anchor_mode(cal, plateau_pct):
     return 'luma' if top - at_plateau > 0.10 else 'simple'
 
 
-def repair(d, tags, curve, ymax, plateau_pct, balanced, cal=None, luma_w=None):
-    anchor_mode = choose_anchor_mode(cal, plateau_pct)
+def repair(d, tags, curve, ymax, plateau_pct, balanced, cal=None, luma_w=None, anchor=None, log=print):
+    anchor_mode = choose_anchor_mode(cal, plateau_pct, anchor)
     mhc2_shoulder_anchor = None
     if 'MHC2' in tags:
         mhc2_off, mhc2_size = tags['MHC2']
@@ -264,26 +298,17 @@ def repair(d, tags, curve, ymax, plateau_pct, balanced, cal=None, luma_w=None):
                 mhc2_shoulder_anchor = (endpoint_start-1)/float(entries-1)
     if luma_w is None:
         luma_w = (0.2627, 0.6780, 0.0593)
+    curve = PiecewiseLinearCurve(curve)
     def measured_lum(code_pct):
-        if code_pct <= curve[0][0]:
-            return curve[0][1]
-        for i in range(1, len(curve)):
-            if curve[i][0] >= code_pct:
-                p0, y0 = curve[i-1]
-                p1, y1 = curve[i]
-                t = 0.0 if p1 == p0 else (code_pct-p0)/(p1-p0)
-                return y0 + t*(y1-y0)
-        return curve[-1][1]
-    def be16(p): return (d[p]<<8)|d[p+1]
-    def wbe16(p, v):
-        v = max(0, min(65535, int(round(v)))); d[p] = v>>8; d[p+1] = v & 0xFF
-    def tinvert(base, count, target):
+        return curve.sample(code_pct)
+    def tinvert(table, target):
+        count = len(table)
         lo_i, hi_i = 0, count-1
-        lo_v = be16(base)/65535.0; hi_v = be16(base+(count-1)*2)/65535.0
+        lo_v = table[0]/65535.0; hi_v = table[count-1]/65535.0
         if target <= lo_v: return 0.0
         if target >= hi_v: return 1.0
         while hi_i-lo_i > 1:
-            mid = (lo_i+hi_i)//2; mv = be16(base+mid*2)/65535.0
+            mid = (lo_i+hi_i)//2; mv = table[mid]/65535.0
             if mv <= target: lo_i, lo_v = mid, mv
             else: hi_i, hi_v = mid, mv
         fr = 0.0 if hi_v == lo_v else (target-lo_v)/(hi_v-lo_v)
@@ -292,21 +317,22 @@ def repair(d, tags, curve, ymax, plateau_pct, balanced, cal=None, luma_w=None):
         target = min(yrel, 1.0)*ymax
         if target >= 0.995*ymax:
             return (balanced[ch] if ch is not None and balanced else plateau_pct/100.0)
-        for i in range(1, len(curve)):
-            if curve[i][1] >= target:
-                p0, y0 = curve[i-1]; p1, y1 = curve[i]
-                fr = 0.0 if y1 == y0 else (target-y0)/(y1-y0)
-                return (p0 + fr*(p1-p0))/100.0
+        i = curve.locate_value(target)
+        if i < len(curve):
+            p0, y0 = curve[i-1]; p1, y1 = curve[i]
+            fr = 0.0 if y1 == y0 else (target-y0)/(y1-y0)
+            return (p0 + fr*(p1-p0))/100.0
         return plateau_pct/100.0
     for tag in ('B2A0', 'B2A1'):
         if tag not in tags: continue
-        o,_ = tags[tag]
-        grid = d[o+10]; ine, oute = struct.unpack('>HH', bytes(d[o+48:o+52]))
-        inoff = o+52; clutoff = inoff+3*ine*2; outoff = clutoff+grid**3*3*2
+        # Decode the tables once; corridor nodes go into the decoded cLUT and
+        # the whole table is stored back after the tag is done.
+        grid, inputs, clut, outputs, clutoff = lut16_tables(d, tags[tag][0])
+        ine = len(inputs[0])
         replaced = 0
         plateau_dev = plateau_pct/100.0
         for j in range(grid):
-            y_rel = tinvert(inoff+1*ine*2, ine, j/(grid-1))/ENC
+            y_rel = tinvert(inputs[1], j/(grid-1))/ENC
             if y_rel < KNEE: continue
             # Phase the balanced per-channel offsets in across the corridor so
             # luminance follows the measured neutral curve while the channel
@@ -363,7 +389,8 @@ def repair(d, tags, curve, ymax, plateau_pct, balanced, cal=None, luma_w=None):
                 if balanced:
                     return base + (balanced[ch] - plateau_dev)*w
                 return base
-            wnode = [tinvert(outoff+ch*oute*2, oute, corridor_code(ch)) for ch in range(3)]
+            wnode = [tinvert(outputs[ch], corridor_code(ch)) for ch in range(3)]
+            wcodes = [max(0, min(65535, int(round(wnode[ch]*65535.0)))) for ch in range(3)]
             # Select corridor nodes in NODE space: every interpolation cell a
             # neutral query can touch must have all its corners owned by the
             # corridor, regardless of how wide the shaper-domain node spacing
@@ -375,53 +402,85 @@ def repair(d, tags, curve, ymax, plateau_pct, balanced, cal=None, luma_w=None):
                 # forward through the input table, then to node coordinate
                 v = enc*(ine-1)
                 lo_i = min(int(v), ine-2); fr = v-lo_i
-                base = inoff+ch*ine*2
-                t = (be16(base+lo_i*2)*(1-fr)+be16(base+(lo_i+1)*2)*fr)/65535.0
+                table = inputs[ch]
+                t = (table[lo_i]*(1-fr)+table[lo_i+1]*fr)/65535.0
                 return t*(grid-1)
             fx = axis_node(0, D50[0]*min(y_rel, 1.9))
             fz = axis_node(2, D50[2]*min(y_rel, 1.9))
             SPAN = 2
             for i in range(max(0, int(fx)-SPAN), min(grid, int(fx)+SPAN+2)):
                 for k in range(max(0, int(fz)-SPAN), min(grid, int(fz)+SPAN+2)):
-                    base = clutoff + (((i*grid+j)*grid+k)*3)*2
-                    for ch in range(3):
-                        wbe16(base+ch*2, wnode[ch]*65535.0)
+                    base = ((i*grid+j)*grid+k)*3
+                    clut[base:base+3] = array('H', wcodes)
                     replaced += 1
-        print("{}: corridor nodes replaced={}".format(tag, replaced))
+        write_u16_table(d, clutoff, clut)
+        log("{}: corridor nodes replaced={}".format(tag, replaced))
 
-def main():
-    src, dst = sys.argv[1], sys.argv[2]
-    d, tags = read_profile(src)
-    if len(sys.argv) > 3:
-        text = open(sys.argv[3], encoding='latin1').read()
-    else:
+def environment_options():
+    """repair_profile() options from PGEN_BALANCE, PGEN_BALANCE_OVERRIDE and PGEN_CAL_ANCHOR."""
+    options = {'balance': os.environ.get('PGEN_BALANCE') == '1',
+               'anchor': os.environ.get('PGEN_CAL_ANCHOR', '') or None}
+    override = os.environ.get('PGEN_BALANCE_OVERRIDE', '')
+    if override:
+        options['balance_override'] = [float(v)/100.0 for v in override.split(',')]
+    return options
+
+def repair_profile(profile, ti3_text=None, options=None, log=None):
+    """Return the ICC bytes profile with its BToA corridor and peak repaired.
+
+    ti3_text holds the characterization rows; without it the embedded targ
+    tag is used. options may set 'balance' (solve the balanced peak through
+    the A2B), 'balance_override' (peak codes as three fractions),
+    'calibration' (per-channel curves for a calibrated corridor) and 'anchor'
+    ('simple' or 'luma' to force the calibration anchor). log receives the
+    progress lines the command line prints, ending with the repair's wall time.
+    """
+    started = time.time()
+    options = options or {}
+    log = log or (lambda message: None)
+    d, tags = parse_profile(profile)
+    if ti3_text is None:
         off, size = tags['targ']
-        text = d[off+8:off+size].decode('latin1', 'replace')
-    fmt, rows = parse_ti3(text)
-    curve, ymax, plateau_pct, balanced, luma_w = analyse_measurements(fmt, rows)
-    print("neutral rows={} plateau={:.2f}%".format(len(curve), plateau_pct))
+        ti3_text = d[off+8:off+size].decode('latin1', 'replace')
+    fmt, rows = parse_ti3(ti3_text)
+    curve, ymax, plateau_pct, balanced, luma_w = analyse_measurements(fmt, rows, log=log)
+    log("neutral rows={} plateau={:.2f}%".format(len(curve), plateau_pct))
     ri2, gi2, bi2 = fmt.index('RGB_R'), fmt.index('RGB_G'), fmt.index('RGB_B')
     xi2, yi2, zi2 = fmt.index('XYZ_X'), fmt.index('XYZ_Y'), fmt.index('XYZ_Z')
     wr = [r for r in rows if float(r[ri2]) == 100 and float(r[gi2]) == 100 and float(r[bi2]) == 100]
     wx = sum(float(r[xi2]) for r in wr)/len(wr); wy = sum(float(r[yi2]) for r in wr)/len(wr)
     wz = sum(float(r[zi2]) for r in wr)/len(wr); ws = wx+wy+wz
-    import os
-    override = os.environ.get('PGEN_BALANCE_OVERRIDE', '')
+    override = options.get('balance_override')
     if override:
-        balanced = [float(v)/100.0 for v in override.split(',')]
-        print("balance override: R={:.2f}% G={:.2f}% B={:.2f}%".format(balanced[0]*100, balanced[1]*100, balanced[2]*100))
-    elif os.environ.get('PGEN_BALANCE') == '1':
-        balanced = refine_balance_with_a2b(d, tags, balanced, plateau_pct/100.0, (wx/ws, wy/ws))
+        balanced = list(override)
+        log("balance override: R={:.2f}% G={:.2f}% B={:.2f}%".format(balanced[0]*100, balanced[1]*100, balanced[2]*100))
+    elif options.get('balance'):
+        balanced = refine_balance_with_a2b(d, tags, balanced, plateau_pct/100.0, (wx/ws, wy/ws), log=log)
     else:
         # Default: continue the corridor to the earliest measured plateau with
         # equal channels. Peak white balancing needs knee-band characterization
         # samples; without them the solve overshoots on cliff-type panels.
         balanced = None
-    cal = load_calibration_curves()
+    cal = calibration_curves(options.get('calibration'))
     if cal is not None:
-        print("calibrated corridor: full-range, curves x{}".format(len(cal[0])))
-    repair(d, tags, curve, ymax, plateau_pct, balanced, cal, luma_w)
-    open(dst, 'wb').write(bytes(d))
+        log("calibrated corridor: full-range, curves x{}".format(len(cal[0])))
+    repair(d, tags, curve, ymax, plateau_pct, balanced, cal, luma_w, options.get('anchor'), log)
+    log("repair time: {:.3f}s".format(time.time() - started))
+    return bytes(d)
+
+def main():
+    src, dst = sys.argv[1], sys.argv[2]
+    with open(src, 'rb') as handle:
+        profile = handle.read()
+    text = None
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], encoding='latin1') as handle:
+            text = handle.read()
+    options = environment_options()
+    options['calibration'] = load_calibration_curves()
+    repaired = repair_profile(profile, text, options, print)
+    with open(dst, 'wb') as handle:
+        handle.write(repaired)
     print("wrote {}".format(dst))
 
 if __name__ == '__main__':
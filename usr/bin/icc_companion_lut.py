@@ -1,15 +1,66 @@
 #!/usr/bin/env python3
-"""Build a compact RGB correction LUT for PGenerator+ Patch Companion."""
-
+"""Build a compact RGB correction LUT for PGenerator+ Patch Companion.
+
+A PGLT file holds a GRID^3 lattice of 16-bit RGB codes, red slowest and blue
+fastest. Version 1, which every Companion reads, is a 16-byte header (magic,
+version, grid, channels, a reserved byte, a big-endian node count and four
+zero bytes) followed by big-endian codes. Version 2 is a PGLT_V2 header
+(magic, version, grid, channels, bits per value, node order, body encoding,
+header size, node count, stored body size and the CRC-32 of the decoded
+little-endian codes) followed by the body. A raw v2 body is the codes in
+little-endian order, so a reader on x86 or ARM can use it in place. A
+delta-zlib body differences the codes along the blue, green and red axes in
+turn, modulo 2^16, and compresses the result with zlib. Without the delta
+step a smooth lattice barely compresses. read_pglt() is the reference
+decoder for both versions.
+
+With a CUBE_SIZE argument the tool writes a standard .cube file instead.
+"""
+
+import array
+import contextlib
+import hashlib
+import json
 import math
 import os
 import re
+import shutil
 import struct
 import sys
+import zlib
+
+try:
+    import numpy
+except ImportError:  # The pure-Python loops are the reference path.
+    numpy = None
+
+from icc_mft2 import NUMPY_MIN_POINTS, Mft2Evaluator, load_mft2, numpy_enabled, read_profile
+from icc_parallel import run_slabs
 
 
 GRID = 65
 
+PGLT_V2 = struct.Struct("<4sBBBBBBHIII")
+PGLT_RED_SLOWEST = 0
+PGLT_RED_FASTEST = 1
+PGLT_RAW = 0
+PGLT_DELTA_ZLIB = 1
+
+# Finished LUTs keyed by the profile bytes and every build option. Exports
+# and Companion correction LUTs are rebuilt from the same stored profile over
+# and over, so a repeat request copies the earlier result. Entries sit in a
+# hidden directory next to the profiles as PROFILE.icc.KEY.cube or .pglt, so
+# the WebUI can drop them by name when it deletes or overwrites a profile.
+# PGEN_DERIVED_LUT_CACHE names another directory, or disables the cache when
+# set to 0.
+DERIVED_LUT_DIR = ".derived-luts"
+DERIVED_LUT_BYTES = 64 * 1024 * 1024
+# A LUT larger than this share of the cache is not stored: a 129-point .cube
+# is about 77 MB, more than the whole cache, and would evict every other entry.
+DERIVED_LUT_ENTRY_SHARE = 4
+# Part of every key: bump it whenever build() or build_cube() output changes.
+DERIVED_LUT_VERSION = 1
+
 
 def fail(message):
     raise ValueError(message)
@@ -78,13 +129,6 @@ def chromatic_adaptation(source_white, destination_white):
     return mat_mul(inverse3(BRADFORD), mat_mul(scale, BRADFORD))
 
 
-def table_sample(table, value):
-    value = max(0.0, min(1.0, value)) * (len(table) - 1)
-    lower = min(len(table) - 2, int(value))
-    fraction = value - lower
-    return table[lower] * (1.0 - fraction) + table[lower + 1] * fraction
-
-
 def curve_values(tag):
     if tag[:4] != b"curv" or len(tag) < 12:
         fail("ICC tone curve is unsupported")
@@ -113,6 +157,24 @@ def inverse_curve(table, value):
     return (low + max(0.0, min(1.0, fraction))) / (len(table) - 1)
 
 
+def numpy_inverse_curve(table, values):
+    """inverse_curve() for a NumPy array, taking the same bisection steps."""
+    values = numpy.maximum(0.0, numpy.minimum(1.0, values))
+    low = numpy.zeros(len(values), dtype=numpy.intp)
+    high = numpy.full(len(values), len(table) - 1, dtype=numpy.intp)
+    searching = high - low > 1
+    while searching.any():
+        middle = (low + high) // 2
+        below = table[middle] < values
+        low = numpy.where(searching & below, middle, low)
+        high = numpy.where(searching & ~below, middle, high)
+        searching = high - low > 1
+    y0, y1 = table[low], table[high]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        fraction = numpy.where(y1 <= y0, 0.0, (values - y0) / (y1 - y0))
+    return (low + numpy.maximum(0.0, numpy.minimum(1.0, fraction))) / (len(table) - 1)
+
+
 class MatrixTransform:
     def __init__(self, profile_tags):
         columns = []
@@ -125,11 +187,30 @@ class MatrixTransform:
             curves.append(curve_values(profile_tags.get(curve_name, b"")))
         self.inverse = inverse3([[columns[column][row] for column in range(3)] for row in range(3)])
         self.curves = curves
+        self._arrays = None
 
     def apply(self, xyz):
         linear = mat_vec(self.inverse, xyz)
         return [inverse_curve(self.curves[channel], linear[channel]) for channel in range(3)]
 
+    def apply_many(self, points):
+        if numpy_enabled() and len(points) >= NUMPY_MIN_POINTS * 3:
+            if self._arrays is None:
+                self._arrays = [numpy.array(curve, dtype=float) for curve in self.curves]
+            values = numpy.asarray(points, dtype=float).reshape(-1, 3)
+            result = numpy.empty_like(values)
+            for channel in range(3):
+                row = self.inverse[channel]
+                linear = row[0] * values[:, 0] + row[1] * values[:, 1] + row[2] * values[:, 2]
+                result[:, channel] = numpy_inverse_curve(self._arrays[channel], linear)
+            flat = array.array("d")
+            flat.frombytes(result.tobytes())
+            return flat
+        result = []
+        for index in range(0, len(points), 3):
+            result.extend(self.apply(points[index:index + 3]))
+        return result
+
 
 class Lut16Transform:
     def __init__(self, tag):
@@ -138,58 +219,22 @@ class Lut16Transform:
         self.inputs, self.outputs, self.grid = tag[8], tag[9], tag[10]
         if self.inputs != 3 or self.outputs != 3 or self.grid < 2:
             fail("ICC BToA cLUT dimensions are unsupported")
-        self.matrix = [[s15(tag, 12 + (row * 3 + column) * 4) for column in range(3)] for row in range(3)]
         input_entries, output_entries = struct.unpack_from(">HH", tag, 48)
         if input_entries < 2 or output_entries < 2:
             fail("ICC BToA cLUT tables are invalid")
-        offset = 52
-        self.input_tables = []
-        for _ in range(3):
-            size = input_entries * 2
-            if offset + size > len(tag):
-                fail("ICC BToA input table is truncated")
-            self.input_tables.append([value / 65535.0 for value in struct.unpack_from(">{}H".format(input_entries), tag, offset)])
-            offset += size
-        count = self.grid ** 3 * 3
-        size = count * 2
-        if offset + size > len(tag):
+        try:
+            lut = load_mft2(tag)
+        except ValueError:
             fail("ICC BToA cLUT is truncated")
-        self.clut = [value / 65535.0 for value in struct.unpack_from(">{}H".format(count), tag, offset)]
-        offset += size
-        self.output_tables = []
-        for _ in range(3):
-            size = output_entries * 2
-            if offset + size > len(tag):
-                fail("ICC BToA output table is truncated")
-            self.output_tables.append([value / 65535.0 for value in struct.unpack_from(">{}H".format(output_entries), tag, offset)])
-            offset += size
+        # ICC v2 LUT16 encodes PCS XYZ over 0.0 through 1.99997.
+        self.evaluator = Mft2Evaluator(lut, matrix="before",
+                                       input_divisor=65535.0 / 32768.0)
 
     def apply(self, xyz):
-        # ICC v2 LUT16 encodes PCS XYZ over 0.0 through 1.99997.
-        values = mat_vec(self.matrix, xyz)
-        values = [table_sample(self.input_tables[channel], values[channel] / (65535.0 / 32768.0)) for channel in range(3)]
-        base = []
-        fraction = []
-        for value in values:
-            position = max(0.0, min(1.0, value)) * (self.grid - 1)
-            lower = min(self.grid - 2, int(position))
-            base.append(lower)
-            fraction.append(position - lower)
-        result = [0.0, 0.0, 0.0]
-        for corner in range(8):
-            weight = 1.0
-            coordinate = []
-            for axis in range(3):
-                if corner & (1 << axis):
-                    weight *= fraction[axis]
-                    coordinate.append(base[axis] + 1)
-                else:
-                    weight *= 1.0 - fraction[axis]
-                    coordinate.append(base[axis])
-            offset = ((coordinate[0] * self.grid + coordinate[1]) * self.grid + coordinate[2]) * 3
-            for channel in range(3):
-                result[channel] += weight * self.clut[offset + channel]
-        return [table_sample(self.output_tables[channel], result[channel]) for channel in range(3)]
+        return self.evaluator(xyz)
+
+    def apply_many(self, points):
+        return self.evaluator.evaluate_many(points)
 
 
 def pq_linear(value):
@@ -261,22 +306,62 @@ def profile_luminance(profile_tags):
     return white_nits
 
 
-def source_xyz(rgb, signal_mode, white_nits, adaptation):
+def source_terms(size, signal_mode, white_nits, adaptation):
+    """Per-channel PCS XYZ contributions of each level of a size-point lattice.
+
+    A source node's PCS XYZ is red[r] + green[g] + blue[b] summed in that
+    order: each channel's linearization depends only on its own level, and
+    the colourspace and adaptation matrices are linear, so they are applied
+    once per level instead of once per node.
+    """
+    levels = [index / (size - 1.0) for index in range(size)]
     if signal_mode == "hdr10":
         # ICC display PCS values are relative to the measured display white,
         # while PQ is absolute with 1.0 representing 10,000 cd/m2. Scale the
         # requested absolute light level into the selected profile's relative
         # PCS before evaluating its PCS-to-device transform.
-        linear = [min(1.0, pq_linear(value) * 10000.0 / white_nits) for value in rgb]
-        absolute_xyz = mat_vec(BT2020_TO_XYZ, linear)
+        linear = [min(1.0, pq_linear(value) * 10000.0 / white_nits) for value in levels]
+        to_xyz = BT2020_TO_XYZ
     else:
-        linear = [srgb_linear(value) for value in rgb]
-        absolute_xyz = mat_vec(SRGB_TO_XYZ, linear)
+        linear = [srgb_linear(value) for value in levels]
+        to_xyz = SRGB_TO_XYZ
     # Display BToA tables are relative-colorimetric and D50-referenced. Adapt
     # the requested absolute XYZ with the same transform the profile was built
     # with, so D65 is corrected to D65 rather than being remapped towards the
     # display's uncalibrated native white.
-    return mat_vec(adaptation, absolute_xyz)
+    matrix = mat_mul(adaptation, to_xyz)
+    return [[(matrix[0][channel] * value, matrix[1][channel] * value,
+              matrix[2][channel] * value) for value in linear]
+            for channel in range(3)]
+
+
+def source_points(terms, first, last, red_fastest=False):
+    """Flat PCS XYZ of the lattice planes first..last-1 of the slowest channel.
+
+    Nodes run red-slowest/blue-fastest, or blue-slowest/red-fastest when
+    red_fastest is set. Large batches come back as a flat NumPy array.
+    """
+    red, green, blue = terms
+    size = len(red)
+    if numpy_enabled() and (last - first) * size * size >= NUMPY_MIN_POINTS:
+        red, green, blue = (numpy.array(channel) for channel in terms)
+        if red_fastest:
+            points = (red[None, None, :, :] + green[None, :, None, :]) + blue[first:last, None, None, :]
+        else:
+            points = (red[first:last, None, None, :] + green[None, :, None, :]) + blue[None, None, :, :]
+        return points.reshape(-1)
+    points = []
+    for slow in range(first, last):
+        for middle in green:
+            if red_fastest:
+                b0, b1, b2 = blue[slow]
+                for r0, r1, r2 in red:
+                    points.extend((r0 + middle[0] + b0, r1 + middle[1] + b1, r2 + middle[2] + b2))
+            else:
+                r0, r1, r2 = red[slow]
+                for b0, b1, b2 in blue:
+                    points.extend((r0 + middle[0] + b0, r1 + middle[1] + b1, r2 + middle[2] + b2))
+    return points
 
 
 def make_transform(profile_path, method, signal_mode):
@@ -284,8 +369,7 @@ def make_transform(profile_path, method, signal_mode):
         fail("Unsupported Companion correction method")
     if signal_mode not in ("sdr", "hdr10"):
         fail("Unsupported Companion correction signal mode")
-    with open(profile_path, "rb") as handle:
-        profile = handle.read()
+    profile = read_profile(profile_path)
     if len(profile) < 132 or profile[12:16] != b"mntr" or profile[16:20] != b"RGB " or profile[20:24] != b"XYZ ":
         fail("The selected file is not a supported RGB display profile with XYZ PCS")
     profile_tags = tags(profile)
@@ -297,62 +381,313 @@ def make_transform(profile_path, method, signal_mode):
     return transform, white_nits, adaptation
 
 
-def write_atomic(output_path, payload):
-    mode = "wb" if isinstance(payload, (bytes, bytearray)) else "w"
+@contextlib.contextmanager
+def atomic_output(output_path, mode="wb"):
+    """Open a temporary file that replaces output_path once writing succeeds."""
     temporary = output_path + ".tmp.{}".format(os.getpid())
-    with open(temporary, mode) as handle:
+    try:
+        with open(temporary, mode) as handle:
+            yield handle
+        os.replace(temporary, output_path)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def write_atomic(output_path, payload):
+    with atomic_output(output_path, "wb" if isinstance(payload, (bytes, bytearray)) else "w") as handle:
         handle.write(payload)
-    os.replace(temporary, output_path)
 
 
-def build(profile_path, method, signal_mode, output_path):
+def cube_rows(values):
+    """Format flat RGB triples, clamped to 0..1, as "%.9f %.9f %.9f" lines."""
+    if numpy_enabled() and len(values) >= NUMPY_MIN_POINTS * 3:
+        return numpy_cube_rows(numpy.asarray(values, dtype=float))
+    clamped = tuple(max(0.0, min(1.0, value)) for value in values)
+    return (("%.9f %.9f %.9f\n" * (len(clamped) // 3)) % clamped).encode("ascii")
+
+
+def numpy_cube_rows(values):
+    """cube_rows() for a flat NumPy array, writing the digits directly.
+
+    Every clamped value prints as one integer digit and nine decimals, so
+    the text is a fixed 12-byte field per value. rint() of the scaled value
+    only disagrees with the exact decimal rounding of "%.9f" when the
+    product lies within its rounding error of a half; those few values are
+    formatted by Python instead.
+    """
+    values = numpy.maximum(0.0, numpy.minimum(1.0, values))
+    scaled = values * 1e9
+    units = numpy.rint(scaled).astype(numpy.int64)
+    for index in numpy.flatnonzero(numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6):
+        units[index] = int(("%.9f" % values[index]).replace(".", ""))
+    text = numpy.empty((len(values), 12), dtype=numpy.uint8)
+    text[:, 0] = 48 + units // 1000000000
+    text[:, 1] = 46
+    fraction = units % 1000000000
+    for column in range(10, 1, -1):
+        text[:, column] = 48 + fraction % 10
+        fraction //= 10
+    text[:, 11] = 32
+    text[2::3, 11] = 10
+    return text.tobytes()
+
+
+def quantize(values):
+    """Clamp values to 0..1 and round them to 16-bit codes in an array('H')."""
+    if numpy_enabled() and len(values) >= NUMPY_MIN_POINTS * 3:
+        codes = numpy.rint(numpy.maximum(0.0, numpy.minimum(
+            1.0, numpy.asarray(values, dtype=float))) * 65535.0)
+        return array.array("H", codes.astype(numpy.uint16).tobytes())
+    return array.array("H", [int(round(max(0.0, min(1.0, value)) * 65535.0)) for value in values])
+
+
+def delta_encode(codes, grid):
+    """Difference a lattice along the blue, green and red axes, modulo 2^16."""
+    if numpy_enabled():
+        lattice = numpy.frombuffer(codes, dtype=numpy.uint16).reshape(grid, grid, grid, 3)
+        for axis in (2, 1, 0):
+            lattice = numpy.diff(lattice, axis=axis,
+                                 prepend=numpy.zeros_like(lattice.take([0], axis=axis)))
+        return array.array("H", lattice.tobytes())
+    values = list(codes)
+    stride = 3
+    for _ in range(3):
+        deltas = values[:stride] + [(value - previous) & 0xFFFF
+                                    for value, previous in zip(values[stride:], values)]
+        # The first node along the axis keeps its own value.
+        for start in range(0, len(values), stride * grid):
+            deltas[start:start + stride] = values[start:start + stride]
+        values = deltas
+        stride *= grid
+    return array.array("H", values)
+
+
+def delta_decode(deltas, grid):
+    """Undo delta_encode() with running sums along each axis."""
+    if numpy_enabled():
+        lattice = numpy.frombuffer(deltas, dtype=numpy.uint16).reshape(grid, grid, grid, 3)
+        for axis in (0, 1, 2):
+            lattice = numpy.cumsum(lattice, axis=axis, dtype=numpy.uint16)
+        return array.array("H", lattice.tobytes())
+    values = list(deltas)
+    stride = 3
+    for _ in range(3):
+        for index in range(stride, len(values)):
+            if (index // stride) % grid:
+                values[index] = (values[index] + values[index - stride]) & 0xFFFF
+        stride *= grid
+    return array.array("H", values)
+
+
+def little_endian(codes):
+    if sys.byteorder == "little":
+        return codes.tobytes()
+    swapped = array.array("H", codes)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def pglt_bytes(codes, grid, version=1, compress=False):
+    """Serialize a red-slowest array('H') lattice as a PGLT v1 or v2 file."""
+    if version == 1:
+        body = array.array("H", codes)
+        if sys.byteorder == "little":
+            body.byteswap()
+        return (b"PGLT" + bytes((1, grid, 3, 0)) + struct.pack(">I", grid ** 3)
+                + b"\0\0\0\0" + body.tobytes())
+    if version != 2:
+        fail("Unsupported PGLT version")
+    body = little_endian(codes)
+    checksum = zlib.crc32(body)
+    encoding = PGLT_RAW
+    if compress:
+        body = zlib.compress(little_endian(delta_encode(codes, grid)))
+        encoding = PGLT_DELTA_ZLIB
+    return PGLT_V2.pack(b"PGLT", 2, grid, 3, 16, PGLT_RED_SLOWEST, encoding, PGLT_V2.size,
+                        grid ** 3, len(body), checksum) + body
+
+
+def read_pglt(data):
+    """Decode a PGLT v1 or v2 file into (grid, node order, array('H') codes)."""
+    if len(data) < 16 or data[:4] != b"PGLT":
+        fail("Not a PGLT correction LUT")
+    codes = array.array("H")
+    if data[4] == 1:
+        grid, channels = data[5], data[6]
+        nodes = struct.unpack_from(">I", data, 8)[0]
+        if channels != 3 or nodes != grid ** 3 or 16 + nodes * 6 != len(data):
+            fail("PGLT v1 header is invalid")
+        codes.frombytes(data[16:])
+        if sys.byteorder == "little":
+            codes.byteswap()
+        return grid, PGLT_RED_SLOWEST, codes
+    if data[4] != 2 or len(data) < PGLT_V2.size:
+        fail("Unsupported PGLT version")
+    (_, _, grid, channels, bits, order, encoding, header_size, nodes, body_size,
+     checksum) = PGLT_V2.unpack_from(data)
+    if (channels != 3 or bits != 16 or grid < 2 or nodes != grid ** 3
+            or header_size < PGLT_V2.size or header_size + body_size != len(data)
+            or order not in (PGLT_RED_SLOWEST, PGLT_RED_FASTEST)):
+        fail("PGLT v2 header is invalid")
+    body = data[header_size:]
+    if encoding == PGLT_DELTA_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error:
+            fail("PGLT v2 body is corrupt")
+    elif encoding != PGLT_RAW:
+        fail("Unsupported PGLT v2 body encoding")
+    if len(body) != nodes * 6:
+        fail("PGLT v2 body is truncated")
+    codes.frombytes(body)
+    if sys.byteorder == "big":
+        codes.byteswap()
+    if encoding == PGLT_DELTA_ZLIB:
+        codes = delta_decode(codes, grid)
+    if zlib.crc32(little_endian(codes)) != checksum:
+        fail("PGLT v2 checksum does not match")
+    return grid, order, codes
+
+
+def build(profile_path, method, signal_mode, output_path, version=1, compress=False):
+    """Write the Companion correction LUT as PGLT v1, or v2 when asked."""
     transform, white_nits, adaptation = make_transform(profile_path, method, signal_mode)
-    output = bytearray(b"PGLT" + bytes((1, GRID, 3, 0)))
-    output.extend(struct.pack(">I", GRID ** 3))
-    output.extend(b"\0\0\0\0")
-    for red in range(GRID):
-        for green in range(GRID):
-            for blue in range(GRID):
-                rgb = (red / (GRID - 1.0), green / (GRID - 1.0), blue / (GRID - 1.0))
-                corrected = transform.apply(source_xyz(rgb, signal_mode, white_nits, adaptation))
-                for value in corrected:
-                    output.extend(struct.pack(">H", int(round(max(0.0, min(1.0, value)) * 65535.0))))
-    write_atomic(output_path, output)
+    terms = source_terms(GRID, signal_mode, white_nits, adaptation)
+
+    def build_slab(first, last):
+        codes = array.array("H")
+        for red in range(first, last):
+            codes.extend(quantize(transform.apply_many(source_points(terms, red, red + 1))))
+        return codes.tobytes()
+
+    codes = array.array("H")
+    codes.frombytes(run_slabs(build_slab, GRID))
+    write_atomic(output_path, pglt_bytes(codes, GRID, version, compress))
 
 
 def build_cube(profile_path, method, signal_mode, output_path, size, title=None):
     if size < 2 or size > 129:
         fail("Unsupported 3D LUT size")
     transform, white_nits, adaptation = make_transform(profile_path, method, signal_mode)
+    terms = source_terms(size, signal_mode, white_nits, adaptation)
     if title is None:
         title = "{} {} ICC correction".format(
             re.sub(r"\.ic[cm]$", "", os.path.basename(profile_path), flags=re.I), signal_mode)
-    lines = ['TITLE "{}"'.format(title.replace('"', "'")),
-             "LUT_3D_SIZE {}".format(size),
-             "DOMAIN_MIN 0.0 0.0 0.0",
-             "DOMAIN_MAX 1.0 1.0 1.0"]
-    # Standard .cube node order is red-fastest/blue-slowest -- the reverse of
-    # the PGLT payload above. Keeping the PGLT nesting here would hand external
-    # tools an R<->B swapped lattice whose neutral axis still looks correct.
-    for blue in range(size):
-        for green in range(size):
-            for red in range(size):
-                rgb = (red / (size - 1.0), green / (size - 1.0), blue / (size - 1.0))
-                corrected = transform.apply(source_xyz(rgb, signal_mode, white_nits, adaptation))
-                lines.append(" ".join(
-                    "{:.9f}".format(max(0.0, min(1.0, value))) for value in corrected))
-    write_atomic(output_path, "\n".join(lines) + "\n")
+    header = ['TITLE "{}"'.format(title.replace('"', "'")),
+              "LUT_3D_SIZE {}".format(size),
+              "DOMAIN_MIN 0.0 0.0 0.0",
+              "DOMAIN_MAX 1.0 1.0 1.0"]
+    # A 129-point cube is 2.1M lines, so each blue plane is formatted and
+    # written as it is evaluated instead of holding the whole text.
+    with atomic_output(output_path) as handle:
+        handle.write(("\n".join(header) + "\n").encode("utf-8"))
+        # Standard .cube node order is red-fastest/blue-slowest -- the reverse
+        # of the PGLT payload above. Keeping the PGLT nesting here would hand
+        # external tools an R<->B swapped lattice whose neutral axis still
+        # looks correct.
+        for blue in range(size):
+            handle.write(cube_rows(transform.apply_many(
+                source_points(terms, blue, blue + 1, red_fastest=True))))
+
+
+def derived_lut_path(profile_path, method, signal_mode, size=None, version=1, compress=False):
+    """Cache entry for one LUT of profile_path, or "" when caching is off.
+
+    The key is the SHA-256 of the profile bytes, the build options and
+    DERIVED_LUT_VERSION, so a profile rewritten under the same name never
+    matches its old entries.
+    """
+    directory = os.environ.get("PGEN_DERIVED_LUT_CACHE")
+    if directory is None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(profile_path)), DERIVED_LUT_DIR)
+    if directory in ("", "0"):
+        return ""
+    digest = hashlib.sha256(read_profile(profile_path))
+    digest.update(b"\0" + json.dumps(
+        [DERIVED_LUT_VERSION, method, signal_mode, size, version, compress]).encode("utf-8"))
+    return os.path.join(directory, "{}.{}.{}".format(
+        os.path.basename(profile_path), digest.hexdigest()[:16],
+        "pglt" if size is None else "cube"))
+
+
+def derived_lut_load(entry, output_path):
+    if not entry:
+        return False
+    try:
+        with open(entry, "rb") as source, atomic_output(output_path) as handle:
+            shutil.copyfileobj(source, handle)
+        # The modification time orders eviction, so a hit marks it recent.
+        os.utime(entry, None)
+        return True
+    except (OSError, IOError):
+        return False
+
+
+def derived_lut_store(entry, output_path):
+    if not entry:
+        return
+    directory = os.path.dirname(entry)
+    try:
+        if os.path.getsize(output_path) > DERIVED_LUT_BYTES // DERIVED_LUT_ENTRY_SHARE:
+            return
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(output_path, "rb") as source, atomic_output(entry) as handle:
+            shutil.copyfileobj(source, handle)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith((".cube", ".pglt")):
+                status = os.stat(os.path.join(directory, name))
+                entries.append((status.st_mtime, status.st_size, name))
+        entries.sort()
+        total = sum(item[1] for item in entries)
+        # Drop least recently used LUTs, always keeping the one just stored.
+        for _, size, name in entries[:-1]:
+            if total <= DERIVED_LUT_BYTES:
+                break
+            if name != os.path.basename(entry):
+                os.remove(os.path.join(directory, name))
+                total -= size
+    except (OSError, IOError):
+        pass  # A cache that cannot be written only costs the next request.
+
+
+def build_cached(profile_path, method, signal_mode, output_path, size=None,
+                 version=1, compress=False):
+    """build(), or build_cube() when size is given, through the LUT cache.
+
+    Returns "hit" when a stored LUT was copied and "miss" when it was built.
+    """
+    entry = derived_lut_path(profile_path, method, signal_mode, size, version, compress)
+    if derived_lut_load(entry, output_path):
+        return "hit"
+    if size is None:
+        build(profile_path, method, signal_mode, output_path, version, compress)
+    else:
+        build_cube(profile_path, method, signal_mode, output_path, size)
+    derived_lut_store(entry, output_path)
+    return "miss"
 
 
 def main():
-    if len(sys.argv) not in (5, 6):
-        print("Usage: icc_companion_lut.py PROFILE clut|matrix sdr|hdr10 OUTPUT [CUBE_SIZE]", file=sys.stderr)
+    arguments = sys.argv[1:]
+    version, compress = 1, False
+    # The PGLT option trails the positional arguments, which icc_worker.py
+    # reads by position to preload the profile.
+    if arguments and arguments[-1] in ("--pglt2", "--pglt2-zlib"):
+        version, compress = 2, arguments.pop() == "--pglt2-zlib"
+    if len(arguments) not in (4, 5) or (version == 2 and len(arguments) == 5):
+        print("Usage: icc_companion_lut.py PROFILE clut|matrix sdr|hdr10 OUTPUT "
+              "[CUBE_SIZE | --pglt2 | --pglt2-zlib]", file=sys.stderr)
         return 2
     try:
-        if len(sys.argv) == 6:
-            build_cube(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
-        else:
-            build(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+        size = int(arguments[4]) if len(arguments) == 5 else None
+        build_cached(arguments[0], arguments[1], arguments[2], arguments[3], size,
+                     version, compress)
         return 0
     except (OSError, ValueError, struct.error) as error:
         print(str(error), file=sys.stderr)
@@ -8,6 +8,8 @@ import sys
 import time
 import zipfile
 
+from icc_stage_job import STAGE_MODULES
+
 
 # Production uses the installed tree. Release builds can point at a staged
 # repository tree without copying files into /usr/share first.
@@ -50,6 +52,9 @@ PLATFORMS = {
         "kind": "archive",
     },
 }
+# The builder's Python stages travel in archive packages as stages/, copied
+# from this generator's own modules so their revision matches its builder.
+STAGE_DIR = os.path.dirname(os.path.abspath(__file__))
 SAFE_SERVER = re.compile(r"^http://[A-Za-z0-9._\-\[\]:]+$")
 SAFE_TOKEN = re.compile(r"^[0-9a-f]{64}$")
 SERVER_SLOT = (b"__PGEN_SERVER_SLOT__" + b"S" * 256)[:256]
@@ -145,6 +150,11 @@ def build(platform, server, token, output_path, paired=True):
             if package["directory"] != "linux-x64" and any(name.startswith(("colprof", "profcheck")) for name in files):
                 add_file(archive, os.path.join(ROOT, "icc-companion", "ArgyllCMS-LICENSE.txt"),
                          "ArgyllCMS-LICENSE.txt")
+        for name in STAGE_MODULES:
+            path = os.path.join(STAGE_DIR, name)
+            if not os.path.isfile(path):
+                fail("Companion stage modules are not installed")
+            add_file(archive, path, "stages/" + name)
         for name in files:
             path = os.path.join(binary_dir, name)
             if not os.path.isfile(path):
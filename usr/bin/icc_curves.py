@@ -0,0 +1,140 @@
+"""Piecewise-linear measured responses shared by the PGenerator+ ICC tools.
+
+The builder, the fine-tune pass and the B2A repair each interpolate measured
+(code, response) samples: a channel ramp, the neutral luminance curve, a grey
+series of XYZ readings. They used to walk the sample list from the start for
+every lookup, and lookups run once per 4096-entry calibration point or per
+cLUT corridor node.
+
+PiecewiseLinearCurve keeps the samples as a tuple and answers the same
+lookups with bisect. The searches reproduce the first-crossing rule of those
+scans exactly, also on flat or noisy columns: each search key is the running
+maximum of the column, so bisect stops at the first sample the scan would
+have stopped at. sample_many() and invert_many() walk ascending queries
+forward in step with the samples instead of searching for each one.
+"""
+
+import bisect
+
+
+# invert() treats responses within this distance as equal, so a target that
+# differs from a fitted plateau by a few ulps still lands on its start.
+RESPONSE_TOLERANCE = 1e-12
+
+
+def _running_maximum(values):
+    keys = []
+    highest = None
+    for value in values:
+        highest = value if highest is None or value > highest else highest
+        keys.append(highest)
+    return keys
+
+
+class PiecewiseLinearCurve(tuple):
+    """Sorted (x, y) samples of a measured response with bisect lookups.
+
+    The curve is the tuple of its (x, y) pairs, so code that indexes or
+    iterates samples keeps working. y may be a tuple of channels for
+    locate(); sample() and invert() need scalar responses.
+    """
+
+    def __new__(cls, samples):
+        self = tuple.__new__(cls, [(x, y) for x, y in samples])
+        if not self:
+            raise ValueError("A response curve needs at least one sample")
+        self._x_keys = _running_maximum([x for x, _ in self[1:]])
+        self._y_keys = {}
+        return self
+
+    def locate(self, x):
+        """Index of the first sample from the second on with x at or below its x.
+
+        Returns len(self) when x lies beyond every sample.
+        """
+        return bisect.bisect_left(self._x_keys, x) + 1
+
+    def _value_keys(self, tolerance):
+        keys = self._y_keys.get(tolerance)
+        if keys is None:
+            keys = self._y_keys[tolerance] = _running_maximum(
+                [response + tolerance if tolerance else response
+                 for _, response in self[1:]])
+        return keys
+
+    def locate_value(self, y, tolerance=0.0):
+        """Index of the first sample from the second on with y <= its y + tolerance.
+
+        Returns len(self) when y lies above every sample.
+        """
+        return bisect.bisect_left(self._value_keys(tolerance), y) + 1
+
+    def _sample_at(self, x, index):
+        if x <= self[0][0]:
+            return self[0][1]
+        if index >= len(self):
+            return self[-1][1]
+        x0, y0 = self[index - 1]
+        x1, y1 = self[index]
+        fraction = 0.0 if x1 <= x0 else (x - x0) / (x1 - x0)
+        return y0 + fraction * (y1 - y0)
+
+    def sample(self, x):
+        """Linearly interpolate the response at x, holding the end samples."""
+        return self._sample_at(x, self.locate(x))
+
+    def sample_many(self, positions):
+        """sample() for a sequence of positions, fastest when ascending."""
+        return self._walk(positions, self.locate, self._x_keys, self._sample_at)
+
+    def _invert_at(self, target, index):
+        target = min(target, self[-1][1])
+        if target <= self[0][1]:
+            return self[0][0]
+        if index >= len(self):
+            return self[-1][0]
+        x0, y0 = self[index - 1]
+        x1, y1 = self[index]
+        if y1 <= y0 + RESPONSE_TOLERANCE:
+            return x0
+        return x0 + (target - y0) / (y1 - y0) * (x1 - x0)
+
+    def invert(self, target):
+        """Code whose response is target, choosing the start of a plateau.
+
+        Targets beyond the measured response return the end codes.
+        """
+        return self._invert_at(target, self.locate_value(
+            min(target, self[-1][1]), RESPONSE_TOLERANCE))
+
+    def invert_many(self, targets):
+        """invert() for a sequence of targets, fastest when ascending."""
+        peak = self[-1][1]
+        return self._walk(
+            [min(target, peak) for target in targets],
+            lambda target: self.locate_value(target, RESPONSE_TOLERANCE),
+            self._value_keys(RESPONSE_TOLERANCE), self._invert_at)
+
+    @staticmethod
+    def _walk(queries, locate, keys, evaluate):
+        """Evaluate queries, advancing one search index while they ascend."""
+        results = []
+        index = None
+        previous = None
+        count = len(keys)
+        for query in queries:
+            if index is None or query < previous:
+                index = locate(query)
+            else:
+                while index <= count and keys[index - 1] < query:
+                    index += 1
+            results.append(evaluate(query, index))
+            previous = query
+        return results
+
+
+def response_curve(samples):
+    """Return samples as a PiecewiseLinearCurve, converting a plain list once."""
+    if isinstance(samples, PiecewiseLinearCurve):
+        return samples
+    return PiecewiseLinearCurve(samples)
@@ -0,0 +1,101 @@
+"""Wake on changes to a directory's entries, with Linux inotify when available.
+
+The Companion offload hands a job to the WebUI through files in one directory
+and then waits, for up to hours, until the WebUI renames result.icc or
+error.txt into place. DirectoryWatch.wait() returns as soon as an entry there
+is written, renamed in or removed, instead of at the next poll tick. inotify
+is reached through ctypes, so nothing beyond the standard library is needed.
+Without it (another kernel, an exhausted watch limit, PGEN_ICC_NO_INOTIFY=1)
+wait() sleeps for the poll interval, which is the former polling loop.
+
+An event only wakes the caller, which then looks at the files itself, so a
+coalesced or missed event can delay an answer until the next timeout but
+never changes it.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import time
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+
+_libc = None
+
+
+def _inotify_libc():
+    """The C library if it provides inotify, else None."""
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                               use_errno=True)
+            libc.inotify_init1
+            libc.inotify_add_watch
+        except (OSError, AttributeError):
+            libc = False
+        _libc = libc
+    return _libc or None
+
+
+class DirectoryWatch(object):
+    """Context manager whose wait() wakes when an entry of path changes.
+
+    active tells whether inotify is in use; when it is not, every wait() is
+    cut to poll_seconds.
+    """
+
+    def __init__(self, path, poll_seconds):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.fd = None
+
+    @property
+    def active(self):
+        return self.fd is not None
+
+    def __enter__(self):
+        libc = None if os.environ.get("PGEN_ICC_NO_INOTIFY") == "1" else _inotify_libc()
+        if libc is None:
+            return self
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return self
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), WATCH_MASK) < 0:
+            os.close(fd)
+            return self
+        self.fd = fd
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        return False
+
+    def wait(self, timeout):
+        """Block until an entry changes or timeout seconds pass; True on a change."""
+        timeout = max(0.0, timeout)
+        if self.fd is None:
+            time.sleep(min(timeout, self.poll_seconds))
+            return False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return False
+        # Drain the queued events; the caller re-reads the files either way.
+        while True:
+            try:
+                if not os.read(self.fd, 4096):
+                    break
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+        return True
@@ -43,6 +43,9 @@ import subprocess
 import sys
 import tempfile
 
+import icc_mft2
+from icc_curves import PiecewiseLinearCurve, response_curve
+
 M1 = 2610.0 / 16384.0
 M2 = 2523.0 / 32.0
 C1 = 3424.0 / 4096.0
@@ -278,8 +281,7 @@ def de2000(xyz_a, xyz_b):
 
 
 def read_profile(path):
-    with open(path, "rb") as handle:
-        data = bytearray(handle.read())
+    data = bytearray(icc_mft2.read_profile(path))
     count = struct.unpack(">I", bytes(data[128:132]))[0]
     tags = {}
     for index in range(count):
@@ -436,34 +438,16 @@ def isotonic_channel_samples(samples):
     peak = fitted[-1]
     if peak <= 1e-9:
         return None
-    return [(collapsed[index][0], fitted[index] / peak)
-            for index in range(len(collapsed))]
+    return PiecewiseLinearCurve((collapsed[index][0], fitted[index] / peak)
+                                for index in range(len(collapsed)))
 
 
 def sample_pairs(samples, position):
-    if position <= samples[0][0]:
-        return samples[0][1]
-    for index in range(1, len(samples)):
-        if samples[index][0] >= position:
-            x0, y0 = samples[index - 1]
-            x1, y1 = samples[index]
-            fraction = 0.0 if x1 <= x0 else (position - x0) / (x1 - x0)
-            return y0 + fraction * (y1 - y0)
-    return samples[-1][1]
+    return response_curve(samples).sample(position)
 
 
 def invert_pairs(samples, target):
-    target = max(samples[0][1], min(samples[-1][1], target))
-    if target <= samples[0][1]:
-        return samples[0][0]
-    for index in range(1, len(samples)):
-        x0, y0 = samples[index - 1]
-        x1, y1 = samples[index]
-        if target <= y1 + 1e-12:
-            if y1 <= y0 + 1e-12:
-                return x0
-            return x0 + (target - y0) / (y1 - y0) * (x1 - x0)
-    return samples[-1][0]
+    return response_curve(samples).invert(target)
 
 
 def sample_values(values, position):
@@ -1274,27 +1258,23 @@ def finetune(payload, output_dir):
     def mhc2_residual_gains(source_code):
         return interpolate_gains(mhc2_keyed, source_code)
 
+    neutral_curve = PiecewiseLinearCurve(neutral)
+
     def measured_lum(code):
-        if code <= neutral[0][0]:
-            return neutral[0][1]
-        for i in range(1, len(neutral)):
-            if neutral[i][0] >= code:
-                c0, y0 = neutral[i - 1]
-                c1, y1 = neutral[i]
-                t = 0.0 if c1 == c0 else (code - c0) / (c1 - c0)
-                return y0 + t * (y1 - y0)
-        return neutral[-1][1]
+        return neutral_curve.sample(code)
 
     def code_for_lum(target):
+        # The raw neutral luminance is not fitted monotonic; the first
+        # sample reaching the target wins, as a forward scan would choose.
         if target <= neutral[0][1]:
             return neutral[0][0]
-        for i in range(1, len(neutral)):
-            if neutral[i][1] >= target:
-                c0, y0 = neutral[i - 1]
-                c1, y1 = neutral[i]
-                t = 0.0 if y1 == y0 else (target - y0) / (y1 - y0)
-                return c0 + t * (c1 - c0)
-        return neutral[-1][0]
+        i = neutral_curve.locate_value(target)
+        if i >= len(neutral):
+            return neutral[-1][0]
+        c0, y0 = neutral[i - 1]
+        c1, y1 = neutral[i]
+        t = 0.0 if y1 == y0 else (target - y0) / (y1 - y0)
+        return c0 + t * (c1 - c0)
 
     # Local slope of the neutral response just below the knee, in wire code
     # per unit log-luminance. Inside the plateau the luminance inverse is
@@ -0,0 +1,689 @@
+"""Compact ICC lut16 (mft2) tables shared by the PGenerator+ ICC tools.
+
+A 65^3 mft2 cLUT holds about 824k values. Decoding it into a Python list of
+floats costs roughly 20 MB of boxed objects per copy, and several build stages
+used to do that independently for the same tag. Mft2Lut keeps the tag words in
+one native array('H') and creates normalized array('d') views only when an
+evaluator first asks for them. load_mft2() shares one decode between every
+caller that reads the same payload, including linked B2A0/B2A1 copies.
+
+Mft2Evaluator samples a tag for single points or for flat batches. Only the
+Python standard library is required; when NumPy is installed, large batches
+are evaluated as arrays with the same arithmetic in the same order. Every
+stage is piecewise linear, so a tetrahedral evaluator also returns its exact
+3x3 derivative alongside a value for the Newton solvers.
+
+read_profile() keeps recently read ICC files so a long-lived process such as
+icc_worker.py does not re-read and re-decode a profile between requests.
+Decoded tags are shared, so the NumPy views of them are read-only, and
+clear_caches() drops both caches once a build no longer needs them.
+"""
+
+import array
+import collections
+import functools
+import os
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:  # The pure-Python loops are the reference path.
+    numpy = None
+
+
+# ICC v2 lut16 encodes PCS XYZ over 0.0 through 1.99997.
+XYZ_TO_MFT = 65536.0 / (2.0 * 65535.0)
+# Below this many points a NumPy call costs more than the Python loop.
+NUMPY_MIN_POINTS = 256
+# Recently read profiles, keyed by path and file identity.
+PROFILE_CACHE_ENTRIES = 4
+# Decoded mft2 tags. A build works on one A2B0 and one B2A0 at a time, plus
+# the virtual profile's; each 65^3 decode holds several MB.
+MFT2_CACHE_ENTRIES = 3
+
+_profile_cache = collections.OrderedDict()
+
+
+def numpy_enabled():
+    """Use NumPy batch paths when installed, unless PGEN_ICC_NUMPY=0."""
+    return numpy is not None and os.environ.get("PGEN_ICC_NUMPY", "1") != "0"
+
+
+def read_profile(path):
+    """Return the bytes of an ICC file, reused while it is unchanged on disk."""
+    status = os.stat(path)
+    # Profiles are replaced atomically, so a rewrite changes the inode and
+    # mtime even when the size happens to match.
+    key = (os.path.realpath(path), status.st_ino, status.st_size, status.st_mtime_ns)
+    data = _profile_cache.get(key)
+    if data is not None:
+        _profile_cache.move_to_end(key)
+        return data
+    with open(path, "rb") as handle:
+        data = handle.read()
+    _profile_cache[key] = data
+    while len(_profile_cache) > PROFILE_CACHE_ENTRIES:
+        _profile_cache.popitem(last=False)
+    return data
+
+
+class Mft2Lut:
+    """Header fields and lazily normalized tables of one mft2 tag."""
+
+    def __init__(self, payload):
+        if len(payload) < 52 or payload[:4] != b"mft2":
+            raise ValueError("ICC table is not an mft2 transform")
+        self.payload = bytes(payload)
+        self.input_channels = payload[8]
+        self.output_channels = payload[9]
+        self.grid = payload[10]
+        self.matrix = [value / 65536.0 for value in struct.unpack_from(">9i", payload, 12)]
+        self.input_entries, self.output_entries = struct.unpack_from(">HH", payload, 48)
+        self.input_start = 52
+        self.clut_start = self.input_start + self.input_channels * self.input_entries * 2
+        self.clut_values = self.grid ** self.input_channels * self.output_channels
+        self.output_start = self.clut_start + self.clut_values * 2
+        self.end = self.output_start + self.output_channels * self.output_entries * 2
+        if self.end > len(payload):
+            raise ValueError("ICC mft2 table is truncated")
+        # Every table is big-endian uint16. Hold them as one native word array
+        # indexed from the first input table.
+        words = array.array("H")
+        words.frombytes(self.payload[self.input_start:self.end])
+        if sys.byteorder == "little":
+            words.byteswap()
+        self.words = words
+        self._input_tables = None
+        self._output_tables = None
+        self._clut = None
+
+    def _normalized(self, start, count):
+        first = (start - self.input_start) // 2
+        return array.array("d", (value / 65535.0
+                                 for value in self.words[first:first + count]))
+
+    def input_table_words(self, channel):
+        first = channel * self.input_entries
+        return self.words[first:first + self.input_entries]
+
+    def clut_words(self):
+        first = (self.clut_start - self.input_start) // 2
+        return self.words[first:first + self.clut_values]
+
+    def output_table_words(self, channel):
+        first = (self.output_start - self.input_start) // 2 + channel * self.output_entries
+        return self.words[first:first + self.output_entries]
+
+    @property
+    def input_tables(self):
+        if self._input_tables is None:
+            self._input_tables = [
+                self._normalized(self.input_start + channel * self.input_entries * 2,
+                                 self.input_entries)
+                for channel in range(self.input_channels)
+            ]
+        return self._input_tables
+
+    @property
+    def output_tables(self):
+        if self._output_tables is None:
+            self._output_tables = [
+                self._normalized(self.output_start + channel * self.output_entries * 2,
+                                 self.output_entries)
+                for channel in range(self.output_channels)
+            ]
+        return self._output_tables
+
+    @property
+    def clut(self):
+        """Flat normalized cLUT, output channels fastest."""
+        if self._clut is None:
+            self._clut = self._normalized(self.clut_start, self.clut_values)
+        return self._clut
+
+
+@functools.lru_cache(maxsize=MFT2_CACHE_ENTRIES)
+def _load_mft2(payload):
+    return Mft2Lut(payload)
+
+
+def load_mft2(payload):
+    """Return the shared Mft2Lut for an mft2 payload, decoding it at most once."""
+    return _load_mft2(bytes(payload))
+
+
+def clear_caches():
+    """Forget every cached profile and decoded tag."""
+    _load_mft2.cache_clear()
+    _profile_cache.clear()
+
+
+def readonly_array(values):
+    """NumPy view of one of a shared Mft2Lut's arrays that cannot be written.
+
+    The arrays belong to every caller of load_mft2() for the same payload,
+    so an in-place edit through a writable view would change them for all.
+    """
+    view = numpy.frombuffer(values)
+    view.flags.writeable = False
+    return view
+
+
+def _sample(table, position):
+    position = max(0.0, min(1.0, position))
+    spot = position * (len(table) - 1)
+    low = min(len(table) - 2, int(spot))
+    fraction = spot - low
+    return table[low] * (1.0 - fraction) + table[low + 1] * fraction
+
+
+def _sample_slope(table, position):
+    """Derivative of _sample: the slope of the segment it interpolates."""
+    if position < 0.0 or position > 1.0:
+        return 0.0
+    spot = position * (len(table) - 1)
+    low = min(len(table) - 2, int(spot))
+    return (table[low + 1] - table[low]) * (len(table) - 1)
+
+
+def _scale_jacobian(jacobian, s0, s1, s2):
+    """Scale the rows of a flat row-major 3x3 Jacobian."""
+    j0, j1, j2, j3, j4, j5, j6, j7, j8 = jacobian
+    return [j0 * s0, j1 * s0, j2 * s0, j3 * s1, j4 * s1, j5 * s1,
+            j6 * s2, j7 * s2, j8 * s2]
+
+
+def _multiply_jacobian(matrix, jacobian):
+    """Left-multiply a flat row-major 3x3 Jacobian by a flat 3x3 matrix."""
+    m0, m1, m2, m3, m4, m5, m6, m7, m8 = matrix
+    j0, j1, j2, j3, j4, j5, j6, j7, j8 = jacobian
+    return [m0 * j0 + m1 * j3 + m2 * j6, m0 * j1 + m1 * j4 + m2 * j7,
+            m0 * j2 + m1 * j5 + m2 * j8, m3 * j0 + m4 * j3 + m5 * j6,
+            m3 * j1 + m4 * j4 + m5 * j7, m3 * j2 + m4 * j5 + m5 * j8,
+            m6 * j0 + m7 * j3 + m8 * j6, m6 * j1 + m7 * j4 + m8 * j7,
+            m6 * j2 + m7 * j5 + m8 * j8]
+
+
+def _numpy_sample_tables(tables, positions):
+    """Sample one table per column of an (N, 3) array, as _sample does."""
+    result = numpy.empty_like(positions)
+    for channel in range(3):
+        table = tables[channel]
+        spot = numpy.clip(positions[:, channel], 0.0, 1.0) * (len(table) - 1)
+        low = numpy.minimum(len(table) - 2, spot.astype(numpy.intp))
+        fraction = spot - low
+        result[:, channel] = (table[low] * (1.0 - fraction)
+                              + table[low + 1] * fraction)
+    return result
+
+
+def _numpy_sample_slopes(tables, positions):
+    """Per-point _sample_slope of one table per column of an (N, 3) array."""
+    result = numpy.empty_like(positions)
+    for channel in range(3):
+        table = tables[channel]
+        value = positions[:, channel]
+        spot = numpy.clip(value, 0.0, 1.0) * (len(table) - 1)
+        low = numpy.minimum(len(table) - 2, spot.astype(numpy.intp))
+        result[:, channel] = numpy.where(
+            (value < 0.0) | (value > 1.0), 0.0,
+            (table[low + 1] - table[low]) * (len(table) - 1))
+    return result
+
+
+def _numpy_scale_jacobian(jacobian, scales):
+    return jacobian * numpy.repeat(scales, 3, axis=1)
+
+
+def _numpy_multiply_jacobian(matrix, jacobian):
+    result = numpy.empty_like(jacobian)
+    for row in range(3):
+        for column in range(3):
+            result[:, row * 3 + column] = (
+                matrix[row * 3] * jacobian[:, column]
+                + matrix[row * 3 + 1] * jacobian[:, 3 + column]
+                + matrix[row * 3 + 2] * jacobian[:, 6 + column])
+    return result
+
+
+def _numpy_matrix(matrix, values):
+    result = numpy.empty_like(values)
+    for row in range(3):
+        result[:, row] = (matrix[row * 3] * values[:, 0]
+                          + matrix[row * 3 + 1] * values[:, 1]
+                          + matrix[row * 3 + 2] * values[:, 2])
+    return result
+
+
+def _numpy_trilinear(table, grid, coordinates):
+    """Trilinearly sample an (N, 3) array; table is (grid^3, 3)."""
+    positions = numpy.clip(coordinates, 0.0, 1.0) * (grid - 1)
+    lows = numpy.minimum(grid - 2, positions.astype(numpy.intp))
+    fractions = positions - lows
+    base = (lows[:, 0] * grid + lows[:, 1]) * grid + lows[:, 2]
+    result = numpy.zeros_like(positions)
+    for red in (0, 1):
+        red_weight = fractions[:, 0] if red else 1.0 - fractions[:, 0]
+        for green in (0, 1):
+            green_weight = fractions[:, 1] if green else 1.0 - fractions[:, 1]
+            for blue in (0, 1):
+                blue_weight = fractions[:, 2] if blue else 1.0 - fractions[:, 2]
+                weight = red_weight * green_weight * blue_weight
+                nodes = table[base + (red * grid + green) * grid + blue]
+                result += nodes * weight[:, None]
+    return result
+
+
+def _numpy_tetrahedral(table, grid, coordinates):
+    """Tetrahedrally sample an (N, 3) array; table is (grid^3, 3)."""
+    positions = numpy.clip(coordinates, 0.0, 1.0) * (grid - 1)
+    lows = numpy.minimum(grid - 2, positions.astype(numpy.intp))
+    fractions = positions - lows
+    red, green, blue = fractions[:, 0], fractions[:, 1], fractions[:, 2]
+    base = (lows[:, 0] * grid + lows[:, 1]) * grid + lows[:, 2]
+    red_step, green_step, blue_step = grid * grid, grid, 1
+    red_green = red >= green
+    green_blue = green >= blue
+    red_blue = red >= blue
+    # The six simplices in the scalar sampler's branch order.
+    cases = [
+        red_green & green_blue,
+        red_green & ~green_blue & red_blue,
+        red_green & ~green_blue & ~red_blue,
+        ~red_green & red_blue,
+        ~red_green & ~red_blue & green_blue,
+        ~red_green & ~red_blue & ~green_blue,
+    ]
+    first_middle = numpy.select(cases, (
+        red_step, red_step, blue_step, green_step, green_step, blue_step))
+    second_middle = numpy.select(cases, (
+        red_step + green_step, red_step + blue_step, red_step + blue_step,
+        red_step + green_step, green_step + blue_step, green_step + blue_step))
+    weights = [
+        numpy.select(cases, (red, red, blue, green, green, blue)),
+        numpy.select(cases, (green, blue, red, red, blue, green)),
+        numpy.select(cases, (blue, green, green, blue, red, red)),
+    ]
+    first = table[base]
+    middle = (table[base + first_middle], table[base + second_middle])
+    last = table[base + red_step + green_step + blue_step]
+    return (first
+            + weights[0][:, None] * (middle[0] - first)
+            + weights[1][:, None] * (middle[1] - middle[0])
+            + weights[2][:, None] * (last - middle[1]))
+
+
+def _numpy_tetrahedral_jacobian(table, grid, coordinates):
+    """_numpy_tetrahedral plus the (N, 9) row-major derivative of each sample.
+
+    Within a simplex the value is linear in the three fractions, and each
+    fraction's slope is the edge of the simplex it walks along.
+    """
+    positions = numpy.clip(coordinates, 0.0, 1.0) * (grid - 1)
+    lows = numpy.minimum(grid - 2, positions.astype(numpy.intp))
+    fractions = positions - lows
+    red, green, blue = fractions[:, 0], fractions[:, 1], fractions[:, 2]
+    base = (lows[:, 0] * grid + lows[:, 1]) * grid + lows[:, 2]
+    red_step, green_step, blue_step = grid * grid, grid, 1
+    red_green = red >= green
+    green_blue = green >= blue
+    red_blue = red >= blue
+    cases = [
+        red_green & green_blue,
+        red_green & ~green_blue & red_blue,
+        red_green & ~green_blue & ~red_blue,
+        ~red_green & red_blue,
+        ~red_green & ~red_blue & green_blue,
+        ~red_green & ~red_blue & ~green_blue,
+    ]
+    first_middle = numpy.select(cases, (
+        red_step, red_step, blue_step, green_step, green_step, blue_step))
+    second_middle = numpy.select(cases, (
+        red_step + green_step, red_step + blue_step, red_step + blue_step,
+        red_step + green_step, green_step + blue_step, green_step + blue_step))
+    weights = [
+        numpy.select(cases, (red, red, blue, green, green, blue)),
+        numpy.select(cases, (green, blue, red, red, blue, green)),
+        numpy.select(cases, (blue, green, green, blue, red, red)),
+    ]
+    # The input axis behind each weight.
+    axes = [
+        numpy.select(cases, (0, 0, 2, 1, 1, 2)),
+        numpy.select(cases, (1, 2, 0, 0, 2, 1)),
+        numpy.select(cases, (2, 1, 1, 2, 0, 0)),
+    ]
+    first = table[base]
+    middle = (table[base + first_middle], table[base + second_middle])
+    last = table[base + red_step + green_step + blue_step]
+    edges = (middle[0] - first, middle[1] - middle[0], last - middle[1])
+    values = (first
+              + weights[0][:, None] * edges[0]
+              + weights[1][:, None] * edges[1]
+              + weights[2][:, None] * edges[2])
+    slopes = numpy.zeros((len(coordinates), 3, 3))
+    points = numpy.arange(len(coordinates))
+    for edge, axis in zip(edges, axes):
+        slopes[points, :, axis] = edge
+    inside = (coordinates >= 0.0) & (coordinates <= 1.0)
+    slopes *= numpy.where(inside, float(grid - 1), 0.0)[:, None, :]
+    return values, slopes.reshape(-1, 9)
+
+
+class Mft2Evaluator:
+    """Evaluate a three-channel mft2 tag for one point or a flat batch.
+
+    The tools grew evaluators that apply the tag matrix before the input
+    shapers (B2A), after them (the builder's A2B) or not at all, and that
+    encode PCS XYZ either by multiplying with XYZ_TO_MFT or by dividing by
+    65535/32768. Each form is kept so every caller stays bit-identical to its
+    former private evaluator. The cLUT is tetrahedral or trilinear.
+    """
+
+    def __init__(self, lut, matrix=None, input_multiplier=None,
+                 input_divisor=None, output_divisor=None, tetrahedral=False):
+        if lut.input_channels != 3 or lut.output_channels != 3 or lut.grid < 2:
+            raise ValueError("ICC mft2 transform is not three-channel RGB")
+        if matrix not in (None, "before", "after"):
+            raise ValueError("Unsupported mft2 matrix placement")
+        self.lut = lut
+        self.matrix = matrix
+        self.input_multiplier = input_multiplier
+        self.input_divisor = input_divisor
+        self.output_divisor = output_divisor
+        self.tetrahedral = tetrahedral
+        self._arrays = None
+
+    def __call__(self, point):
+        return list(self._evaluate_python(point))
+
+    def evaluate_many(self, points):
+        """Evaluate a flat x0 y0 z0 x1 ... sequence into a flat array('d')."""
+        if numpy_enabled() and len(points) >= NUMPY_MIN_POINTS * 3:
+            result = self.evaluate_array(
+                numpy.asarray(points, dtype=float).reshape(-1, 3))
+            flat = array.array("d")
+            flat.frombytes(result.tobytes())
+            return flat
+        return self._evaluate_python(points)
+
+    def evaluate_array(self, points):
+        """Evaluate an (N, 3) NumPy array into an (N, 3) NumPy array."""
+        lut = self.lut
+        input_tables, clut, output_tables = self._array_tables()
+        values = points
+        if self.matrix == "before":
+            values = _numpy_matrix(lut.matrix, values)
+        if self.input_multiplier is not None:
+            values = values * self.input_multiplier
+        elif self.input_divisor is not None:
+            values = values / self.input_divisor
+        values = _numpy_sample_tables(input_tables, values)
+        if self.matrix == "after":
+            values = _numpy_matrix(lut.matrix, values)
+        sampler = _numpy_tetrahedral if self.tetrahedral else _numpy_trilinear
+        values = _numpy_sample_tables(output_tables, sampler(clut, lut.grid, values))
+        if self.output_divisor is not None:
+            values = values / self.output_divisor
+        return values
+
+    def _array_tables(self):
+        if self._arrays is None:
+            lut = self.lut
+            self._arrays = (
+                [readonly_array(table) for table in lut.input_tables],
+                readonly_array(lut.clut).reshape(-1, 3),
+                [readonly_array(table) for table in lut.output_tables],
+            )
+        return self._arrays
+
+    def evaluate_with_jacobian(self, point):
+        """Return (value, jacobian) for one point in a single pass.
+
+        jacobian is the flat row-major 3x3 derivative of the output channels
+        by the input channels. The value equals self(point). A clamped input
+        has zero slope; at a table or cLUT node the segment above it is used.
+        """
+        lut = self.lut
+        if not self.tetrahedral:
+            raise ValueError("mft2 Jacobians need a tetrahedral evaluator")
+        in0, in1, in2 = lut.input_tables
+        out0, out1, out2 = lut.output_tables
+        m0, m1, m2, m3, m4, m5, m6, m7, m8 = lut.matrix
+        x, y, z = point[0], point[1], point[2]
+        jacobian = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]
+        if self.matrix == "before":
+            x, y, z = (m0 * x + m1 * y + m2 * z,
+                       m3 * x + m4 * y + m5 * z,
+                       m6 * x + m7 * y + m8 * z)
+            jacobian = _multiply_jacobian(lut.matrix, jacobian)
+        if self.input_multiplier is not None:
+            multiplier = self.input_multiplier
+            x, y, z = x * multiplier, y * multiplier, z * multiplier
+            jacobian = [value * multiplier for value in jacobian]
+        elif self.input_divisor is not None:
+            divisor = self.input_divisor
+            x, y, z = x / divisor, y / divisor, z / divisor
+            jacobian = [value / divisor for value in jacobian]
+        jacobian = _scale_jacobian(jacobian, _sample_slope(in0, x),
+                                   _sample_slope(in1, y), _sample_slope(in2, z))
+        x, y, z = _sample(in0, x), _sample(in1, y), _sample(in2, z)
+        if self.matrix == "after":
+            x, y, z = (m0 * x + m1 * y + m2 * z,
+                       m3 * x + m4 * y + m5 * z,
+                       m6 * x + m7 * y + m8 * z)
+            jacobian = _multiply_jacobian(lut.matrix, jacobian)
+        (x, y, z), slopes = self._tetrahedral_jacobian(lut.clut, lut.grid, x, y, z)
+        jacobian = _multiply_jacobian(slopes, jacobian)
+        jacobian = _scale_jacobian(jacobian, _sample_slope(out0, x),
+                                   _sample_slope(out1, y), _sample_slope(out2, z))
+        x, y, z = _sample(out0, x), _sample(out1, y), _sample(out2, z)
+        if self.output_divisor is not None:
+            divisor = self.output_divisor
+            x, y, z = x / divisor, y / divisor, z / divisor
+            jacobian = [value / divisor for value in jacobian]
+        return [x, y, z], jacobian
+
+    def evaluate_array_with_jacobian(self, points):
+        """NumPy twin of evaluate_with_jacobian: (N, 3) values, (N, 9) Jacobians."""
+        lut = self.lut
+        if not self.tetrahedral:
+            raise ValueError("mft2 Jacobians need a tetrahedral evaluator")
+        input_tables, clut, output_tables = self._array_tables()
+        values = points
+        jacobian = numpy.tile(numpy.array([1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]),
+                              (len(points), 1))
+        if self.matrix == "before":
+            values = _numpy_matrix(lut.matrix, values)
+            jacobian = _numpy_multiply_jacobian(lut.matrix, jacobian)
+        if self.input_multiplier is not None:
+            values = values * self.input_multiplier
+            jacobian = jacobian * self.input_multiplier
+        elif self.input_divisor is not None:
+            values = values / self.input_divisor
+            jacobian = jacobian / self.input_divisor
+        jacobian = _numpy_scale_jacobian(jacobian, _numpy_sample_slopes(input_tables, values))
+        values = _numpy_sample_tables(input_tables, values)
+        if self.matrix == "after":
+            values = _numpy_matrix(lut.matrix, values)
+            jacobian = _numpy_multiply_jacobian(lut.matrix, jacobian)
+        values, slopes = _numpy_tetrahedral_jacobian(clut, lut.grid, values)
+        result = numpy.empty_like(jacobian)
+        for row in range(3):
+            for column in range(3):
+                result[:, row * 3 + column] = (
+                    slopes[:, row * 3] * jacobian[:, column]
+                    + slopes[:, row * 3 + 1] * jacobian[:, 3 + column]
+                    + slopes[:, row * 3 + 2] * jacobian[:, 6 + column])
+        jacobian = _numpy_scale_jacobian(result, _numpy_sample_slopes(output_tables, values))
+        values = _numpy_sample_tables(output_tables, values)
+        if self.output_divisor is not None:
+            values = values / self.output_divisor
+            jacobian = jacobian / self.output_divisor
+        return values, jacobian
+
+    def _evaluate_python(self, points):
+        lut = self.lut
+        grid = lut.grid
+        clut = lut.clut
+        in0, in1, in2 = lut.input_tables
+        out0, out1, out2 = lut.output_tables
+        m0, m1, m2, m3, m4, m5, m6, m7, m8 = lut.matrix
+        before = self.matrix == "before"
+        after = self.matrix == "after"
+        multiplier = self.input_multiplier
+        divisor = self.input_divisor
+        output_divisor = self.output_divisor
+        sample_clut = self._tetrahedral if self.tetrahedral else self._trilinear
+        result = array.array("d", bytes(8 * len(points)))
+        for index in range(0, len(points), 3):
+            x, y, z = points[index], points[index + 1], points[index + 2]
+            if before:
+                x, y, z = (m0 * x + m1 * y + m2 * z,
+                           m3 * x + m4 * y + m5 * z,
+                           m6 * x + m7 * y + m8 * z)
+            if multiplier is not None:
+                x, y, z = x * multiplier, y * multiplier, z * multiplier
+            elif divisor is not None:
+                x, y, z = x / divisor, y / divisor, z / divisor
+            x, y, z = _sample(in0, x), _sample(in1, y), _sample(in2, z)
+            if after:
+                x, y, z = (m0 * x + m1 * y + m2 * z,
+                           m3 * x + m4 * y + m5 * z,
+                           m6 * x + m7 * y + m8 * z)
+            x, y, z = sample_clut(clut, grid, x, y, z)
+            x, y, z = _sample(out0, x), _sample(out1, y), _sample(out2, z)
+            if output_divisor is not None:
+                x, y, z = x / output_divisor, y / output_divisor, z / output_divisor
+            result[index] = x
+            result[index + 1] = y
+            result[index + 2] = z
+        return result
+
+    @staticmethod
+    def _trilinear(clut, grid, x, y, z):
+        limit = grid - 1
+        x = max(0.0, min(1.0, x)) * limit
+        y = max(0.0, min(1.0, y)) * limit
+        z = max(0.0, min(1.0, z)) * limit
+        red = min(grid - 2, int(x))
+        green = min(grid - 2, int(y))
+        blue = min(grid - 2, int(z))
+        fr, fg, fb = x - red, y - green, z - blue
+        ir, ig, ib = 1.0 - fr, 1.0 - fg, 1.0 - fb
+        o000 = ((red * grid + green) * grid + blue) * 3
+        o001 = o000 + 3
+        o010 = o000 + grid * 3
+        o011 = o010 + 3
+        o100 = o000 + grid * grid * 3
+        o101 = o100 + 3
+        o110 = o100 + grid * 3
+        o111 = o110 + 3
+        w000 = ir * ig * ib
+        w001 = ir * ig * fb
+        w010 = ir * fg * ib
+        w011 = ir * fg * fb
+        w100 = fr * ig * ib
+        w101 = fr * ig * fb
+        w110 = fr * fg * ib
+        w111 = fr * fg * fb
+        return ((clut[o000] * w000 + clut[o001] * w001
+                 + clut[o010] * w010 + clut[o011] * w011
+                 + clut[o100] * w100 + clut[o101] * w101
+                 + clut[o110] * w110 + clut[o111] * w111),
+                (clut[o000 + 1] * w000 + clut[o001 + 1] * w001
+                 + clut[o010 + 1] * w010 + clut[o011 + 1] * w011
+                 + clut[o100 + 1] * w100 + clut[o101 + 1] * w101
+                 + clut[o110 + 1] * w110 + clut[o111 + 1] * w111),
+                (clut[o000 + 2] * w000 + clut[o001 + 2] * w001
+                 + clut[o010 + 2] * w010 + clut[o011 + 2] * w011
+                 + clut[o100 + 2] * w100 + clut[o101 + 2] * w101
+                 + clut[o110 + 2] * w110 + clut[o111 + 2] * w111))
+
+    @staticmethod
+    def _tetrahedral_jacobian(clut, grid, x, y, z):
+        """_tetrahedral plus the flat row-major derivative of the sample."""
+        limit = grid - 1
+        inside = [0.0 <= value <= 1.0 for value in (x, y, z)]
+        x = max(0.0, min(1.0, x)) * limit
+        y = max(0.0, min(1.0, y)) * limit
+        z = max(0.0, min(1.0, z)) * limit
+        red = min(grid - 2, int(x))
+        green = min(grid - 2, int(y))
+        blue = min(grid - 2, int(z))
+        fr, fg, fb = x - red, y - green, z - blue
+        step_r, step_g, step_b = grid * grid * 3, grid * 3, 3
+        first = ((red * grid + green) * grid + blue) * 3
+        last = first + step_r + step_g + step_b
+        if fr >= fg:
+            if fg >= fb:
+                middle0, middle1, w0, w1, w2, axes = step_r, step_r + step_g, fr, fg, fb, (0, 1, 2)
+            elif fr >= fb:
+                middle0, middle1, w0, w1, w2, axes = step_r, step_r + step_b, fr, fb, fg, (0, 2, 1)
+            else:
+                middle0, middle1, w0, w1, w2, axes = step_b, step_r + step_b, fb, fr, fg, (2, 0, 1)
+        else:
+            if fr >= fb:
+                middle0, middle1, w0, w1, w2, axes = step_g, step_r + step_g, fg, fr, fb, (1, 0, 2)
+            elif fg >= fb:
+                middle0, middle1, w0, w1, w2, axes = step_g, step_g + step_b, fg, fb, fr, (1, 2, 0)
+            else:
+                middle0, middle1, w0, w1, w2, axes = step_b, step_g + step_b, fb, fg, fr, (2, 1, 0)
+        middle0 += first
+        middle1 += first
+        a0, a1, a2 = axes
+        s0, s1, s2 = [float(limit) if inside[axis] else 0.0 for axis in axes]
+        values = []
+        slopes = [0.0] * 9
+        for channel in range(3):
+            e0 = clut[middle0 + channel] - clut[first + channel]
+            e1 = clut[middle1 + channel] - clut[middle0 + channel]
+            e2 = clut[last + channel] - clut[middle1 + channel]
+            values.append(clut[first + channel] + w0 * e0 + w1 * e1 + w2 * e2)
+            row = channel * 3
+            slopes[row + a0] = e0 * s0
+            slopes[row + a1] = e1 * s1
+            slopes[row + a2] = e2 * s2
+        return values, slopes
+
+    @staticmethod
+    def _tetrahedral(clut, grid, x, y, z):
+        limit = grid - 1
+        x = max(0.0, min(1.0, x)) * limit
+        y = max(0.0, min(1.0, y)) * limit
+        z = max(0.0, min(1.0, z)) * limit
+        red = min(grid - 2, int(x))
+        green = min(grid - 2, int(y))
+        blue = min(grid - 2, int(z))
+        fr, fg, fb = x - red, y - green, z - blue
+        step_r, step_g, step_b = grid * grid * 3, grid * 3, 3
+        first = ((red * grid + green) * grid + blue) * 3
+        last = first + step_r + step_g + step_b
+        if fr >= fg:
+            if fg >= fb:
+                middle0, middle1, w0, w1, w2 = step_r, step_r + step_g, fr, fg, fb
+            elif fr >= fb:
+                middle0, middle1, w0, w1, w2 = step_r, step_r + step_b, fr, fb, fg
+            else:
+                middle0, middle1, w0, w1, w2 = step_b, step_r + step_b, fb, fr, fg
+        else:
+            if fr >= fb:
+                middle0, middle1, w0, w1, w2 = step_g, step_r + step_g, fg, fr, fb
+            elif fg >= fb:
+                middle0, middle1, w0, w1, w2 = step_g, step_g + step_b, fg, fb, fr
+            else:
+                middle0, middle1, w0, w1, w2 = step_b, step_g + step_b, fb, fg, fr
+        middle0 += first
+        middle1 += first
+        return ((clut[first]
+                 + w0 * (clut[middle0] - clut[first])
+                 + w1 * (clut[middle1] - clut[middle0])
+                 + w2 * (clut[last] - clut[middle1])),
+                (clut[first + 1]
+                 + w0 * (clut[middle0 + 1] - clut[first + 1])
+                 + w1 * (clut[middle1 + 1] - clut[middle0 + 1])
+                 + w2 * (clut[last + 1] - clut[middle1 + 1])),
+                (clut[first + 2]
+                 + w0 * (clut[middle0 + 2] - clut[first + 2])
+                 + w1 * (clut[middle1 + 2] - clut[middle0 + 2])
+                 + w2 * (clut[last + 2] - clut[middle1 + 2])))
@@ -0,0 +1,101 @@
+"""Process-pool helpers shared by the PGenerator+ ICC tools.
+
+The large table stages are pure Python and independent per tag, so one core
+did all the work while the rest of a Pi 4 sat idle. run_tasks() spreads such
+calls over forked worker processes, which inherit the imported modules and
+any tables already decoded in the parent. Results come back in submission
+order, so the output is identical to running the calls one after another.
+
+run_slabs() does the same for the outer axis of one cLUT. The slab function may
+be a closure over the caller's tables: it is handed to the forked workers of
+that call's own pool as they start, so they reach it without pickling, and only
+the packed result bytes travel back. map_slabs() is the same split for slab
+functions that return more than bytes.
+
+PGEN_ICC_WORKERS sets the number of worker processes. It defaults to the CPU
+count; 1 keeps every stage in the calling process, as does a platform
+without fork, such as a Windows Patch Companion running an offloaded stage.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+
+
+# Slabs per worker; more, smaller slabs even out uneven per-slab cost.
+SLABS_PER_WORKER = 4
+
+# Set inside pool workers so a stage never starts a pool of its own there.
+_in_worker = False
+# The slab function of the map_slabs() call a worker was forked for. Only
+# workers set it, so concurrent calls in the parent cannot swap functions.
+_slab_function = None
+
+
+def _start_worker(slab_function):
+    global _in_worker, _slab_function
+    _in_worker = True
+    _slab_function = slab_function
+
+
+def worker_count():
+    """Worker processes to use, from PGEN_ICC_WORKERS or the CPU count."""
+    if _in_worker or "fork" not in multiprocessing.get_all_start_methods():
+        return 1
+    try:
+        count = int(os.environ.get("PGEN_ICC_WORKERS", ""))
+    except ValueError:
+        count = os.cpu_count() or 1
+    return max(1, count)
+
+
+def _pool(workers, slab_function=None):
+    # Under fork the initializer arguments are inherited, not pickled.
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+        initializer=_start_worker, initargs=(slab_function,))
+
+
+def run_tasks(function, tasks):
+    """Return [function(*task) for task in tasks], using worker processes.
+
+    function must be a module-level callable. An exception raised by any
+    task is raised again here, as it would be from the serial loop.
+    """
+    tasks = list(tasks)
+    workers = min(worker_count(), len(tasks))
+    if workers <= 1:
+        return [function(*task) for task in tasks]
+    with _pool(workers) as pool:
+        futures = [pool.submit(function, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def _run_slab(start, stop):
+    return _slab_function(start, stop)
+
+
+def map_slabs(function, count):
+    """Return [function(start, stop), ...] over ordered slabs of range(count).
+
+    function(start, stop) handles the outer-axis rows start..stop-1 and may
+    return any picklable value. Without worker processes this is the single
+    call function(0, count).
+    """
+    workers = min(worker_count(), count)
+    if workers <= 1:
+        return [function(0, count)]
+    step = -(-count // (workers * SLABS_PER_WORKER))
+    with _pool(workers, function) as pool:
+        futures = [pool.submit(_run_slab, start, min(count, start + step))
+                   for start in range(0, count, step)]
+        return [future.result() for future in futures]
+
+
+def run_slabs(function, count):
+    """Return function(0, count), computed as ordered slabs of the range.
+
+    function(start, stop) packs the outer-axis rows start..stop-1 into bytes;
+    the slabs are concatenated in order, so the result matches one call.
+    """
+    return b"".join(map_slabs(function, count))
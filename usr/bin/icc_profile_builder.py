@@ -3,24 +3,54 @@
 
 The normal and KDE profiles are created by the bundled ArgyllCMS colprof.
 Windows Advanced Color profiles add Microsoft's documented MHC2 tag to that
-measured matrix/shaper profile.  Only the Python standard library is used.
+measured matrix/shaper profile.  Only the Python standard library is
+required; when NumPy is installed the forward-model B2A refinement solves its
+cLUT nodes in batches instead of one at a time.
 """
 
 from __future__ import print_function
 
+import contextlib
+import cProfile
 import datetime
+import errno
+import fcntl
+import hashlib
 import io
 import json
 import math
 import os
 import re
+import resource
 import shutil
+import signal
 import struct
 import subprocess
 import sys
 import tempfile
 import time
 
+from icc_b2a_repair import environment_options as b2a_repair_environment_options
+from icc_b2a_repair import repair_profile
+from icc_curves import PiecewiseLinearCurve, response_curve
+from icc_dirwatch import DirectoryWatch
+from icc_mft2 import XYZ_TO_MFT, Mft2Evaluator, load_mft2, numpy_enabled, read_profile
+from icc_mft2 import readonly_array
+from icc_mft2 import clear_caches as clear_mft2_caches
+from icc_parallel import map_slabs, run_slabs, run_tasks
+from icc_progress import begin as begin_progress
+from icc_progress import finish as finish_progress
+from icc_progress import report as report_progress
+from icc_progress import stream as stream_command
+from icc_stage_job import decode_result as decode_stage_result
+from icc_stage_job import encode_job as encode_stage_job
+from icc_stage_job import stage_revision
+
+try:
+    import numpy
+except ImportError:  # The scalar solver below remains the reference path.
+    numpy = None
+
 
 PROFILE_TYPES = {
     "sdr": "SDR display",
@@ -68,6 +98,71 @@ def fail(message):
     raise ValueError(message)
 
 
+class BuildStages:
+    """Wall time, CPU time and peak RSS of the expensive steps of one build.
+
+    Each stage() block adds one entry, so a step that runs twice is listed
+    twice. CPU time includes finished child processes: colprof and pool
+    workers. Peak RSS is the high-water mark reached by the end of the
+    stage. With PGEN_ICC_PROFILE=1 every stage also runs under
+    cProfile and is dumped as NN-stage.prof into a fresh temporary directory
+    named in the report; pool workers are not profiled. Entering a stage
+    also publishes it as the build's progress.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = []
+        self.profile_dir = None
+        if os.environ.get("PGEN_ICC_PROFILE") == "1":
+            self.profile_dir = tempfile.mkdtemp(prefix="pgen_icc_profile_")
+
+    @staticmethod
+    def _peak_rss_kb():
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        report_progress(name)
+        profiler = None
+        if self.profile_dir:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.time()
+        cpu = os.times()
+        try:
+            yield
+        finally:
+            finished = os.times()
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(
+                    self.profile_dir,
+                    "{:02d}-{}.prof".format(len(self.stages) + 1, name)))
+            peak, child_peak = self._peak_rss_kb()
+            self.stages.append({
+                "stage": name,
+                "seconds": round(time.time() - started, 3),
+                "cpu_seconds": round(sum(finished[:4]) - sum(cpu[:4]), 3),
+                "peak_rss_kb": peak,
+                "child_peak_rss_kb": child_peak,
+            })
+
+    def report(self):
+        total = time.time() - self.started
+        peak, child_peak = self._peak_rss_kb()
+        return {
+            "total_seconds": round(total, 3),
+            "unstaged_seconds": round(
+                total - sum(entry["seconds"] for entry in self.stages), 3),
+            "peak_rss_kb": peak,
+            "child_peak_rss_kb": child_peak,
+            "profile_dir": self.profile_dir,
+            "stages": list(self.stages),
+        }
+
+
 def finite_number(value, name):
     try:
         number = float(value)
@@ -505,16 +600,17 @@ def calibration_curves(rows, black, white, primaries, profile_type, target_trans
         channel_targets = [value / maximum_target for value in channel_targets]
     curves = []
     for channel in range(3):
-        values = []
-        previous = 0.0
+        targets = []
         for index in range(entries):
             position = index / float(entries - 1)
             if peak_pq > 0.0:
                 target = (pq_to_nits(position * peak_pq) - black_nits) / span
             else:
                 target = target_transfer_to_linear(position, target_transfer or "srgb", black_ratio)
-            target = max(0.0, min(1.0, target * channel_targets[channel]))
-            device = invert_channel_response(channel_samples[channel], target)
+            targets.append(max(0.0, min(1.0, target * channel_targets[channel])))
+        values = []
+        previous = 0.0
+        for device in response_curve(channel_samples[channel]).invert_many(targets):
             previous = max(previous, max(0.0, min(1.0, device)))
             values.append(previous)
         values[0] = 0.0
@@ -671,11 +767,9 @@ def apply_profile_calibration(profile_path, curves):
             applycal_profile = bytes(applycal_profile)
         with open(input_path, "wb") as handle:
             handle.write(applycal_profile)
-        completed = subprocess.Popen(
-            [applycal, "-a", cal_path, input_path, output_path],
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        output = completed.communicate()[0]
-        if (completed.returncode != 0 or not os.path.isfile(output_path)
+        returncode, output = stream_command(
+            [applycal, "-a", cal_path, input_path, output_path], "applycal")
+        if (returncode != 0 or not os.path.isfile(output_path)
                 or os.path.getsize(output_path) <= 0):
             detail = (output or "").strip().splitlines()
             fail("ArgyllCMS could not incorporate the calibration into the ICC"
@@ -700,6 +794,23 @@ def apply_profile_calibration(profile_path, curves):
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
+def repair_b2a_corridor(profile, ti3_text=None, balance=False, calibration=None):
+    """Return profile with icc_b2a_repair's BToA corridor repair applied.
+
+    The repair runs in this process on the profile bytes. PGEN_BALANCE_OVERRIDE
+    and PGEN_CAL_ANCHOR still reach it from the environment, as they did
+    when it ran as a child process.
+    """
+    options = b2a_repair_environment_options()
+    options["balance"] = balance
+    options["calibration"] = calibration
+    try:
+        return repair_profile(profile, ti3_text, options)
+    except Exception as error:  # Any failure is reported like the former child's.
+        fail("BToA corridor repair failed: "
+             + "{}: {}".format(type(error).__name__, error)[:200])
+
+
 def target_transfer_to_linear(value, transfer, black_ratio=0.0):
     value = max(0.0, min(1.0, value))
     black_ratio = max(0.0, min(0.999, black_ratio))
@@ -770,7 +881,7 @@ def isotonic_channel_samples(samples):
     peak = monotonic[-1][1]
     if peak <= 1e-6:
         fail("Measured channel response has no usable range")
-    return [(code, response / peak) for code, response in monotonic]
+    return PiecewiseLinearCurve((code, response / peak) for code, response in monotonic)
 
 
 def neutral_channel_samples(rows, black, primaries):
@@ -807,18 +918,7 @@ def invert_channel_response(samples, target):
     # before searching. Otherwise a target of 1.0 can miss a fitted peak of
     # 0.9999999999999999 and fall through to the final device code, creating a
     # large one-channel jump at the start of the plateau.
-    target = min(target, samples[-1][1])
-    if target <= samples[0][1]:
-        return samples[0][0]
-    for index in range(1, len(samples)):
-        x0, y0 = samples[index - 1]
-        x1, y1 = samples[index]
-        if target <= y1 + 1e-12:
-            if y1 <= y0 + 1e-12:
-                return x0
-            fraction = (target - y0) / (y1 - y0)
-            return x0 + fraction * (x1 - x0)
-    return samples[-1][0]
+    return response_curve(samples).invert(target)
 
 
 def windows_sdr_adjustment_luts(rows, black, white, primaries, entries, transfer, wire, adjustment):
@@ -832,20 +932,21 @@ def windows_sdr_adjustment_luts(rows, black, white, primaries, entries, transfer
         gain = neutral_gains[channel]
         if gain <= 1e-6:
             fail("SDR MHC2 calibration matrix has an invalid neutral response")
-        values = []
-        previous = 0.0
+        targets = []
         for index in range(entries):
             lut_input = index / float(entries - 1)
             linear_input = srgb_to_linear(lut_input)
             if linear_input <= gain:
                 source_encoded = linear_to_srgb(linear_input / gain)
-                target = gain * target_transfer_to_linear(source_encoded, transfer, black_ratio)
+                targets.append(gain * target_transfer_to_linear(source_encoded, transfer, black_ratio))
             else:
                 # Neutral white never enters this part of a channel LUT when
                 # its matrix gain is below one. Preserve usable headroom for
                 # saturated colors and meet the identity endpoint at 1.0.
-                target = linear_input
-            value = invert_channel_response(samples, target)
+                targets.append(linear_input)
+        values = []
+        previous = 0.0
+        for value in response_curve(samples).invert_many(targets):
             previous = max(previous, max(0.0, min(1.0, value)))
             values.append(previous)
         values[0] = 0.0
@@ -1418,16 +1519,7 @@ def regularize_hdr_shadow_balance(curves):
 
 def sample_channel_response(samples, position):
     """Sample a measured, normalized channel-response fit."""
-    position = max(0.0, min(1.0, position))
-    if position <= samples[0][0]:
-        return samples[0][1]
-    for index in range(1, len(samples)):
-        x0, y0 = samples[index - 1]
-        x1, y1 = samples[index]
-        if position <= x1:
-            fraction = 0.0 if x1 <= x0 else (position - x0) / (x1 - x0)
-            return y0 + fraction * (y1 - y0)
-    return samples[-1][1]
+    return response_curve(samples).sample(max(0.0, min(1.0, position)))
 
 
 def isotonic_curve(values):
@@ -2600,112 +2692,29 @@ def invert_table(table, value):
     return (low + fraction) / (len(table) - 1.0)
 
 
-def _sample_mft2_clut(table, grid, coordinates):
-    """Trilinearly sample an RGB mft2 cLUT."""
-    positions = [max(0.0, min(1.0, value)) * (grid - 1) for value in coordinates]
-    lows = [min(grid - 2, int(value)) for value in positions]
-    fractions = [positions[channel] - lows[channel] for channel in range(3)]
-    result = [0.0, 0.0, 0.0]
-    for red in (0, 1):
-        red_weight = fractions[0] if red else 1.0 - fractions[0]
-        for green in (0, 1):
-            green_weight = fractions[1] if green else 1.0 - fractions[1]
-            for blue in (0, 1):
-                blue_weight = fractions[2] if blue else 1.0 - fractions[2]
-                weight = red_weight * green_weight * blue_weight
-                node = ((lows[0] + red) * grid * grid
-                        + (lows[1] + green) * grid
-                        + lows[2] + blue) * 3
-                for channel in range(3):
-                    result[channel] += table[node + channel] * weight
-    return result
-
-
-def _sample_mft2_clut_tetrahedral(table, grid, coordinates):
-    """Tetrahedrally sample an RGB mft2 cLUT, matching ArgyllCMS."""
-    positions = [max(0.0, min(1.0, value)) * (grid - 1) for value in coordinates]
-    lows = [min(grid - 2, int(value)) for value in positions]
-    fractions = [positions[channel] - lows[channel] for channel in range(3)]
-
-    def node(red, green, blue):
-        offset = (((lows[0] + red) * grid * grid
-                   + (lows[1] + green) * grid
-                   + lows[2] + blue) * 3)
-        return table[offset:offset + 3]
-
-    red, green, blue = fractions
-    first = node(0, 0, 0)
-    last = node(1, 1, 1)
-    if red >= green:
-        if green >= blue:
-            middle = (node(1, 0, 0), node(1, 1, 0))
-            weights = (red, green, blue)
-        elif red >= blue:
-            middle = (node(1, 0, 0), node(1, 0, 1))
-            weights = (red, blue, green)
-        else:
-            middle = (node(0, 0, 1), node(1, 0, 1))
-            weights = (blue, red, green)
-    else:
-        if red >= blue:
-            middle = (node(0, 1, 0), node(1, 1, 0))
-            weights = (green, red, blue)
-        elif green >= blue:
-            middle = (node(0, 1, 0), node(0, 1, 1))
-            weights = (green, blue, red)
-        else:
-            middle = (node(0, 0, 1), node(0, 1, 1))
-            weights = (blue, green, red)
-    return [
-        first[channel]
-        + weights[0] * (middle[0][channel] - first[channel])
-        + weights[1] * (middle[1][channel] - middle[0][channel])
-        + weights[2] * (last[channel] - middle[1][channel])
-        for channel in range(3)
-    ]
+def mft2_tag_lut(profile, signature, purpose):
+    """Return the shared decoded Mft2Lut of a three-channel RGB mft2 tag."""
+    name = signature.decode("ascii")
+    payload = dict(read_icc_tags(profile)).get(signature)
+    if not payload or len(payload) < 52 or payload[:4] != b"mft2":
+        fail("{} requires an mft2 {} transform".format(purpose, name))
+    if payload[8] != 3 or payload[9] != 3 or payload[10] < 2:
+        fail("{} requires a three-channel {} transform".format(purpose, name))
+    try:
+        return load_mft2(payload)
+    except ValueError:
+        fail("ICC {} table is truncated".format(name))
 
 
 def mft2_a2b_evaluator(profile):
-    """Return a raw-device RGB to relative-PCS evaluator for A2B0."""
-    payload = dict(read_icc_tags(profile)).get(b"A2B0")
-    if not payload or len(payload) < 52 or payload[:4] != b"mft2":
-        fail("Measured HDR calibration requires an mft2 A2B0 transform")
-    input_channels, output_channels, grid = payload[8], payload[9], payload[10]
-    input_entries, output_entries = struct.unpack_from(">HH", payload, 48)
-    if input_channels != 3 or output_channels != 3 or grid < 2:
-        fail("Measured HDR calibration requires a three-channel A2B0 transform")
-    input_start = 52
-    clut_start = input_start + input_channels * input_entries * 2
-    clut_values = grid ** input_channels * output_channels
-    output_start = clut_start + clut_values * 2
-    required = output_start + output_channels * output_entries * 2
-    if required > len(payload):
-        fail("ICC A2B0 table is truncated")
-    matrix = [value / 65536.0 for value in struct.unpack_from(">9i", payload, 12)]
-    input_tables = []
-    output_tables = []
-    for channel in range(3):
-        offset = input_start + channel * input_entries * 2
-        input_tables.append([value / 65535.0 for value in struct.unpack_from(
-            ">{}H".format(input_entries), payload, offset)])
-        offset = output_start + channel * output_entries * 2
-        output_tables.append([value / 65535.0 for value in struct.unpack_from(
-            ">{}H".format(output_entries), payload, offset)])
-    clut = [value / 65535.0 for value in struct.unpack_from(
-        ">{}H".format(clut_values), payload, clut_start)]
-    xyz_to_mft = 65536.0 / (2.0 * 65535.0)
-
-    def evaluate(rgb):
-        shaped = [sample_table(input_tables[channel], rgb[channel]) for channel in range(3)]
-        transformed = [
-            sum(matrix[row * 3 + column] * shaped[column] for column in range(3))
-            for row in range(3)
-        ]
-        encoded = _sample_mft2_clut_tetrahedral(clut, grid, transformed)
-        return [sample_table(output_tables[channel], encoded[channel]) / xyz_to_mft
-                for channel in range(3)]
+    """Return a raw-device RGB to relative-PCS evaluator for A2B0.
 
-    return evaluate
+    The evaluator also offers evaluate_many() for flat batches and, with
+    NumPy, evaluate_array() for (N, 3) arrays.
+    """
+    lut = mft2_tag_lut(profile, b"A2B0", "Measured HDR calibration")
+    return Mft2Evaluator(lut, matrix="after", output_divisor=XYZ_TO_MFT,
+                         tetrahedral=True)
 
 
 def mft2_b2a_evaluator(profile):
@@ -2717,46 +2726,8 @@ def mft2_b2a_evaluator(profile):
     and the Companion prevents the two Windows handling choices from growing
     different neutral responses.
     """
-    payload = dict(read_icc_tags(profile)).get(b"B2A0")
-    if not payload or len(payload) < 52 or payload[:4] != b"mft2":
-        fail("Windows HDR cLUT matching requires an mft2 B2A0 transform")
-    input_channels, output_channels, grid = payload[8], payload[9], payload[10]
-    input_entries, output_entries = struct.unpack_from(">HH", payload, 48)
-    if input_channels != 3 or output_channels != 3 or grid < 2:
-        fail("Windows HDR cLUT matching requires a three-channel B2A0 transform")
-    input_start = 52
-    clut_start = input_start + input_channels * input_entries * 2
-    clut_values = grid ** input_channels * output_channels
-    output_start = clut_start + clut_values * 2
-    required = output_start + output_channels * output_entries * 2
-    if required > len(payload):
-        fail("ICC B2A0 table is truncated")
-    matrix = [value / 65536.0 for value in struct.unpack_from(">9i", payload, 12)]
-    input_tables = []
-    output_tables = []
-    for channel in range(3):
-        offset = input_start + channel * input_entries * 2
-        input_tables.append([value / 65535.0 for value in struct.unpack_from(
-            ">{}H".format(input_entries), payload, offset)])
-        offset = output_start + channel * output_entries * 2
-        output_tables.append([value / 65535.0 for value in struct.unpack_from(
-            ">{}H".format(output_entries), payload, offset)])
-    clut = [value / 65535.0 for value in struct.unpack_from(
-        ">{}H".format(clut_values), payload, clut_start)]
-    xyz_to_mft = 65536.0 / (2.0 * 65535.0)
-
-    def evaluate(xyz):
-        mapped = [
-            sum(matrix[row * 3 + column] * xyz[column] for column in range(3))
-            for row in range(3)
-        ]
-        shaped = [sample_table(input_tables[channel], mapped[channel] * xyz_to_mft)
-                  for channel in range(3)]
-        encoded = _sample_mft2_clut(clut, grid, shaped)
-        return [sample_table(output_tables[channel], encoded[channel])
-                for channel in range(3)]
-
-    return evaluate
+    lut = mft2_tag_lut(profile, b"B2A0", "Windows HDR cLUT matching")
+    return Mft2Evaluator(lut, matrix="before", input_multiplier=XYZ_TO_MFT)
 
 
 def windows_hdr_b2a_neutral_evaluator(profile):
@@ -2797,6 +2768,58 @@ def windows_hdr_b2a_source_evaluator(profile):
     return evaluate
 
 
+def _windows_shadow_b2a_table(payload, reference_luts, corrected_luts,
+                              neutral_gains, source_limit, white_nits):
+    """Rewrite the neutral corridor of one B2A mft2 payload."""
+    xyz_to_mft = 65536.0 / (2.0 * 65535.0)
+    d50 = (0.9642, 1.0, 0.8249)
+    try:
+        lut = load_mft2(payload)
+    except ValueError:
+        fail("Windows HDR shadow matching found a truncated B2A table")
+    grid = lut.grid
+    clut_start = lut.clut_start
+    clut = lut.clut
+    input_tables = lut.input_tables
+    output_tables = lut.output_tables
+    updated = bytearray(payload)
+    denominator = float(grid - 1)
+    for red in range(grid):
+        for green in range(max(0, red - 1), min(grid, red + 2)):
+            for blue in range(max(0, red - 1), min(grid, red + 2)):
+                if max(red, green, blue) - min(red, green, blue) > 1:
+                    continue
+                estimates = []
+                for channel, node in enumerate((red, green, blue)):
+                    encoded_xyz = invert_table(
+                        input_tables[channel], node / denominator)
+                    pcs = encoded_xyz / xyz_to_mft
+                    relative = max(0.0, pcs / d50[channel])
+                    estimates.append(nits_to_pq(relative * white_nits))
+                source_code = sorted(estimates)[1]
+                if source_code > source_limit:
+                    continue
+                node_offset = (((red * grid + green) * grid + blue) * 3)
+                for channel in range(3):
+                    curve_input = nits_to_pq(
+                        pq_to_nits(source_code) * neutral_gains[channel])
+                    correction = (
+                        sample_table(corrected_luts[channel], curve_input)
+                        - sample_table(reference_luts[channel], curve_input))
+                    node_value = clut[node_offset + channel]
+                    old_output = sample_table(
+                        output_tables[channel], node_value)
+                    desired = max(0.0, min(1.0,
+                                          old_output + correction))
+                    encoded = invert_table(output_tables[channel],
+                                           desired)
+                    struct.pack_into(">H", updated,
+                                     clut_start + (node_offset + channel) * 2,
+                                     max(0, min(65535,
+                                         int(round(encoded * 65535.0)))))
+    return bytes(updated)
+
+
 def windows_hdr_b2a_with_shadow_luts(profile, reference_luts, corrected_luts,
                                       neutral_gains,
                                       source_limit=0.35):
@@ -2820,71 +2843,26 @@ def windows_hdr_b2a_with_shadow_luts(profile, reference_luts, corrected_luts,
     white_nits = read_s15fixed16(lumi, 12)
     if white_nits <= 0.0:
         fail("Windows HDR shadow matching requires positive profile luminance")
-    xyz_to_mft = 65536.0 / (2.0 * 65535.0)
-    d50 = (0.9642, 1.0, 0.8249)
-    replacements = {}
+    # Linked B2A0/B2A1 copies share one rewrite; distinct tables run in
+    # parallel worker processes.
+    signatures = {}
+    payloads = []
     for signature, payload in read_icc_tags(profile):
-        if signature not in (b"B2A0", b"B2A1") or signature in replacements:
+        if signature not in (b"B2A0", b"B2A1") or signature in signatures:
             continue
         if len(payload) < 52 or payload[:4] != b"mft2":
             continue
-        input_channels, output_channels, grid = payload[8], payload[9], payload[10]
-        input_entries, output_entries = struct.unpack_from(">HH", payload, 48)
-        if input_channels != 3 or output_channels != 3 or grid < 2:
+        if payload[8] != 3 or payload[9] != 3 or payload[10] < 2:
             continue
-        input_start = 52
-        clut_start = input_start + input_channels * input_entries * 2
-        clut_values = grid ** input_channels * output_channels
-        output_start = clut_start + clut_values * 2
-        if output_start + output_channels * output_entries * 2 > len(payload):
-            fail("Windows HDR shadow matching found a truncated B2A table")
-        input_tables = []
-        output_tables = []
-        for channel in range(3):
-            offset = input_start + channel * input_entries * 2
-            input_tables.append([value / 65535.0 for value in struct.unpack_from(
-                ">{}H".format(input_entries), payload, offset)])
-            offset = output_start + channel * output_entries * 2
-            output_tables.append([value / 65535.0 for value in struct.unpack_from(
-                ">{}H".format(output_entries), payload, offset)])
-        updated = bytearray(payload)
-        denominator = float(grid - 1)
-        for red in range(grid):
-            for green in range(max(0, red - 1), min(grid, red + 2)):
-                for blue in range(max(0, red - 1), min(grid, red + 2)):
-                    if max(red, green, blue) - min(red, green, blue) > 1:
-                        continue
-                    estimates = []
-                    for channel, node in enumerate((red, green, blue)):
-                        encoded_xyz = invert_table(
-                            input_tables[channel], node / denominator)
-                        pcs = encoded_xyz / xyz_to_mft
-                        relative = max(0.0, pcs / d50[channel])
-                        estimates.append(nits_to_pq(relative * white_nits))
-                    source_code = sorted(estimates)[1]
-                    if source_code > source_limit:
-                        continue
-                    node_offset = (((red * grid + green) * grid + blue) * 3)
-                    for channel in range(3):
-                        curve_input = nits_to_pq(
-                            pq_to_nits(source_code) * neutral_gains[channel])
-                        correction = (
-                            sample_table(corrected_luts[channel], curve_input)
-                            - sample_table(reference_luts[channel], curve_input))
-                        node_value = struct.unpack_from(
-                            ">H", payload,
-                            clut_start + (node_offset + channel) * 2)[0] / 65535.0
-                        old_output = sample_table(
-                            output_tables[channel], node_value)
-                        desired = max(0.0, min(1.0,
-                                              old_output + correction))
-                        encoded = invert_table(output_tables[channel],
-                                               desired)
-                        struct.pack_into(">H", updated,
-                                         clut_start + (node_offset + channel) * 2,
-                                         max(0, min(65535,
-                                             int(round(encoded * 65535.0)))))
-        replacements[signature] = bytes(updated)
+        if payload not in payloads:
+            payloads.append(payload)
+        signatures[signature] = payloads.index(payload)
+    results = run_tasks(_windows_shadow_b2a_table, [
+        (payload, reference_luts, corrected_luts, neutral_gains, source_limit,
+         white_nits)
+        for payload in payloads])
+    replacements = dict((signature, results[index])
+                        for signature, index in signatures.items())
     return rebuild_icc(profile, replacements) if replacements else profile
 
 
@@ -2929,17 +2907,19 @@ def hdr_profile_calibration_from_a2b(profile, rows, fallback, entries=4096,
         (code, robust_xyz(samples)) for code, samples in grouped_neutral
     ]
 
+    measured_neutral = PiecewiseLinearCurve(measured_neutral)
+
     def measured_xyz_at_code(code):
         if code <= measured_neutral[0][0]:
             return measured_neutral[0][1]
-        for anchor in range(1, len(measured_neutral)):
-            x0, xyz0 = measured_neutral[anchor - 1]
-            x1, xyz1 = measured_neutral[anchor]
-            if code <= x1:
-                fraction = 0.0 if x1 <= x0 else (code - x0) / (x1 - x0)
-                return tuple(xyz0[channel] * (1.0 - fraction)
-                             + xyz1[channel] * fraction for channel in range(3))
-        return measured_neutral[-1][1]
+        anchor = measured_neutral.locate(code)
+        if anchor >= len(measured_neutral):
+            return measured_neutral[-1][1]
+        x0, xyz0 = measured_neutral[anchor - 1]
+        x1, xyz1 = measured_neutral[anchor]
+        fraction = 0.0 if x1 <= x0 else (code - x0) / (x1 - x0)
+        return tuple(xyz0[channel] * (1.0 - fraction)
+                     + xyz1[channel] * fraction for channel in range(3))
 
     response_neutral = [(code, xyz[1]) for code, xyz in measured_neutral]
 
@@ -2955,8 +2935,9 @@ def hdr_profile_calibration_from_a2b(profile, rows, fallback, entries=4096,
     for start, end, total, weight in blocks:
         for index in range(start, end + 1):
             fitted[index] = total / weight
-    response_neutral = [(response_neutral[index][0], fitted[index])
-                        for index in range(len(response_neutral))]
+    response_neutral = PiecewiseLinearCurve(
+        (response_neutral[index][0], fitted[index])
+        for index in range(len(response_neutral)))
     peak = max(response for _code, response in response_neutral)
     plateau_code = next(code for code, response in response_neutral
                         if response >= peak * 0.998)
@@ -3003,21 +2984,23 @@ def hdr_profile_calibration_from_a2b(profile, rows, fallback, entries=4096,
         return fitted_samples
 
     absolute_channel_samples = [
-        isotonic_absolute(samples) for samples in absolute_channel_samples
+        PiecewiseLinearCurve(isotonic_absolute(samples))
+        for samples in absolute_channel_samples
     ]
 
     def invert_absolute_response(samples, target):
+        """Invert a response curve, never past the first plateau code."""
         if target <= samples[0][1]:
             return samples[0][0]
-        for sample_index in range(1, len(samples)):
-            x0, y0 = samples[sample_index - 1]
-            x1, y1 = samples[sample_index]
-            if target <= y1:
-                if y1 <= y0 + 1e-12:
-                    return min(x1, plateau_code)
-                fraction = (target - y0) / (y1 - y0)
-                return min(x0 + fraction * (x1 - x0), plateau_code)
-        return plateau_code
+        index = samples.locate_value(target)
+        if index >= len(samples):
+            return plateau_code
+        x0, y0 = samples[index - 1]
+        x1, y1 = samples[index]
+        if y1 <= y0 + 1e-12:
+            return min(x1, plateau_code)
+        fraction = (target - y0) / (y1 - y0)
+        return min(x0 + fraction * (x1 - x0), plateau_code)
 
     def measured_axis_rgb(target_xyz):
         target_response = mat_vec_mul(
@@ -3031,17 +3014,7 @@ def hdr_profile_calibration_from_a2b(profile, rows, fallback, entries=4096,
         ]
 
     def invert_luminance(target):
-        if target <= response_neutral[0][1]:
-            return response_neutral[0][0]
-        for index in range(1, len(response_neutral)):
-            x0, y0 = response_neutral[index - 1]
-            x1, y1 = response_neutral[index]
-            if target <= y1:
-                if y1 <= y0 + 1e-12:
-                    return min(x1, plateau_code)
-                fraction = (target - y0) / (y1 - y0)
-                return min(x0 + fraction * (x1 - x0), plateau_code)
-        return plateau_code
+        return invert_absolute_response(response_neutral, target)
 
     evaluate = mft2_a2b_evaluator(profile)
     d50 = (0.9642, 1.0, 0.8249)
@@ -3282,24 +3255,15 @@ def hdr_profile_calibration_from_a2b(profile, rows, fallback, entries=4096,
         )[:12]
         return fit_measured_jacobian(code, nearby)
 
-    step = 2.0 / 1023.0
     curves = [[], [], []]
     for index in range(entries):
         encoded = index / float(entries - 1)
         target_nits = min(pq_to_nits(encoded), peak)
         base = invert_luminance(target_nits)
-        rgb = [base, base, base]
-        actual = evaluate(rgb)
-        jacobian = [[0.0] * 3 for _axis in range(3)]
-        for channel in range(3):
-            probe = list(rgb)
-            probe[channel] = min(1.0, base + step)
-            if probe[channel] == base:
-                probe[channel] = max(0.0, base - step)
-            result = evaluate(probe)
-            denominator = probe[channel] - base
-            for axis in range(3):
-                jacobian[axis][channel] = (result[axis] - actual[axis]) / denominator
+        # The model's own RGB-to-PCS derivative at this neutral, exact for
+        # the piecewise-linear A2B.
+        _, flat_jacobian = evaluate.evaluate_with_jacobian((base, base, base))
+        jacobian = [flat_jacobian[0:3], flat_jacobian[3:6], flat_jacobian[6:9]]
         measured_xyz = measured_xyz_at_code(base)
         target_xyz = [target_nits * component for component in d65]
         axis_rgb = measured_axis_rgb(target_xyz)
@@ -3866,158 +3830,131 @@ def b2a_profile_with_curve_probe(profile, mhc2, channel,
         source_limit=0.45)
 
 
-def reshape_hdr_b2a_for_pq(profile, white_y, incorporated_calibration=None, grid_size=65):
-    """Give a KDE HDR B2A table a PQ-domain shaper and neutral corridor.
-
-    Argyll's inverse display table is sampled in linear PCS XYZ. Even a 45^3
-    cLUT then places both 5% and 10% PQ inside its first cell, so the OLED toe
-    cannot be represented accurately. Reparameterize the table through PQ
-    input shapers, resample the original chromatic transform, and reserve the
-    one-cell neutral corridor for the calibration stage. With VCGT, that
-    corridor stays in source PQ and KWin applies the separate curves. When
-    calibration is included without VCGT, keep the neutral cLUT in its
-    virtual-device domain and put the calibration in the high-resolution B2A
-    output shapers. This preserves sharp HDR rolloffs that a 3D grid cannot.
-    """
+def _reshape_hdr_b2a_table(payload, white_y, incorporated_calibration, grid_size):
+    """Reshape one B2A mft2 payload; None when it is not a 3-channel table."""
     d50 = (0.9642, 1.0, 0.8249)
-    xyz_to_mft = 65536.0 / (2.0 * 65535.0)
+    xyz_to_mft = XYZ_TO_MFT
     # KWin's HDR ICC path accepts the full mft2 range through its direct parser.
     # Stay within LittleCMS' signed 16-bit stage limit while retaining enough
     # linear-PCS resolution to distinguish 5% PQ near black.
     new_input_entries = 32767
     new_output_entries = 4096
-    replacements = {}
-    changed = False
-    for signature, payload in read_icc_tags(profile):
-        if signature not in (b"B2A0", b"B2A1") or signature in replacements:
-            continue
-        if len(payload) < 52 or payload[:4] != b"mft2":
-            continue
-        input_channels, output_channels, source_grid = payload[8], payload[9], payload[10]
-        # Keep 65 as the accuracy-oriented default. The neutral corridor below
-        # is expressed as a fraction of the cube axis, not as a fixed count of
-        # cells: two cells in 65^3 cover the same chromatic distance as one in
-        # 33^3. A fixed two-cell corridor made the 33^3 option twice as wide
-        # and pulled legitimate near-neutral colours onto the grey axis.
-        grid = max(source_grid, grid_size)
-        input_entries, output_entries = struct.unpack(">HH", payload[48:52])
-        if input_channels != 3 or output_channels != 3 or source_grid < 2 or input_entries < 2 or output_entries < 2:
-            continue
-        input_start = 52
-        clut_start = input_start + input_channels * input_entries * 2
-        clut_values = source_grid ** input_channels * output_channels
-        output_start = clut_start + clut_values * 2
-        required = output_start + output_channels * output_entries * 2
-        if required > len(payload):
-            fail("ICC B2A table is truncated")
-        matrix = [value / 65536.0 for value in struct.unpack_from(">9i", payload, 12)]
-        identity = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
-        if any(abs(matrix[index] - identity[index]) > 1e-5 for index in range(9)):
-            fail("KDE HDR PQ shaping requires an identity B2A matrix")
-        input_tables = []
-        output_tables = []
-        for channel in range(3):
-            offset = input_start + channel * input_entries * 2
-            values = struct.unpack_from(">{}H".format(input_entries), payload, offset)
-            input_tables.append([value / 65535.0 for value in values])
-            offset = output_start + channel * output_entries * 2
-            values = struct.unpack_from(">{}H".format(output_entries), payload, offset)
-            output_tables.append([value / 65535.0 for value in values])
-        if any(table[index] > table[index + 1]
-               for table in input_tables + output_tables
-               for index in range(len(table) - 1)):
-            fail("ICC B2A PQ shaping requires monotonic shaper tables")
-        old_clut = [value / 65535.0 for value in struct.unpack_from(
-            ">{}H".format(clut_values), payload, clut_start)]
-
-        def evaluate_original(pcs):
-            coordinates = [
-                sample_table(input_tables[channel], pcs[channel] * xyz_to_mft)
-                for channel in range(3)
-            ]
-            clut_result = _sample_mft2_clut(old_clut, source_grid, coordinates)
-            return [sample_table(output_tables[channel], clut_result[channel])
-                    for channel in range(3)]
+    input_channels, output_channels, source_grid = payload[8], payload[9], payload[10]
+    # Keep 65 as the accuracy-oriented default. The neutral corridor below
+    # is expressed as a fraction of the cube axis, not as a fixed count of
+    # cells: two cells in 65^3 cover the same chromatic distance as one in
+    # 33^3. A fixed two-cell corridor made the 33^3 option twice as wide
+    # and pulled legitimate near-neutral colours onto the grey axis.
+    grid = max(source_grid, grid_size)
+    input_entries, output_entries = struct.unpack(">HH", payload[48:52])
+    if input_channels != 3 or output_channels != 3 or source_grid < 2 or input_entries < 2 or output_entries < 2:
+        return None
+    try:
+        lut = load_mft2(payload)
+    except ValueError:
+        fail("ICC B2A table is truncated")
+    matrix = lut.matrix
+    identity = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+    if any(abs(matrix[index] - identity[index]) > 1e-5 for index in range(9)):
+        fail("KDE HDR PQ shaping requires an identity B2A matrix")
+    input_tables = lut.input_tables
+    output_tables = lut.output_tables
+    if any(table[index] > table[index + 1]
+           for table in input_tables + output_tables
+           for index in range(len(table) - 1)):
+        fail("ICC B2A PQ shaping requires monotonic shaper tables")
+    original_b2a = Mft2Evaluator(lut, input_multiplier=xyz_to_mft)
+
+    updated = bytearray(payload[:48])
+    updated[10] = grid
+    updated.extend(struct.pack(">HH", new_input_entries, new_output_entries))
+    new_input_tables = []
+    for channel in range(3):
+        quantized_table = []
+        for index in range(new_input_entries):
+            encoded_xyz = index / float(new_input_entries - 1)
+            pcs = encoded_xyz / xyz_to_mft
+            relative = max(0.0, pcs / d50[channel])
+            pq_value = nits_to_pq(relative * white_y)
+            quantized = max(0, min(65535, int(round(pq_value * 65535.0))))
+            quantized_table.append(quantized)
+
+        # Linear PCS has less than one full mft2 input-table interval at
+        # 5% PQ on a bright HDR display. Sampling the analytic shaper only
+        # at the fixed table nodes then gives X, Y and Z different PQ
+        # errors, which becomes a visible RGB-balance error after the
+        # output calibration. Pin the piecewise-linear table to the exact
+        # 5% mapping. This changes no target response; it removes the
+        # interpolation error at the first normally measurable HDR grey.
+        shadow_anchor = 0.05
+        anchor_encoded_xyz = (d50[channel]
+                              * pq_to_nits(shadow_anchor) / white_y
+                              * xyz_to_mft)
+        anchor_position = anchor_encoded_xyz * (new_input_entries - 1)
+        anchor_low = int(anchor_position)
+        anchor_fraction = anchor_position - anchor_low
+        if (anchor_low >= 0 and anchor_low + 2 < new_input_entries
+                and anchor_fraction > 1e-9):
+            low_value = quantized_table[anchor_low] / 65535.0
+            needed = ((shadow_anchor
+                       - low_value * (1.0 - anchor_fraction))
+                      / anchor_fraction)
+            lower = quantized_table[anchor_low] / 65535.0
+            upper = quantized_table[anchor_low + 2] / 65535.0
+            if lower <= needed <= upper:
+                quantized_table[anchor_low + 1] = max(
+                    0, min(65535, int(round(needed * 65535.0))))
+        updated.extend(struct.pack(">{}H".format(new_input_entries),
+                                   *quantized_table))
+        new_input_tables.append(
+            [value / 65535.0 for value in quantized_table])
+
+    def pq_from_clut_coordinate(channel, coordinate):
+        # A uniform XYZ input table has fewer than two samples below 5%
+        # PQ even at the 32767-entry limit accepted by KWin.  Its linear
+        # interpolation therefore produces different PQ coordinates for
+        # D50 X, Y and Z.  Recover the PCS represented by each sampled
+        # coordinate and normalise it by the corresponding D50 component.
+        # A true neutral reconstructs to three equal PQ values, while a
+        # nearby chromatic coordinate retains its channel separation.
+        # Collapsing these estimates to one median value would fix gray at
+        # the cost of desaturating every color inside the corridor.
+        encoded_xyz = invert_table(new_input_tables[channel], coordinate)
+        pcs = encoded_xyz / xyz_to_mft
+        relative = max(0.0, pcs / d50[channel])
+        return nits_to_pq(relative * white_y)
+
+    denominator = float(grid - 1)
+    # Preserve the same normalized corridor width at each supported cube
+    # density. This intentionally evaluates to one cell at 33^3 and two
+    # cells at 65^3.
+    neutral_corridor_cells = max(
+        1, int(round(2.0 * denominator / 64.0)))
+    # Each channel's PQ estimate, and the PCS it stands for, depends only on
+    # that channel's own grid index. Solve the table inversions once per
+    # axis rather than once per node.
+    axis = [index / denominator for index in range(grid)]
+    axis_pcs = [
+        [d50[channel] * pq_to_nits(pq_from_clut_coordinate(channel, coordinate)) / white_y
+         for coordinate in axis]
+        for channel in range(3)
+    ]
 
-        updated = bytearray(payload[:48])
-        updated[10] = grid
-        updated.extend(struct.pack(">HH", new_input_entries, new_output_entries))
-        new_input_tables = []
-        for channel in range(3):
-            quantized_table = []
-            for index in range(new_input_entries):
-                encoded_xyz = index / float(new_input_entries - 1)
-                pcs = encoded_xyz / xyz_to_mft
-                relative = max(0.0, pcs / d50[channel])
-                pq_value = nits_to_pq(relative * white_y)
-                quantized = max(0, min(65535, int(round(pq_value * 65535.0))))
-                quantized_table.append(quantized)
-
-            # Linear PCS has less than one full mft2 input-table interval at
-            # 5% PQ on a bright HDR display. Sampling the analytic shaper only
-            # at the fixed table nodes then gives X, Y and Z different PQ
-            # errors, which becomes a visible RGB-balance error after the
-            # output calibration. Pin the piecewise-linear table to the exact
-            # 5% mapping. This changes no target response; it removes the
-            # interpolation error at the first normally measurable HDR grey.
-            shadow_anchor = 0.05
-            anchor_encoded_xyz = (d50[channel]
-                                  * pq_to_nits(shadow_anchor) / white_y
-                                  * xyz_to_mft)
-            anchor_position = anchor_encoded_xyz * (new_input_entries - 1)
-            anchor_low = int(anchor_position)
-            anchor_fraction = anchor_position - anchor_low
-            if (anchor_low >= 0 and anchor_low + 2 < new_input_entries
-                    and anchor_fraction > 1e-9):
-                low_value = quantized_table[anchor_low] / 65535.0
-                needed = ((shadow_anchor
-                           - low_value * (1.0 - anchor_fraction))
-                          / anchor_fraction)
-                lower = quantized_table[anchor_low] / 65535.0
-                upper = quantized_table[anchor_low + 2] / 65535.0
-                if lower <= needed <= upper:
-                    quantized_table[anchor_low + 1] = max(
-                        0, min(65535, int(round(needed * 65535.0))))
-            updated.extend(struct.pack(">{}H".format(new_input_entries),
-                                       *quantized_table))
-            new_input_tables.append(
-                [value / 65535.0 for value in quantized_table])
-
-        def pq_from_clut_coordinates(coordinates):
-            # A uniform XYZ input table has fewer than two samples below 5%
-            # PQ even at the 32767-entry limit accepted by KWin.  Its linear
-            # interpolation therefore produces different PQ coordinates for
-            # D50 X, Y and Z.  Recover the PCS represented by each sampled
-            # coordinate and normalise it by the corresponding D50 component.
-            # A true neutral reconstructs to three equal PQ values, while a
-            # nearby chromatic coordinate retains its channel separation.
-            # Collapsing these estimates to one median value would fix gray at
-            # the cost of desaturating every color inside the corridor.
-            estimates = []
-            for channel in range(3):
-                encoded_xyz = invert_table(new_input_tables[channel],
-                                           coordinates[channel])
-                pcs = encoded_xyz / xyz_to_mft
-                relative = max(0.0, pcs / d50[channel])
-                estimates.append(nits_to_pq(relative * white_y))
-            return estimates
-
-        denominator = float(grid - 1)
-        # Preserve the same normalized corridor width at each supported cube
-        # density. This intentionally evaluates to one cell at 33^3 and two
-        # cells at 65^3.
-        neutral_corridor_cells = max(
-            1, int(round(2.0 * denominator / 64.0)))
-        for red in range(grid):
+    def reshape_slab(first, last):
+        slab = bytearray()
+        for red in range(first, last):
+            # Resample the original table one red slab per batch call.
+            slab_pcs = []
+            red_pcs = axis_pcs[0][red]
+            for green_pcs in axis_pcs[1]:
+                for blue_pcs in axis_pcs[2]:
+                    slab_pcs.extend((red_pcs, green_pcs, blue_pcs))
+            slab_original = original_b2a.evaluate_many(slab_pcs)
             for green in range(grid):
                 for blue in range(grid):
-                    pq_coordinates = [red / denominator, green / denominator, blue / denominator]
-                    corrected = pq_from_clut_coordinates(pq_coordinates)
-                    pcs = [
-                        d50[channel] * pq_to_nits(corrected[channel]) / white_y
-                        for channel in range(3)
-                    ]
-                    original = evaluate_original(pcs)
+                    pq_coordinates = [axis[red], axis[green], axis[blue]]
+                    offset = (green * grid + blue) * 3
+                    original = slab_original[offset:offset + 3]
                     spread = max(red, green, blue) - min(red, green, blue)
                     if spread <= neutral_corridor_cells:
                         # Keep this corridor linear in each axis. Trilinear
@@ -4034,30 +3971,259 @@ def reshape_hdr_b2a_for_pq(profile, white_y, incorporated_calibration=None, grid
                                   for channel in range(3)]
                     else:
                         result = original
-                    updated.extend(struct.pack(">3H", *(
+                    slab.extend(struct.pack(">3H", *(
                         max(0, min(65535, int(round(value * 65535.0))))
                         for value in result
                     )))
-        for channel in range(3):
-            output_curve = [
-                sample_table(incorporated_calibration[channel],
-                             index / float(new_output_entries - 1))
-                if incorporated_calibration is not None
-                else index / float(new_output_entries - 1)
-                for index in range(new_output_entries)
-            ]
-            updated.extend(struct.pack(">{}H".format(new_output_entries), *(
-                max(0, min(65535, int(round(value * 65535.0))))
-                for value in output_curve
-            )))
-        replacements[signature] = bytes(updated)
-        changed = True
-    if not changed:
+        return bytes(slab)
+
+    # Red slabs are independent; spread them over the worker processes.
+    updated.extend(run_slabs(reshape_slab, grid))
+    for channel in range(3):
+        output_curve = [
+            sample_table(incorporated_calibration[channel],
+                         index / float(new_output_entries - 1))
+            if incorporated_calibration is not None
+            else index / float(new_output_entries - 1)
+            for index in range(new_output_entries)
+        ]
+        updated.extend(struct.pack(">{}H".format(new_output_entries), *(
+            max(0, min(65535, int(round(value * 65535.0))))
+            for value in output_curve
+        )))
+    return bytes(updated)
+
+
+def reshape_hdr_b2a_for_pq(profile, white_y, incorporated_calibration=None, grid_size=65):
+    """Give a KDE HDR B2A table a PQ-domain shaper and neutral corridor.
+
+    Argyll's inverse display table is sampled in linear PCS XYZ. Even a 45^3
+    cLUT then places both 5% and 10% PQ inside its first cell, so the OLED toe
+    cannot be represented accurately. Reparameterize the table through PQ
+    input shapers, resample the original chromatic transform, and reserve the
+    one-cell neutral corridor for the calibration stage. With VCGT, that
+    corridor stays in source PQ and KWin applies the separate curves. When
+    calibration is included without VCGT, keep the neutral cLUT in its
+    virtual-device domain and put the calibration in the high-resolution B2A
+    output shapers. This preserves sharp HDR rolloffs that a 3D grid cannot.
+    """
+    # Linked B2A0/B2A1 copies share one reshape; distinct tables run in
+    # parallel worker processes.
+    signatures = {}
+    payloads = []
+    for signature, payload in read_icc_tags(profile):
+        if signature not in (b"B2A0", b"B2A1") or signature in signatures:
+            continue
+        if len(payload) < 52 or payload[:4] != b"mft2":
+            continue
+        if payload not in payloads:
+            payloads.append(payload)
+        signatures[signature] = payloads.index(payload)
+    results = run_tasks(_reshape_hdr_b2a_table, [
+        (payload, white_y, incorporated_calibration, grid_size)
+        for payload in payloads])
+    replacements = dict((signature, results[index])
+                        for signature, index in signatures.items()
+                        if results[index] is not None)
+    if not replacements:
         fail("KDE HDR calibrated profiles require an mft2 B2A transform")
     return rebuild_icc(profile, replacements)
 
 
-def refine_hdr_b2a_from_forward_model(profile, forward_profile, white_y):
+# Nodes per NumPy refinement batch. This bounds the temporary arrays of a 65^3
+# solve to tens of MB on the Pi while keeping per-call overhead negligible.
+REFINE_BATCH_NODES = 32768
+
+
+def _numpy_squared_error(actual, target):
+    difference = actual - target
+    return (difference[:, 0] ** 2 + difference[:, 1] ** 2) + difference[:, 2] ** 2
+
+
+def _numpy_calibration_to_profile_values(curve, devices):
+    """Batched calibration_to_profile_value for one output curve."""
+    table = numpy.asarray(curve, dtype=float)
+    if numpy.any(table[1:] < table[:-1]):
+        return numpy.array([calibration_to_profile_value(curve, device)
+                            for device in devices.tolist()])
+    # On a non-decreasing curve the scalar bisection always ends on the last
+    # entry not above the device value, which is exactly searchsorted's slot.
+    low = numpy.clip(numpy.searchsorted(table, devices, side="right") - 1,
+                     0, len(table) - 2)
+    step = table[low + 1] - table[low]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        fraction = numpy.where(step <= 0, 0.0, (devices - table[low]) / step)
+    result = (low + fraction) / (len(table) - 1.0)
+    return numpy.where(devices <= table[0], 0.0,
+                       numpy.where(devices >= table[-1], 1.0, result))
+
+
+def _refine_counters():
+    """Running solve counters of one refinement slab range."""
+    return {"nodes": 0, "iterations": 0, "max_iterations": 0, "not_converged": 0,
+            "evaluations": 0}
+
+
+def _numpy_solve_b2a_nodes(forward, targets, initial, actual=None, jacobian=None):
+    """Run the refinement's per-node Newton solve for many nodes in lockstep.
+
+    forward returns values and analytic Jacobians for an (N, 3) array. Every
+    node follows the scalar solve_node step for step: the same singular-
+    Jacobian stop, halving line search and step tolerance. Nodes leave the
+    active set as they individually stop. Returns (device, accepted steps,
+    flags of nodes still moving after the last iteration, forward
+    evaluations).
+    """
+    count = len(initial)
+    device = initial.copy()
+    evaluations = 0
+    if actual is None:
+        actual, jacobian = forward(device)
+        evaluations += count
+    else:
+        actual, jacobian = actual.copy(), jacobian.copy()
+    error = _numpy_squared_error(actual, targets)
+    iterations = numpy.zeros(count, dtype=numpy.intp)
+    active = numpy.arange(count)
+    for unused in range(14):
+        if not active.size:
+            break
+        a, b, c, d, e, f, g, h, i = jacobian[active].T
+        determinant = a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+        solvable = ~(numpy.abs(determinant) < 1e-9)
+        a, b, c, d, e, f, g, h, i, determinant = [
+            value[solvable] for value in (a, b, c, d, e, f, g, h, i, determinant)]
+        active = active[solvable]
+        current = device[active]
+        residual = targets[active] - actual[active]
+        inverse = (
+            (e * i - f * h) / determinant, (c * h - b * i) / determinant,
+            (b * f - c * e) / determinant, (f * g - d * i) / determinant,
+            (a * i - c * g) / determinant, (c * d - a * f) / determinant,
+            (d * h - e * g) / determinant, (b * g - a * h) / determinant,
+            (a * e - b * d) / determinant,
+        )
+        delta = numpy.column_stack([
+            inverse[row * 3] * residual[:, 0]
+            + inverse[row * 3 + 1] * residual[:, 1]
+            + inverse[row * 3 + 2] * residual[:, 2]
+            for row in range(3)
+        ])
+        accepted_scale = numpy.zeros(len(active))
+        pending = numpy.arange(len(active))
+        scale = 1.0
+        while scale >= 1.0 / 128.0 and pending.size:
+            probe = numpy.clip(current[pending] + scale * delta[pending], 0.0, 1.0)
+            measured, measured_jacobian = forward(probe)
+            evaluations += len(pending)
+            nodes = active[pending]
+            probe_error = _numpy_squared_error(measured, targets[nodes])
+            better = probe_error < error[nodes]
+            improved = nodes[better]
+            device[improved] = probe[better]
+            actual[improved] = measured[better]
+            jacobian[improved] = measured_jacobian[better]
+            error[improved] = probe_error[better]
+            accepted_scale[pending[better]] = scale
+            pending = pending[~better]
+            scale /= 2.0
+        moved = numpy.max(numpy.abs(accepted_scale[:, None] * delta), axis=1)
+        iterations[active[accepted_scale > 0.0]] += 1
+        active = active[(accepted_scale > 0.0) & (moved >= 0.000002)]
+    unfinished = numpy.zeros(count, dtype=bool)
+    unfinished[active] = True
+    return device, iterations, unfinished, evaluations
+
+
+def _numpy_refine_b2a_clut(forward, base, lut, white_y, first, last, continuation=False):
+    """Batched twin of the scalar node loop for red slabs first..last-1.
+
+    Returns the packed cLUT bytes of those slabs and their solve statistics.
+    """
+    d50 = (0.9642, 1.0, 0.8249)
+    grid = lut.grid
+    denominator = float(grid - 1)
+    nodes_per_slab = grid * grid
+    original = readonly_array(lut.clut).reshape(-1, 3)[
+        first * nodes_per_slab:last * nodes_per_slab]
+    indices = numpy.indices((grid, grid, grid)).reshape(3, -1).T[
+        first * nodes_per_slab:last * nodes_per_slab]
+    # A node's target channel depends only on its own grid index.
+    axis_targets = [
+        numpy.array([d50[channel] * pq_to_nits(index / denominator) / white_y
+                     for index in range(grid)])
+        for channel in range(3)
+    ]
+    spread = indices.max(axis=1) - indices.min(axis=1)
+    solvable = (spread > 2) & (indices.max(axis=1) / denominator <= 0.82)
+    solved = numpy.flatnonzero(solvable)
+    refined = original.copy()
+    statistics = _refine_counters()
+
+    def store(nodes, device, iterations, unfinished, evaluations):
+        refined[nodes] = numpy.column_stack([
+            _numpy_calibration_to_profile_values(lut.output_tables[channel],
+                                                 device[:, channel])
+            for channel in range(3)
+        ])
+        statistics["nodes"] += len(nodes)
+        statistics["iterations"] += int(iterations.sum())
+        statistics["max_iterations"] = max(statistics["max_iterations"],
+                                           int(iterations.max()) if len(nodes) else 0)
+        statistics["not_converged"] += int(unfinished.sum())
+        statistics["evaluations"] += evaluations
+
+    def targets_of(nodes):
+        return numpy.column_stack([
+            axis_targets[channel][indices[nodes, channel]] for channel in range(3)])
+
+    if not continuation:
+        for start in range(0, len(solved), REFINE_BATCH_NODES):
+            nodes = solved[start:start + REFINE_BATCH_NODES]
+            device, iterations, unfinished, evaluations = _numpy_solve_b2a_nodes(
+                forward.evaluate_array_with_jacobian, targets_of(nodes),
+                base.evaluate_array(targets_of(nodes)))
+            store(nodes, device, iterations, unfinished, evaluations)
+    else:
+        # Sweep the blue axis: every node of one blue plane is solved in
+        # lockstep, seeded from its solved blue - 1 neighbour.
+        solution = numpy.zeros((len(indices), 3))
+        for blue in range(grid):
+            nodes = numpy.flatnonzero(solvable & (indices[:, 2] == blue))
+            if not nodes.size:
+                continue
+            targets = targets_of(nodes)
+            device = base.evaluate_array(targets)
+            actual, jacobian = forward.evaluate_array_with_jacobian(device)
+            evaluations = len(nodes)
+            if blue > 0:
+                neighbours = nodes - 1
+                seeded = numpy.flatnonzero(solvable[neighbours])
+                if seeded.size:
+                    candidate = solution[neighbours[seeded]]
+                    candidate_actual, candidate_jacobian = (
+                        forward.evaluate_array_with_jacobian(candidate))
+                    evaluations += len(seeded)
+                    better = (_numpy_squared_error(candidate_actual, targets[seeded])
+                              < _numpy_squared_error(actual[seeded], targets[seeded]))
+                    chosen = seeded[better]
+                    device[chosen] = candidate[better]
+                    actual[chosen] = candidate_actual[better]
+                    jacobian[chosen] = candidate_jacobian[better]
+            device, iterations, unfinished, solve_evaluations = _numpy_solve_b2a_nodes(
+                forward.evaluate_array_with_jacobian, targets, device, actual, jacobian)
+            solution[nodes] = device
+            store(nodes, device, iterations, unfinished, evaluations + solve_evaluations)
+    blended = (spread == 3) | (spread == 4)
+    weight = ((spread[blended] - 2) / 3.0)[:, None]
+    refined[blended] = (original[blended] * (1.0 - weight)
+                        + refined[blended] * weight)
+    packed = numpy.clip(numpy.rint(refined * 65535.0), 0, 65535).astype(">u2").tobytes()
+    return packed, statistics
+
+
+def refine_hdr_b2a_from_forward_model(profile, forward_profile, white_y,
+                                      continuation=False, statistics=None):
     """Numerically invert the measured A2B model into the PQ B2A cLUT.
 
     Argyll's independently fitted B2A can diverge from its better-constrained
@@ -4065,12 +4231,23 @@ def refine_hdr_b2a_from_forward_model(profile, forward_profile, white_y):
     against the raw High-quality A2B while retaining the PQ neutral corridor,
     output shapers and unreachable plateau region from the reshaped profile.
     Only the original characterization model is consumed.
+
+    Each Newton step uses the A2B's analytic Jacobian, which comes with every
+    forward evaluation. By default every node starts from the original B2A.
+    With continuation, nodes are solved along each blue scanline and a node
+    starts from its solved neighbour when that is closer than the B2A
+    estimate. A statistics dict, when given, receives the solve mode, node
+    count, iterations per node, forward evaluations and the number of nodes
+    still moving when the iteration limit ran out. Nodes whose target is
+    unreachable stop early at the closest point the line search finds, and
+    count as settled.
     """
     forward = mft2_a2b_evaluator(forward_profile)
     d50 = (0.9642, 1.0, 0.8249)
     replacements = {}
     refined_payloads = {}
     changed = False
+    totals = _refine_counters()
 
     for signature, payload in read_icc_tags(profile):
         if signature not in (b"B2A0", b"B2A1") or signature in replacements:
@@ -4086,132 +4263,166 @@ def refine_hdr_b2a_from_forward_model(profile, forward_profile, white_y):
         if len(payload) < 52 or payload[:4] != b"mft2":
             continue
         input_channels, output_channels, grid = payload[8], payload[9], payload[10]
-        input_entries, output_entries = struct.unpack_from(">HH", payload, 48)
         if input_channels != 3 or output_channels != 3 or grid < 2:
             continue
-        input_start = 52
-        clut_start = input_start + input_channels * input_entries * 2
-        clut_values = grid ** input_channels * output_channels
-        output_start = clut_start + clut_values * 2
-        required = output_start + output_channels * output_entries * 2
-        if required > len(payload):
+        try:
+            lut = load_mft2(payload)
+        except ValueError:
             fail("ICC B2A forward-model refinement table is truncated")
+        output_tables = lut.output_tables
+        # The original B2A seeds every solve from the PCS target.
+        base = Mft2Evaluator(lut, input_divisor=65535.0 / 32768.0)
+        if numpy_enabled():
+            # NumPy solves every node of a red slab range in lockstep; the
+            # per-node scalar solve below is the stdlib reference it mirrors.
+            slabs = map_slabs(
+                lambda first, last: _numpy_refine_b2a_clut(
+                    forward, base, lut, white_y, first, last, continuation),
+                grid)
+        else:
+            original_clut = lut.clut
+            counter = [0]
+
+            def evaluate(device):
+                counter[0] += 1
+                value, jacobian = forward.evaluate_with_jacobian(device)
+                return value, [jacobian[0:3], jacobian[3:6], jacobian[6:9]]
+
+            def model_error(actual, target):
+                return sum((actual[channel] - target[channel]) ** 2
+                           for channel in range(3))
+
+            def solve_node(target, device, actual, jacobian):
+                """Return (device, accepted steps, still moving)."""
+                error = model_error(actual, target)
+                iterations = 0
+                for unused in range(14):
+                    residual = [target[channel] - actual[channel] for channel in range(3)]
+                    try:
+                        delta = mat_vec_mul(mat_inv(jacobian), residual)
+                    except ValueError:
+                        break
+                    scale = 1.0
+                    accepted = False
+                    while scale >= 1.0 / 128.0:
+                        probe = [max(0.0, min(1.0,
+                                     device[channel] + scale * delta[channel]))
+                                 for channel in range(3)]
+                        measured, measured_jacobian = evaluate(probe)
+                        current_error = model_error(measured, target)
+                        if current_error < error:
+                            device, actual, jacobian = probe, measured, measured_jacobian
+                            error = current_error
+                            accepted = True
+                            break
+                        scale /= 2.0
+                    if not accepted:
+                        break
+                    iterations += 1
+                    if max(abs(scale * value) for value in delta) < 0.000002:
+                        break
+                else:
+                    return device, iterations, True
+                return device, iterations, False
 
-        input_tables = []
-        output_tables = []
-        for channel in range(3):
-            offset = input_start + channel * input_entries * 2
-            input_tables.append([value / 65535.0 for value in struct.unpack_from(
-                ">{}H".format(input_entries), payload, offset)])
-            offset = output_start + channel * output_entries * 2
-            output_tables.append([value / 65535.0 for value in struct.unpack_from(
-                ">{}H".format(output_entries), payload, offset)])
-        original_clut = [value / 65535.0 for value in struct.unpack_from(
-            ">{}H".format(clut_values), payload, clut_start)]
-
-        def base_device(target):
-            coordinates = [
-                sample_table(input_tables[channel],
-                             target[channel] / (65535.0 / 32768.0))
+            denominator = float(grid - 1)
+            axis_targets = [
+                [d50[channel] * pq_to_nits(index / denominator) / white_y
+                 for index in range(grid)]
                 for channel in range(3)
             ]
-            pre_output = _sample_mft2_clut(original_clut, grid, coordinates)
-            return [sample_table(output_tables[channel], pre_output[channel])
-                    for channel in range(3)]
 
-        def model_error(device, target):
-            actual = forward(device)
-            return sum((actual[channel] - target[channel]) ** 2
-                       for channel in range(3))
-
-        def solve_node(target, initial):
-            device = list(initial)
-            previous_error = model_error(device, target)
-            for unused in range(14):
-                actual = forward(device)
-                residual = [target[channel] - actual[channel] for channel in range(3)]
-                step = 0.002
-                columns = []
-                for axis in range(3):
-                    probe = list(device)
-                    probe[axis] = (min(1.0, device[axis] + step)
-                                   if device[axis] < 0.998
-                                   else max(0.0, device[axis] - step))
-                    measured = forward(probe)
-                    denominator = probe[axis] - device[axis]
-                    columns.append([
-                        (measured[channel] - actual[channel]) / denominator
-                        for channel in range(3)
-                    ])
-                jacobian = [[columns[column][row] for column in range(3)]
-                            for row in range(3)]
-                try:
-                    delta = mat_vec_mul(mat_inv(jacobian), residual)
-                except ValueError:
-                    break
-                scale = 1.0
-                accepted = False
-                while scale >= 1.0 / 128.0:
-                    probe = [max(0.0, min(1.0,
-                                 device[channel] + scale * delta[channel]))
-                             for channel in range(3)]
-                    current_error = model_error(probe, target)
-                    if current_error < previous_error:
-                        device = probe
-                        previous_error = current_error
-                        accepted = True
-                        break
-                    scale /= 2.0
-                if (not accepted
-                        or max(abs(scale * value) for value in delta) < 0.000002):
-                    break
-            return device
-
-        refined_clut = []
-        denominator = float(grid - 1)
-        for red in range(grid):
-            for green in range(grid):
-                for blue in range(grid):
-                    pq_coordinates = [red / denominator, green / denominator,
-                                      blue / denominator]
-                    target = [
-                        d50[channel] * pq_to_nits(pq_coordinates[channel]) / white_y
-                        for channel in range(3)
-                    ]
-                    initial = base_device(target)
-                    spread = max(red, green, blue) - min(red, green, blue)
-                    node = ((red * grid + green) * grid + blue) * 3
-                    original = original_clut[node:node + 3]
-                    if spread <= 2 or max(pq_coordinates) > 0.82:
-                        pre_output = original
-                    else:
-                        device = solve_node(target, initial)
-                        pre_output = [
-                            calibration_to_profile_value(output_tables[channel],
-                                                         device[channel])
-                            for channel in range(3)
-                        ]
-                    if spread in (3, 4):
-                        weight = (spread - 2) / 3.0
-                        pre_output = [
-                            original[channel] * (1.0 - weight)
-                            + pre_output[channel] * weight
-                            for channel in range(3)
-                        ]
-                    refined_clut.extend(pre_output)
-
-        updated = bytearray(payload[:clut_start])
-        updated.extend(struct.pack(">{}H".format(len(refined_clut)), *(
-            max(0, min(65535, int(round(value * 65535.0))))
-            for value in refined_clut
-        )))
-        updated.extend(payload[output_start:])
+            def refine_slab(first, last):
+                slab = []
+                statistics = _refine_counters()
+                counter[0] = 0
+                for red in range(first, last):
+                    # Seed the slab's solved nodes with one batched B2A lookup.
+                    slab_targets = []
+                    for green in range(grid):
+                        for blue in range(grid):
+                            spread = max(red, green, blue) - min(red, green, blue)
+                            if spread > 2 and max(red, green, blue) / denominator <= 0.82:
+                                slab_targets.extend((axis_targets[0][red],
+                                                     axis_targets[1][green],
+                                                     axis_targets[2][blue]))
+                    slab_initial = base.evaluate_many(slab_targets)
+                    solved = 0
+                    for green in range(grid):
+                        neighbour = None
+                        for blue in range(grid):
+                            spread = max(red, green, blue) - min(red, green, blue)
+                            node = ((red * grid + green) * grid + blue) * 3
+                            original = original_clut[node:node + 3]
+                            if spread <= 2 or max(red, green, blue) / denominator > 0.82:
+                                pre_output = original
+                                neighbour = None
+                            else:
+                                target = slab_targets[solved:solved + 3]
+                                device = slab_initial[solved:solved + 3]
+                                actual, jacobian = evaluate(device)
+                                if continuation and neighbour is not None:
+                                    candidate_actual, candidate_jacobian = evaluate(neighbour)
+                                    if (model_error(candidate_actual, target)
+                                            < model_error(actual, target)):
+                                        device, actual = neighbour, candidate_actual
+                                        jacobian = candidate_jacobian
+                                device, iterations, unfinished = solve_node(
+                                    target, device, actual, jacobian)
+                                neighbour = device
+                                solved += 3
+                                statistics["nodes"] += 1
+                                statistics["iterations"] += iterations
+                                statistics["max_iterations"] = max(
+                                    statistics["max_iterations"], iterations)
+                                statistics["not_converged"] += 1 if unfinished else 0
+                                pre_output = [
+                                    calibration_to_profile_value(output_tables[channel],
+                                                                 device[channel])
+                                    for channel in range(3)
+                                ]
+                            if spread in (3, 4):
+                                weight = (spread - 2) / 3.0
+                                pre_output = [
+                                    original[channel] * (1.0 - weight)
+                                    + pre_output[channel] * weight
+                                    for channel in range(3)
+                                ]
+                            slab.extend(pre_output)
+                statistics["evaluations"] = counter[0]
+                return struct.pack(">{}H".format(len(slab)), *(
+                    max(0, min(65535, int(round(value * 65535.0))))
+                    for value in slab
+                )), statistics
+
+            slabs = map_slabs(refine_slab, grid)
+
+        refined_clut = b"".join(packed for packed, _ in slabs)
+        for _, slab_statistics in slabs:
+            for key, value in slab_statistics.items():
+                totals[key] = (max(totals[key], value) if key == "max_iterations"
+                               else totals[key] + value)
+        updated = bytearray(payload[:lut.clut_start])
+        updated.extend(refined_clut)
+        updated.extend(payload[lut.output_start:])
         replacements[signature] = bytes(updated)
         refined_payloads[payload] = replacements[signature]
         changed = True
 
     if not changed:
         fail("KDE HDR forward-model refinement requires an mft2 B2A transform")
+    if statistics is not None:
+        nodes = totals["nodes"]
+        statistics.update({
+            "mode": "continuation" if continuation else "newton",
+            "nodes": nodes,
+            "mean_iterations": round(totals["iterations"] / float(nodes), 3) if nodes else 0.0,
+            "max_iterations": totals["max_iterations"],
+            "forward_evaluations": totals["evaluations"],
+            "evaluations_per_node": (round(totals["evaluations"] / float(nodes), 2)
+                                     if nodes else 0.0),
+            "not_converged": totals["not_converged"],
+        })
     return rebuild_icc(profile, replacements)
 
 
@@ -4331,9 +4542,16 @@ def unique_profile_filename(output_dir, filename):
 
 # Offload directory shared with the WebUI. The builder writes a job here, the
 # Companion collects it through the existing poll channel, and the finished
-# profile is written back by the result endpoint.
+# profile is written back by the result endpoint. The builder wakes on changes
+# in the directory; COMPANION_BUILD_POLL_SECONDS paces the checks that no file
+# announces, and every check when inotify is unavailable.
 COMPANION_BUILD_DIR = "/var/lib/PGenerator/icc-companion/build"
 COMPANION_BUILD_POLL_SECONDS = 2.0
+# An offloaded Python stage runs here instead once the Companion has shown no
+# progress on it for COMPANION_STAGE_IDLE_SECONDS, or has not answered within
+# COMPANION_STAGE_TIMEOUT; the slowest stage takes a few minutes on a Pi 4.
+COMPANION_STAGE_IDLE_SECONDS = 10
+COMPANION_STAGE_TIMEOUT = 600
 
 
 # The Companion polls every few seconds whenever it is running, whether or not
@@ -4363,53 +4581,268 @@ def companion_seen_recently(state):
     return abs(time.time() - seen) <= COMPANION_SEEN_SECONDS
 
 
-def companion_build_offload(ti3, command, temporary_output, timeout_seconds):
-    """Ask a connected Patch Companion to run colprof, returning True on success.
+def companion_job_wait(watch, claim_path, job_id, deadline):
+    """Sleep until the job directory changes or the next check is due.
 
-    colprof is single-threaded and the Pi 4 needs roughly ten minutes for a
-    high-quality cLUT fit that an x86 desktop finishes in under a minute, so
-    the fit is handed to the Companion when one is connected. Only colprof
-    moves: the characterization, the MHC2/vcgt derivation and the ICC rebuild
-    all stay here, so there is one implementation of the calibration logic
-    regardless of where the fit ran.
+    A claimed job ends with result.icc, error.txt or the deadline, and the
+    files wake the watch, so it sleeps up to the deadline: a multi-hour fit no
+    longer wakes the Pi every poll interval. Before the claim the Companion's
+    poll freshness can lapse without any file changing, so that is re-checked
+    every COMPANION_BUILD_POLL_SECONDS.
+    """
+    remaining = deadline - time.time()
+    if str(read_companion_state(claim_path).get("job", "")) != job_id:
+        remaining = min(remaining, COMPANION_BUILD_POLL_SECONDS)
+    watch.wait(remaining)
+
+
+# Open, flock()ed owner.lock of every job this process has queued, by job id.
+# The kernel drops the lock when the builder exits however it exits, so a
+# reused pid cannot keep a dead builder's job queued.
+_job_locks = {}
 
-    Recoverable failures return False and leave the caller to run colprof
-    locally. A Companion that consumes the complete deadline raises instead,
-    because repeating the same multi-hour fit on the Pi would only cause the
-    outer request to time out later.
+
+def companion_job_live(job_id):
+    """Whether the builder that queued job_id still holds the job's lock.
+
+    A directory created a moment ago may not have its lock yet; its owner is
+    then judged by the pid in the id.
     """
-    if os.environ.get("PGEN_ICC_NO_OFFLOAD"):
+    match = re.match(r"\A\d+-(\d+)\Z", job_id)
+    if not match:
         return False
+    try:
+        fd = os.open(os.path.join(COMPANION_BUILD_DIR, "jobs", job_id, "owner.lock"), os.O_RDONLY)
+    except OSError:
+        try:
+            os.kill(int(match.group(1)), 0)
+        except OSError as error:
+            return error.errno == errno.EPERM
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+@contextlib.contextmanager
+def companion_queue():
+    """The offload queue manifest, locked against other builders for the block.
+
+    Yields the list of queued {"job", "operation"} entries, oldest first; the
+    list as the block leaves it is written back. Jobs whose builder has exited
+    lose their directory and their entry on the way, so a killed build cannot
+    leave work behind for the Companion.
+    """
+    jobs_dir = os.path.join(COMPANION_BUILD_DIR, "jobs")
+    queue_path = os.path.join(COMPANION_BUILD_DIR, "queue.json")
+    if not os.path.isdir(jobs_dir):
+        os.mkdir(jobs_dir, 0o700)
+    with open(os.path.join(COMPANION_BUILD_DIR, "queue.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        for job_id in os.listdir(jobs_dir):
+            if not companion_job_live(job_id):
+                shutil.rmtree(os.path.join(jobs_dir, job_id), ignore_errors=True)
+        queue = [entry for entry in read_companion_state(queue_path).get("jobs", [])
+                 if isinstance(entry, dict)
+                 and os.path.isdir(os.path.join(jobs_dir, str(entry.get("job", ""))))]
+        yield queue
+        write_json_atomic(queue_path, {"jobs": queue})
+
+
+def companion_job_create():
+    """Create an empty job directory, returning (job id, directory).
+
+    The id is the submission time in milliseconds and the builder's pid, so
+    ids sort by submission and name their owner. The builder holds an flock
+    on the directory's owner.lock until companion_job_remove().
+    """
+    jobs_dir = os.path.join(COMPANION_BUILD_DIR, "jobs")
+    if not os.path.isdir(jobs_dir):
+        os.mkdir(jobs_dir, 0o700)
+    stamp = int(time.time() * 1000)
+    while True:
+        job_id = "%d-%d" % (stamp, os.getpid())
+        job_dir = os.path.join(jobs_dir, job_id)
+        try:
+            os.mkdir(job_dir, 0o700)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+            stamp += 1
+            continue
+        # Locked before it is renamed into place, so no other builder sees
+        # the lock unheld and takes the new job for an orphan.
+        lock_path = os.path.join(job_dir, "owner.lock")
+        fd = os.open(lock_path + ".tmp", os.O_WRONLY | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(lock_path + ".tmp", lock_path)
+        _job_locks[job_id] = fd
+        return job_id, job_dir
+
+
+def companion_job_submit(job_dir, job, heartbeat=False):
+    """Write job.json into a job directory whose inputs are staged, and queue it.
+
+    heartbeat creates the job's progress file, which the WebUI refreshes
+    while the Companion lists the job as running (see
+    companion_job_progress()). Only waits that read it ask for one.
+    """
+    if heartbeat:
+        with open(os.path.join(job_dir, "progress"), "wb"):
+            pass
+    write_json_atomic(os.path.join(job_dir, "job.json"), job)
+    with companion_queue() as queue:
+        queue.append({"job": job["job"], "operation": job["operation"]})
+
+
+def companion_job_remove(job_id):
+    """Take a job out of the queue and delete its directory."""
+    with companion_queue() as queue:
+        queue[:] = [entry for entry in queue if entry.get("job") != job_id]
+        shutil.rmtree(os.path.join(COMPANION_BUILD_DIR, "jobs", job_id), ignore_errors=True)
+    fd = _job_locks.pop(job_id, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def companion_job_answer(job_id, minimum_bytes, deadline, local=None):
+    """Wait for a queued job's answer.
+
+    Returns ("result", path) once result.icc holds more than minimum_bytes,
+    ("error", reason) for error.txt, ("timeout", None) at the deadline, and
+    None when the job was never claimed and the Companion stopped polling.
+    With local, a process racing the Companion, ("local", returncode) once
+    it exits; the unclaimed-job check is left to the process then.
+    """
+    job_dir = os.path.join(COMPANION_BUILD_DIR, "jobs", job_id)
+    result_path = os.path.join(job_dir, "result.icc")
+    error_path = os.path.join(job_dir, "error.txt")
+    claim_path = os.path.join(job_dir, "claim.json")
+    state_path = os.path.join(COMPANION_BUILD_DIR, "companion.json")
+    with DirectoryWatch(job_dir, COMPANION_BUILD_POLL_SECONDS) as watch:
+        while time.time() < deadline:
+            if local is not None:
+                report_progress(None, source="companion",
+                                message="Running here and on the Patch Companion")
+            elif str(read_companion_state(claim_path).get("job", "")) == job_id:
+                report_progress(None, source="companion", message="Running on the Patch Companion")
+            else:
+                report_progress(None, source="companion",
+                                message="Waiting for the Patch Companion to claim the job")
+            if os.path.isfile(result_path) and os.path.getsize(result_path) > minimum_bytes:
+                return "result", result_path
+            if os.path.isfile(error_path):
+                try:
+                    with io.open(error_path, "r", encoding="utf-8") as handle:
+                        return "error", handle.read(240).strip()
+                except (OSError, IOError):
+                    return "error", ""
+            if local is not None:
+                if local.poll() is not None:
+                    return "local", local.returncode
+                # A process exit does not touch the job directory.
+                watch.wait(min(deadline - time.time(), COMPANION_BUILD_POLL_SECONDS))
+                continue
+            # A single-slot Companion runs colprof synchronously and cannot
+            # poll during the fit. Once it has fetched the input, claim.json
+            # proves that this exact job was accepted and the deadline becomes
+            # its liveness bound. Poll freshness still rejects an unclaimed job.
+            if not companion_seen_recently(read_companion_state(state_path)):
+                claim = read_companion_state(claim_path)
+                if str(claim.get("job", "")) != job_id:
+                    return None
+            companion_job_wait(watch, claim_path, job_id, deadline)
+    return "timeout", None
+
+
+def companion_job_progress(job_id):
+    """When the Companion last showed progress on a job: its newest file's
+    mtime.
+
+    Submission writes the inputs and the claim rewrites claim.json, so a job
+    nobody has picked up reports its submission time. A job submitted with a
+    heartbeat has a progress file, and while a Companion with build threads
+    lists the job as running its polls refresh that file's mtime every two
+    seconds. Only the mtime changes, which wakes no DirectoryWatch. A
+    single-slot Companion cannot poll during its fit, so for it this stays at
+    the claim.
+    """
+    job_dir = os.path.join(COMPANION_BUILD_DIR, "jobs", job_id)
+    newest = 0.0
+    try:
+        for name in os.listdir(job_dir):
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(job_dir, name)))
+            except OSError:
+                pass
+    except OSError:
+        pass
+    return newest or time.time()
+
+
+def companion_race_seconds():
+    """Seconds without Companion progress before colprof also starts here.
+
+    PGEN_ICC_OFFLOAD_RACE enables the race; unset or 0 keeps waiting for the
+    Companion alone. A window shorter than the Companion's poll interval
+    races fits that are still running.
+    """
+    try:
+        seconds = float(os.environ.get("PGEN_ICC_OFFLOAD_RACE", "0"))
+    except ValueError:
+        return 0.0
+    return seconds if seconds > 0 and math.isfinite(seconds) else 0.0
+
+
+def colprof_failure(returncode, output, timeout_seconds):
+    """Fail with the reason a local colprof run exited with returncode."""
+    detail = (output or "").strip().splitlines()
+    if returncode == 124:
+        fail("ArgyllCMS profile creation timed out after {} seconds".format(timeout_seconds))
+    fail("ArgyllCMS profile creation failed" + (": " + detail[-1][:240] if detail else ""))
+
+
+# colprof jobs queued by prefetch_colprof() and not yet collected, by fit key.
+_prefetched_fits = {}
+
+
+def companion_build_submit(ti3, command, temporary_output, timeout_seconds):
+    """Queue a colprof fit on a connected Patch Companion.
+
+    Returns the job id, or None when no compatible Companion is connected and
+    the fit has to run here.
+    """
+    if os.environ.get("PGEN_ICC_NO_OFFLOAD"):
+        return None
+    job_id = None
     try:
         state_path = os.path.join(COMPANION_BUILD_DIR, "companion.json")
         if not os.path.isfile(state_path):
-            return False
+            return None
         with io.open(state_path, "r", encoding="utf-8") as handle:
             state = json.load(handle)
         if not state.get("connected"):
-            return False
+            return None
         # "connected" is written by the poll handler and is never cleared, so a
         # Companion that was closed leaves it true. Without a freshness check
         # the wait below would sit out the whole colprof timeout before falling
         # back, turning a ten-minute local fit into a twenty-five minute one.
         if not companion_seen_recently(state):
-            return False
+            return None
         # Refuse to offload to a different ArgyllCMS than the one here: the same
         # measurements fitted by a different version produce a different profile,
         # and the user would have no way to tell which built theirs.
         local_version = argyll_version()
         remote_version = str(state.get("argyll_version", ""))
         if not local_version or not remote_version or local_version != remote_version:
-            return False
+            return None
         if not os.path.isdir(COMPANION_BUILD_DIR):
-            return False
-        job_id = "%d-%d" % (int(time.time()), os.getpid())
-        result_path = os.path.join(COMPANION_BUILD_DIR, "result.icc")
-        error_path = os.path.join(COMPANION_BUILD_DIR, "error.txt")
-        claim_path = os.path.join(COMPANION_BUILD_DIR, "claim.json")
-        for stale in (result_path, error_path, claim_path):
-            if os.path.exists(stale):
-                os.remove(stale)
+            return None
+        job_id, job_dir = companion_job_create()
         # Hand over only the arguments that describe the fit. The Companion
         # appends its own "-O <output> <basename>" against its own working
         # directory, so -O, the output path and the input basename all have to
@@ -4432,47 +4865,148 @@ def companion_build_offload(ti3, command, temporary_output, timeout_seconds):
         # job: the Companion's poll response buffer is 32 KB and a 1000-patch
         # .ti3 is around 76 KB, so inlining would fail on exactly the large
         # profiles that most deserve offloading. The Companion fetches it.
-        ti3_path = os.path.join(COMPANION_BUILD_DIR, "job.ti3")
-        write_text_atomic(ti3_path, ti3)
-        job = {
+        write_text_atomic(os.path.join(job_dir, "job.ti3"), ti3)
+        companion_job_submit(job_dir, {
             "job": job_id,
             "operation": "colprof",
             "argyll_version": local_version,
             "timeout": timeout_seconds,
             "flags": flags,
             "ti3_bytes": len(ti3),
-        }
-        write_json_atomic(os.path.join(COMPANION_BUILD_DIR, "job.json"), job)
-        deadline = time.time() + timeout_seconds
-        while time.time() < deadline:
-            if os.path.isfile(result_path) and os.path.getsize(result_path) > 128:
-                shutil.copyfile(result_path, temporary_output)
-                os.remove(result_path)
+        }, heartbeat=companion_race_seconds() > 0)
+        return job_id
+    except (OSError, IOError, ValueError, KeyError):
+        if job_id:
+            companion_job_remove(job_id)
+        return None
+
+
+def companion_build_collect(job_id, temporary_output, timeout_seconds, command=None):
+    """Wait for a queued colprof job, copying its profile to temporary_output.
+
+    Returns True on success. Recoverable failures return False and leave the
+    caller to run colprof locally. A Companion that consumes the complete
+    deadline raises instead, because repeating the same multi-hour fit on the
+    Pi would only cause the outer request to time out later.
+
+    With command and a race window from companion_race_seconds(), a job the
+    Companion has shown no progress on for that long (see
+    companion_job_progress()) also starts command here at the lowest CPU
+    priority. Whichever fit finishes first is used and the other
+    is abandoned: the local colprof is killed, the Companion's job withdrawn.
+    Both fits run the same ArgyllCMS version, so either gives the same profile.
+    """
+    deadline = time.time() + timeout_seconds
+    race = 0.0
+    if command and not os.environ.get("PGEN_ICC_REQUIRE_OFFLOAD"):
+        race = companion_race_seconds()
+    local = None
+    local_log = None
+    local_failed = None
+
+    def stop_local():
+        # timeout cannot pass SIGKILL on to colprof, so kill the whole group.
+        if local.poll() is None:
+            try:
+                os.killpg(local.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            local.wait()
+
+    def local_finished(returncode):
+        if (returncode == 0 and os.path.isfile(temporary_output)
+                and os.path.getsize(temporary_output) > 0):
+            return True
+        local_log.seek(0)
+        return (returncode, local_log.read())
+
+    try:
+        while True:
+            racing = local is not None and local_failed is None
+            wake = deadline
+            if race and local is None:
+                wake = min(deadline, companion_job_progress(job_id) + race)
+            answer = companion_job_answer(job_id, 128, wake, local if racing else None)
+            kind = answer[0] if answer else None
+            if kind == "result":
+                if racing:
+                    stop_local()
+                shutil.copyfile(answer[1], temporary_output)
                 return True
-            if os.path.isfile(error_path):
-                os.remove(error_path)
-                return False
-            # The Companion runs colprof synchronously and cannot poll during
-            # the fit. Once it has fetched the TI3, claim.json proves that this
-            # exact job was accepted and the build deadline becomes its
-            # liveness bound. Poll freshness still rejects an unclaimed job.
-            if not companion_seen_recently(read_companion_state(state_path)):
-                claim = read_companion_state(claim_path)
-                if str(claim.get("job", "")) != job_id:
-                    return False
-            time.sleep(COMPANION_BUILD_POLL_SECONDS)
-        raise CompanionBuildTimeout(
-            "Patch Companion profile creation timed out after {} seconds".format(timeout_seconds))
+            if kind == "local":
+                local_failed = local_finished(answer[1])
+                if local_failed is True:
+                    return True
+                continue
+            if kind == "timeout" and time.time() < deadline:
+                # The race window ran out. Start here unless the Companion
+                # touched the job in the meantime.
+                if companion_job_progress(job_id) + race <= time.time():
+                    local_log = tempfile.TemporaryFile(mode="w+")
+                    local = subprocess.Popen(
+                        ["timeout", str(timeout_seconds)] + command,
+                        stdout=local_log, stderr=subprocess.STDOUT,
+                        universal_newlines=True, start_new_session=True,
+                        preexec_fn=lambda: os.nice(19))
+                continue
+            # The Companion is out of the race: it failed, vanished before
+            # claiming the job, or used up its deadline. A local fit already
+            # under way carries on under its own timeout.
+            if racing:
+                local_failed = local_finished(local.wait())
+                if local_failed is True:
+                    return True
+            if local_failed is not None:
+                colprof_failure(local_failed[0], local_failed[1], timeout_seconds)
+            if kind == "timeout":
+                raise CompanionBuildTimeout(
+                    "Patch Companion profile creation timed out after {} seconds".format(timeout_seconds))
+            return False
     except CompanionBuildTimeout:
         raise
-    except (OSError, IOError, ValueError, KeyError):
+    except (OSError, IOError, KeyError):
+        return False
+    except ValueError:
+        if local_failed is not None:
+            raise
         return False
     finally:
-        for leftover in ("job.json", "job.ti3", "claim.json"):
-            try:
-                os.remove(os.path.join(COMPANION_BUILD_DIR, leftover))
-            except OSError:
-                pass
+        if local is not None:
+            stop_local()
+        if local_log is not None:
+            local_log.close()
+        companion_job_remove(job_id)
+
+
+def companion_build_offload(ti3, command, temporary_output, timeout_seconds, fit_key=None):
+    """Ask a connected Patch Companion to run colprof, returning True on success.
+
+    colprof is single-threaded and the Pi 4 needs roughly ten minutes for a
+    high-quality cLUT fit that an x86 desktop finishes in under a minute, so
+    the fit is handed to the Companion when one is connected. Only colprof
+    moves: the characterization, the MHC2/vcgt derivation and the ICC rebuild
+    all stay here, so there is one implementation of the calibration logic
+    regardless of where the fit ran.
+
+    A fit that prefetch_colprof() already queued under fit_key is collected
+    instead of being queued again.
+    """
+    job_id = _prefetched_fits.pop(fit_key, None) if fit_key else None
+    if job_id is None:
+        job_id = companion_build_submit(ti3, command, temporary_output, timeout_seconds)
+    if job_id is None:
+        return False
+    return companion_build_collect(job_id, temporary_output, timeout_seconds, command)
+
+
+def companion_withdraw_prefetched():
+    """Remove prefetched colprof jobs that the build never collected."""
+    while _prefetched_fits:
+        _, job_id = _prefetched_fits.popitem()
+        try:
+            companion_job_remove(job_id)
+        except (OSError, IOError):
+            pass
 
 
 def companion_targen_offload(command, output_path, timeout_seconds,
@@ -4486,7 +5020,7 @@ def companion_targen_offload(command, output_path, timeout_seconds,
     """
     if os.environ.get("PGEN_ICC_NO_OFFLOAD"):
         return False
-    input_path = os.path.join(COMPANION_BUILD_DIR, "job.input")
+    job_id = None
     try:
         state_path = os.path.join(COMPANION_BUILD_DIR, "companion.json")
         state = read_companion_state(state_path)
@@ -4500,14 +5034,6 @@ def companion_targen_offload(command, output_path, timeout_seconds,
         if not os.path.isdir(COMPANION_BUILD_DIR):
             return False
 
-        job_id = "%d-%d" % (int(time.time()), os.getpid())
-        result_path = os.path.join(COMPANION_BUILD_DIR, "result.icc")
-        error_path = os.path.join(COMPANION_BUILD_DIR, "error.txt")
-        claim_path = os.path.join(COMPANION_BUILD_DIR, "claim.json")
-        for stale in (result_path, error_path, claim_path, input_path):
-            if os.path.exists(stale):
-                os.remove(stale)
-
         # Drop the output basename and replace the Pi-only preconditioning
         # path with a staged binary input the Companion names locally.
         flags = []
@@ -4524,9 +5050,11 @@ def companion_targen_offload(command, output_path, timeout_seconds,
                 continue
             flags.append(item)
             index += 1
+        if has_precondition and (not precondition_path or not os.path.isfile(precondition_path)):
+            return False
+        job_id, job_dir = companion_job_create()
+        input_path = os.path.join(job_dir, "job.input")
         if has_precondition:
-            if not precondition_path or not os.path.isfile(precondition_path):
-                return False
             temporary_input = input_path + ".tmp"
             shutil.copyfile(precondition_path, temporary_input)
             os.rename(temporary_input, input_path)
@@ -4537,7 +5065,7 @@ def companion_targen_offload(command, output_path, timeout_seconds,
                 handle.write(b"")
             os.rename(input_path + ".tmp", input_path)
 
-        job = {
+        companion_job_submit(job_dir, {
             "job": job_id,
             "operation": "targen",
             "argyll_version": local_version,
@@ -4545,36 +5073,21 @@ def companion_targen_offload(command, output_path, timeout_seconds,
             "flags": flags,
             "input_bytes": os.path.getsize(input_path),
             "precondition": has_precondition,
-        }
-        write_json_atomic(os.path.join(COMPANION_BUILD_DIR, "job.json"), job)
-        deadline = time.time() + timeout_seconds
-        while time.time() < deadline:
-            if os.path.isfile(result_path) and os.path.getsize(result_path) > 32:
-                shutil.copyfile(result_path, output_path)
-                os.remove(result_path)
-                return True
-            if os.path.isfile(error_path):
-                try:
-                    with io.open(error_path, "r", encoding="utf-8") as handle:
-                        reason = handle.read(240).strip()
-                except (OSError, IOError):
-                    reason = "unknown Companion error"
-                try:
-                    os.remove(error_path)
-                except OSError:
-                    pass
-                # An error file can only be written after this exact job was
-                # claimed. Do not disguise a desktop failure by repeating the
-                # expensive randomized optimization on the Pi and reporting
-                # whatever progress line the fallback happened to print last.
-                raise CompanionBuildFailed(
-                    "Patch Companion chart generation failed: {}".format(
-                        reason or "unknown Companion error"))
-            if not companion_seen_recently(read_companion_state(state_path)):
-                claim = read_companion_state(claim_path)
-                if str(claim.get("job", "")) != job_id:
-                    return False
-            time.sleep(COMPANION_BUILD_POLL_SECONDS)
+        })
+        answer = companion_job_answer(job_id, 32, time.time() + timeout_seconds)
+        if answer is None:
+            return False
+        if answer[0] == "result":
+            shutil.copyfile(answer[1], output_path)
+            return True
+        if answer[0] == "error":
+            # An error file can only be written after this exact job was
+            # claimed. Do not disguise a desktop failure by repeating the
+            # expensive randomized optimization on the Pi and reporting
+            # whatever progress line the fallback happened to print last.
+            raise CompanionBuildFailed(
+                "Patch Companion chart generation failed: {}".format(
+                    answer[1] or "unknown Companion error"))
         raise CompanionBuildTimeout(
             "Patch Companion chart generation timed out after {} seconds".format(
                 timeout_seconds))
@@ -4585,22 +5098,120 @@ def companion_targen_offload(command, output_path, timeout_seconds,
     except (OSError, IOError, ValueError, KeyError):
         return False
     finally:
-        for leftover in ("job.json", "job.input", "claim.json"):
+        if job_id:
             try:
-                os.remove(os.path.join(COMPANION_BUILD_DIR, leftover))
-            except OSError:
+                companion_job_remove(job_id)
+            except (OSError, IOError):
                 pass
 
 
-def argyll_tool_version(tool):
-    """Version string reported by one local ArgyllCMS command."""
+def companion_stage_offload(stage, arguments):
+    """Run a Python stage on a connected Patch Companion, returning its output.
+
+    Returns None when no Companion runs this stage revision or the job fails
+    in any way, including a job the Companion shows no progress on for
+    COMPANION_STAGE_IDLE_SECONDS, and the caller runs the stage here. The
+    answer is accepted only if it names the digest of this job and matches
+    its own digest.
+    """
+    if os.environ.get("PGEN_ICC_NO_OFFLOAD"):
+        return None
+    job_id = None
     try:
-        process = subprocess.Popen([tool], stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT, universal_newlines=True)
-        text = process.communicate()[0] or ""
-    except (OSError, ValueError):
+        state = read_companion_state(os.path.join(COMPANION_BUILD_DIR, "companion.json"))
+        revision = stage_revision()
+        if (not companion_seen_recently(state) or not revision
+                or str(state.get("stages", "")) != revision):
+            return None
+        data, job_sha256 = encode_stage_job(stage, arguments)
+        job_id, job_dir = companion_job_create()
+        input_path = os.path.join(job_dir, "job.input")
+        with open(input_path + ".tmp", "wb") as handle:
+            handle.write(data)
+        os.rename(input_path + ".tmp", input_path)
+        companion_job_submit(job_dir, {
+            "job": job_id,
+            "operation": "python-stage",
+            "stage": stage,
+            "revision": revision,
+            "timeout": COMPANION_STAGE_TIMEOUT,
+            "input_bytes": len(data),
+            "input_sha256": job_sha256,
+        }, heartbeat=True)
+        deadline = time.time() + COMPANION_STAGE_TIMEOUT
+        while True:
+            # The job is queued with a heartbeat: the WebUI refreshes its
+            # progress file while the Companion lists it as running. An
+            # unclaimed job, or one the Companion stopped listing, goes stale.
+            wake = min(deadline, companion_job_progress(job_id) + COMPANION_STAGE_IDLE_SECONDS)
+            answer = companion_job_answer(job_id, 32, wake)
+            if (answer and answer[0] == "timeout" and time.time() < deadline
+                    and companion_job_progress(job_id) + COMPANION_STAGE_IDLE_SECONDS > time.time()):
+                continue
+            break
+        if not answer or answer[0] != "result":
+            return None
+        with open(answer[1], "rb") as handle:
+            return decode_stage_result(handle.read(), job_sha256)
+    except (OSError, IOError, ValueError, KeyError):
+        return None
+    finally:
+        if job_id:
+            try:
+                companion_job_remove(job_id)
+            except (OSError, IOError):
+                pass
+
+
+def local_python_stage(stage, arguments):
+    """Run a Python stage named by icc_stage_job.STAGES in this process."""
+    if stage == "hdr_calibration":
+        return hdr_profile_calibration_from_a2b(**arguments)
+    if stage == "reshape":
+        return reshape_hdr_b2a_for_pq(**arguments)
+    if stage == "refine":
+        statistics = {}
+        profile = refine_hdr_b2a_from_forward_model(statistics=statistics, **arguments)
+        return {"profile": profile, "statistics": statistics}
+    fail("Unknown Python stage: {}".format(stage))
+
+
+def python_stage(stage, **arguments):
+    """Run a Python stage on the Companion when it can, otherwise here."""
+    output = companion_stage_offload(stage, arguments)
+    if output is None:
+        report_progress(stage)
+        output = local_python_stage(stage, arguments)
+    return output
+
+
+# Output of local ArgyllCMS probes, keyed by the arguments and the resolved
+# tool's identity. A build computes several fit keys and each one needs the
+# colprof version, which used to start colprof again on every call.
+_tool_probes = {}
+
+
+def argyll_tool_output(tool, arguments=()):
+    """What tool prints for arguments, run once while the file is unchanged."""
+    try:
+        path = os.path.realpath(tool)
+        status = os.stat(path)
+        key = (path, status.st_ino, status.st_mtime_ns, tuple(arguments))
+    except OSError:
         return ""
-    match = re.search(r"Version\s+([0-9]+(?:\.[0-9]+)+)", text)
+    if key not in _tool_probes:
+        try:
+            process = subprocess.Popen([tool] + list(arguments), stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, universal_newlines=True)
+            _tool_probes[key] = process.communicate()[0] or ""
+        except (OSError, ValueError):
+            return ""
+    return _tool_probes[key]
+
+
+def argyll_tool_version(tool):
+    """Version string reported by one local ArgyllCMS command."""
+    match = re.search(r"Version\s+([0-9]+(?:\.[0-9]+)+)", argyll_tool_output(tool))
     return match.group(1) if match else ""
 
 
@@ -4612,86 +5223,282 @@ def argyll_version():
 
 def colprof_supports_icc44(colprof):
     """Return whether colprof provides the PGenerator+ ICC v4.4/CICP path."""
+    return "Create ICC v4.4 RGB display profile with CICP" in argyll_tool_output(colprof, ["-?"])
+
+
+# Fitted colprof profiles keyed by their inputs. Reused measurements rebuilt
+# with the same settings produce the same .ti3 and colprof arguments, and a
+# cLUT fit on the Pi takes ten minutes to well over an hour, so the profile
+# is kept rather than fitted again. PGEN_COLPROF_CACHE names another
+# directory, or disables the cache when set to 0.
+COLPROF_CACHE_DIR = "/var/lib/PGenerator/icc-colprof-cache"
+COLPROF_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def colprof_cache_dir():
+    directory = os.environ.get("PGEN_COLPROF_CACHE", COLPROF_CACHE_DIR)
+    return "" if directory in ("", "0") else directory
+
+
+def colprof_fit_key(ti3, command, temporary_output, base):
+    """SHA-256 of the fit inputs: .ti3 data, colprof flags and Argyll version.
+
+    The CREATED timestamp and the temporary paths differ on every run without
+    changing the fit, so they are left out.
+    """
+    version = argyll_version()
+    if not version:
+        return None
+    flags = [item for item in command[1:] if item not in ("-O", temporary_output, base)]
+    digest = hashlib.sha256()
+    digest.update(re.sub(r"(?m)^CREATED .*$", "", ti3).encode("utf-8"))
+    digest.update(b"\0" + json.dumps(flags).encode("utf-8"))
+    digest.update(b"\0" + version.encode("ascii", "replace"))
+    return digest.hexdigest()
+
+
+def colprof_cache_load(key, output_path):
+    directory = colprof_cache_dir()
+    if not directory or not key:
+        return False
+    path = os.path.join(directory, key + ".icc")
     try:
-        process = subprocess.Popen([colprof, "-?"], stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT, universal_newlines=True)
-        text = process.communicate()[0] or ""
-    except (OSError, ValueError):
+        with open(path, "rb") as handle:
+            profile = handle.read()
+        if len(profile) < 132 or profile[36:40] != b"acsp":
+            os.remove(path)
+            return False
+        with open(output_path, "wb") as handle:
+            handle.write(profile)
+        # The modification time orders eviction, so a hit marks it recent.
+        os.utime(path, None)
+        return True
+    except (OSError, IOError):
         return False
-    return "Create ICC v4.4 RGB display profile with CICP" in text
 
 
-def run_colprof(payload, ti3, output_path, profile_model, patch_set, icc_version="2.2"):
+def colprof_cache_store(key, profile_path):
+    directory = colprof_cache_dir()
+    if not directory or not key:
+        return
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = os.path.join(directory, key + ".tmp")
+        shutil.copyfile(profile_path, temporary)
+        os.rename(temporary, os.path.join(directory, key + ".icc"))
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".icc"):
+                status = os.stat(os.path.join(directory, name))
+                entries.append((status.st_mtime, status.st_size, name))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        # Drop least recently used fits, always keeping the one just stored.
+        for _, size, name in entries[:-1]:
+            if total <= COLPROF_CACHE_BYTES:
+                break
+            if name != key + ".icc":
+                os.remove(os.path.join(directory, name))
+                total -= size
+    except (OSError, IOError):
+        pass  # A cache that cannot be written only costs the next fit.
+
+
+# A profile built from reusable measurements keeps the colprof fits it was
+# derived from next to its measurements sidecar, as PROFILE.icc.fit-KEY. A
+# later build that names it in "rederive_from" starts from those fits when
+# its .ti3 and colprof flags are unchanged, so changing only options applied
+# after the fit (B2A grid, CICP, or a calibration mode that keeps the same
+# characterization) takes seconds instead of a new fit. Older fits are
+# carried forward, so switching back and forth keeps hitting.
+COLPROF_SAVED_FITS = 4
+
+
+def prune_saved_fits(output_dir, filename, kept_fits):
+    """Remove fit files of filename that its sidecar no longer lists.
+
+    A fit dropped from the COLPROF_SAVED_FITS entries, or left by a build
+    that stopped before writing its sidecar, would otherwise stay on disk
+    until the profile itself is deleted.
+    """
+    kept = set(entry["file"] for entry in kept_fits)
+    pattern = re.compile(r"\A" + re.escape(filename) + r"\.fit-[0-9a-f]{16}(?:\.tmp)?\Z")
+    for name in os.listdir(output_dir):
+        if pattern.match(name) and name not in kept:
+            try:
+                os.remove(os.path.join(output_dir, name))
+            except OSError:
+                pass
+
+
+def load_saved_fits(payload, output_dir):
+    """colprof fits kept with the profile named in payload["rederive_from"].
+
+    Returns [(stage, key, profile)]. A profile built before fits were kept,
+    or without reusable measurements, has none and the build fits as usual.
+    """
+    source = payload.get("rederive_from")
+    if source in (None, ""):
+        return []
+    source = str(source)
+    if not re.match(r"^[A-Za-z0-9._()-]+\.icc$", source, re.I):
+        fail("Invalid re-derive source profile")
+    try:
+        with io.open(os.path.join(output_dir, source + ".measurements.json"), "r",
+                     encoding="utf-8") as handle:
+            sidecar = json.load(handle)
+    except (OSError, IOError, ValueError):
+        return []
+    saved = []
+    entries = sidecar.get("fits") if isinstance(sidecar, dict) else None
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        key = str(entry.get("key", ""))
+        name = str(entry.get("file", ""))
+        if not re.match(r"^[0-9a-f]{64}$", key) or name != source + ".fit-" + key[:16]:
+            continue
+        try:
+            # Through the profile cache, which the ICC worker fills before
+            # it forks the build.
+            profile = read_profile(os.path.join(output_dir, name))
+        except (OSError, IOError):
+            continue
+        if len(profile) >= 132 and profile[36:40] == b"acsp":
+            saved.append((str(entry.get("stage", "")), key, profile))
+    return saved
+
+
+def colprof_command(payload, ti3, base, profile_model, patch_set, icc_version="2.2"):
+    """colprof command line, output path and timeout for ti3 staged as base.ti3."""
     colprof = os.environ.get("PGEN_COLPROF", "/usr/bin/colprof")
     if not os.path.isfile(colprof) or not os.access(colprof, os.X_OK):
         fail("The bundled ArgyllCMS colprof executable is unavailable")
     description = profile_description(payload).replace('"', "'")
+    requested_quality = str(payload.get("profile_quality", "")).lower()
+    quality = {"low": "l", "medium": "m", "high": "h", "ultra": "u"}.get(requested_quality)
+    if quality is None:
+        quality = "h" if patch_set == "large" or len(ti3.splitlines()) > 800 else "m"
+    algorithm = PROFILE_MODELS[profile_model]["argyll"]
+    temporary_output = base + ".icc"
+    command = [
+        colprof, "-q" + quality, "-a" + algorithm, "-A", "PGenerator+", "-M", PROFILE_TYPES[payload["profile_type"]],
+        "-D", description, "-C", "Created from user measurements by PGenerator+", "-O", temporary_output, base,
+    ]
+    if icc_version == "4.4":
+        if not colprof_supports_icc44(colprof):
+            fail("ICC v4.4 profile creation requires the bundled ICC v4.4/CICP build of ArgyllCMS")
+        command[1:1] = ["-4"]
+    if PROFILE_MODELS[profile_model]["family"] == "clut":
+        # targen -V controls where the characterization patches are
+        # measured. colprof -V separately controls the inverse cLUT grid.
+        # Both use Argyll's 1.0 to 4.0 dark-region concentration scale.
+        dark = max(0.0, min(1.0, finite_number(
+            payload.get("dark_emphasis", 0.2), "dark-region emphasis")))
+        command[-3:-3] = ["-V{:.3f}".format(1.0 + dark * 3.0)]
+    average_deviation = payload.get("avg_deviation")
+    if average_deviation not in (None, ""):
+        average_deviation = finite_number(average_deviation, "measurement deviation")
+        if average_deviation < 0.0 or average_deviation > 5.0:
+            fail("Measurement deviation must be between 0 and 5 percent")
+        # The profiling UI has always described this control as colprof
+        # -r, but the builder previously discarded it. Put it before the
+        # output/input operands so both local and Companion-offloaded fits
+        # receive the same explicit noise estimate.
+        command[-3:-3] = ["-r", "{:.6g}".format(average_deviation)]
+    # cLUT fitting on the Pi is substantially slower than matrix fitting,
+    # and scales with both characterization size and requested quality.
+    # Ultra is especially expensive: a normal 1000-patch fit computes to
+    # more than 100 minutes with this estimate. Do not clamp that healthy
+    # fit to the former 40-minute ceiling.
+    line_count = len(ti3.splitlines())
+    quality_factor = {"l": 0.5, "m": 1.0, "h": 2.0, "u": 4.0}.get(quality, 1.0)
+    if PROFILE_MODELS[profile_model]["family"] == "clut":
+        # colprof's current cLUT optimizer runs one fit on one CPU thread, and a
+        # normal High fit can need more than eight minutes on Pi 4. Floors
+        # prevent small but complex data sets from being killed early;
+        # the line-count estimate gives large Ultra fits over two hours.
+        # The four-hour ceiling is a runaway guard, not an expected time.
+        quality_floor = {"l": 900, "m": 1800, "h": 3600, "u": 7200}.get(quality, 1800)
+        timeout_seconds = min(14400, max(quality_floor, int(300 + line_count * quality_factor * 2.0)))
+    else:
+        timeout_seconds = min(900, max(180, int(90 + line_count * quality_factor * 0.5)))
+    return command, temporary_output, timeout_seconds
+
+
+def run_colprof(payload, ti3, output_path, profile_model, patch_set, icc_version="2.2",
+                saved_fits=None):
+    """Fit output_path with colprof, returning (fit key, source).
+
+    source is "reused" when saved_fits, a {key: profile} map from an earlier
+    build, holds a fit with exactly these inputs, "hit" when the result cache
+    does, and "miss" when colprof ran here or on the Companion.
+    """
     temp_dir = tempfile.mkdtemp(prefix="pgen_icc_")
     try:
         base = os.path.join(temp_dir, "profile")
         with io.open(base + ".ti3", "w", encoding="ascii", errors="replace") as handle:
             handle.write(ti3)
-        requested_quality = str(payload.get("profile_quality", "")).lower()
-        quality = {"low": "l", "medium": "m", "high": "h", "ultra": "u"}.get(requested_quality)
-        if quality is None:
-            quality = "h" if patch_set == "large" or len(ti3.splitlines()) > 800 else "m"
-        algorithm = PROFILE_MODELS[profile_model]["argyll"]
-        temporary_output = base + ".icc"
-        command = [
-            colprof, "-q" + quality, "-a" + algorithm, "-A", "PGenerator+", "-M", PROFILE_TYPES[payload["profile_type"]],
-            "-D", description, "-C", "Created from user measurements by PGenerator+", "-O", temporary_output, base,
-        ]
-        if icc_version == "4.4":
-            if not colprof_supports_icc44(colprof):
-                fail("ICC v4.4 profile creation requires the bundled ICC v4.4/CICP build of ArgyllCMS")
-            command[1:1] = ["-4"]
-        if PROFILE_MODELS[profile_model]["family"] == "clut":
-            # targen -V controls where the characterization patches are
-            # measured. colprof -V separately controls the inverse cLUT grid.
-            # Both use Argyll's 1.0 to 4.0 dark-region concentration scale.
-            dark = max(0.0, min(1.0, finite_number(
-                payload.get("dark_emphasis", 0.2), "dark-region emphasis")))
-            command[-3:-3] = ["-V{:.3f}".format(1.0 + dark * 3.0)]
-        average_deviation = payload.get("avg_deviation")
-        if average_deviation not in (None, ""):
-            average_deviation = finite_number(average_deviation, "measurement deviation")
-            if average_deviation < 0.0 or average_deviation > 5.0:
-                fail("Measurement deviation must be between 0 and 5 percent")
-            # The profiling UI has always described this control as colprof
-            # -r, but the builder previously discarded it. Put it before the
-            # output/input operands so both local and Companion-offloaded fits
-            # receive the same explicit noise estimate.
-            command[-3:-3] = ["-r", "{:.6g}".format(average_deviation)]
-        # cLUT fitting on the Pi is substantially slower than matrix fitting,
-        # and scales with both characterization size and requested quality.
-        # Ultra is especially expensive: a normal 1000-patch fit computes to
-        # more than 100 minutes with this estimate. Do not clamp that healthy
-        # fit to the former 40-minute ceiling.
-        line_count = len(ti3.splitlines())
-        quality_factor = {"l": 0.5, "m": 1.0, "h": 2.0, "u": 4.0}.get(quality, 1.0)
-        if PROFILE_MODELS[profile_model]["family"] == "clut":
-            # colprof's current cLUT optimizer runs one fit on one CPU thread, and a
-            # normal High fit can need more than eight minutes on Pi 4. Floors
-            # prevent small but complex data sets from being killed early;
-            # the line-count estimate gives large Ultra fits over two hours.
-            # The four-hour ceiling is a runaway guard, not an expected time.
-            quality_floor = {"l": 900, "m": 1800, "h": 3600, "u": 7200}.get(quality, 1800)
-            timeout_seconds = min(14400, max(quality_floor, int(300 + line_count * quality_factor * 2.0)))
-        else:
-            timeout_seconds = min(900, max(180, int(90 + line_count * quality_factor * 0.5)))
-        if companion_build_offload(ti3, command, temporary_output, timeout_seconds):
+        command, temporary_output, timeout_seconds = colprof_command(
+            payload, ti3, base, profile_model, patch_set, icc_version)
+        fit_key = colprof_fit_key(ti3, command, temporary_output, base)
+        if fit_key and saved_fits and fit_key in saved_fits:
+            with open(output_path, "wb") as handle:
+                handle.write(saved_fits[fit_key])
+            return fit_key, "reused"
+        if colprof_cache_load(fit_key, output_path):
+            report_progress(None, message="Reusing a cached colprof fit")
+            return fit_key, "hit"
+        if companion_build_offload(ti3, command, temporary_output, timeout_seconds,
+                                   fit_key=fit_key):
+            colprof_cache_store(fit_key, temporary_output)
             os.rename(temporary_output, output_path)
-            return
+            return fit_key, "miss"
         if os.environ.get("PGEN_ICC_REQUIRE_OFFLOAD"):
             fail("Patch Companion did not claim the required profile build")
-        completed = subprocess.Popen(["timeout", str(timeout_seconds)] + command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        output = completed.communicate()[0]
-        if completed.returncode != 0 or not os.path.isfile(temporary_output) or os.path.getsize(temporary_output) <= 0:
-            detail = (output or "").strip().splitlines()
-            if completed.returncode == 124:
-                fail("ArgyllCMS profile creation timed out after {} seconds".format(timeout_seconds))
-            fail("ArgyllCMS profile creation failed" + (": " + detail[-1][:240] if detail else ""))
+        # -v makes colprof print its progress. It is added here, after the fit
+        # key and the Companion flags were taken, and changes nothing in the fit.
+        returncode, output = stream_command(
+            ["timeout", str(timeout_seconds), command[0], "-v"] + command[1:], None)
+        if returncode != 0 or not os.path.isfile(temporary_output) or os.path.getsize(temporary_output) <= 0:
+            colprof_failure(returncode, output, timeout_seconds)
+        colprof_cache_store(fit_key, temporary_output)
         os.rename(temporary_output, output_path)
+        return fit_key, "miss"
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def prefetch_colprof(payload, ti3, profile_model, patch_set, icc_version="2.2",
+                     saved_fits=None):
+    """Queue a later colprof fit on the Companion so it runs beside the current one.
+
+    A multi-slot Companion fits both at once; run_colprof() collects the job
+    when the build reaches that fit. Nothing is queued when the fit is saved
+    or cached, or when the Companion would run the jobs one after another.
+    """
+    state = read_companion_state(os.path.join(COMPANION_BUILD_DIR, "companion.json"))
+    try:
+        slots = int(state.get("jobs", 1))
+    except (TypeError, ValueError):
+        slots = 1
+    if slots < 2:
+        return
+    temp_dir = tempfile.mkdtemp(prefix="pgen_icc_")
+    try:
+        base = os.path.join(temp_dir, "profile")
+        command, temporary_output, timeout_seconds = colprof_command(
+            payload, ti3, base, profile_model, patch_set, icc_version)
+        fit_key = colprof_fit_key(ti3, command, temporary_output, base)
+        if not fit_key or fit_key in _prefetched_fits or (saved_fits and fit_key in saved_fits):
+            return
+        cache_dir = colprof_cache_dir()
+        if cache_dir and os.path.isfile(os.path.join(cache_dir, fit_key + ".icc")):
+            return
+        job_id = companion_build_submit(ti3, command, temporary_output, timeout_seconds)
+        if job_id:
+            _prefetched_fits[fit_key] = job_id
     finally:
         shutil.rmtree(temp_dir, ignore_errors=True)
 
@@ -4870,6 +5677,7 @@ def generate_patches(payload, output_dir):
         # its last progress line merely says "Re-seeding".
         timeout_seconds = min(1800, max(300, 120 + total // 4))
         ti1_path = base + ".ti1"
+        report_progress("targen")
         if companion_targen_offload(command, ti1_path, timeout_seconds,
                                     precondition_path or None):
             patches = parse_ti1_patches(ti1_path)
@@ -4877,11 +5685,11 @@ def generate_patches(payload, output_dir):
             return {"status": "ok", "patches": patches, "count": len(patches)}
         if os.environ.get("PGEN_ICC_REQUIRE_OFFLOAD"):
             fail("Patch Companion did not claim the required chart generation")
-        completed = subprocess.Popen(["timeout", str(timeout_seconds)] + command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        output = completed.communicate()[0]
-        if completed.returncode != 0 or not os.path.isfile(ti1_path):
+        returncode, output = stream_command(
+            ["timeout", str(timeout_seconds)] + command, "targen")
+        if returncode != 0 or not os.path.isfile(ti1_path):
             detail = (output or "").strip().splitlines()
-            if completed.returncode == 124:
+            if returncode == 124:
                 fail("ArgyllCMS patch generation timed out after {} seconds".format(
                     timeout_seconds))
             fail("ArgyllCMS patch generation failed" + (": " + detail[-1][:240] if detail else ""))
@@ -4912,6 +5720,7 @@ def generate_preconditioned_patches(payload, output_dir):
         # preconditioning while avoiding an unnecessarily expensive final-fit
         # optimization. The requested quality is still used for the real ICC.
         precondition_payload["profile_quality"] = "low"
+        report_progress("colprof")
         run_colprof(precondition_payload, ti3, profile_path, "matrix", "small")
         settings = dict(settings)
         settings["profile_type"] = payload.get("profile_type")
@@ -4933,9 +5742,18 @@ def run_profcheck(ti3_path, profile_path, rows, profile_model, patch_set):
     command = ["timeout", str(timeout_seconds), profcheck, "-v2", "-k", ti3_path, profile_path]
     environment = dict(os.environ)
     environment["LC_ALL"] = "C"
-    completed = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, env=environment)
-    output = completed.communicate()[0] or ""
-    if completed.returncode != 0:
+    # -v2 prints one "[dE] N:" line per patch, which counts the progress.
+    checked = set()
+
+    def patch_percent(line):
+        match = re.match(r"\[[0-9.eE+-]+\]\s+(\d+):", line)
+        if not match or not rows:
+            return None
+        checked.add(match.group(1))
+        return 100.0 * len(checked) / len(rows)
+
+    returncode, output = stream_command(command, "profcheck", patch_percent, environment)
+    if returncode != 0:
         detail = output.strip().splitlines()
         fail("ArgyllCMS profile validation failed" + (": " + detail[-1][:240] if detail else ""))
     summary = re.search(
@@ -5033,6 +5851,15 @@ def run_profcheck(ti3_path, profile_path, rows, profile_model, patch_set):
 
 
 def build(payload, output_dir):
+    try:
+        return _build(payload, output_dir)
+    finally:
+        companion_withdraw_prefetched()
+        clear_mft2_caches()
+
+
+def _build(payload, output_dir):
+    stages = BuildStages()
     profile_type = str(payload.get("profile_type", ""))
     if profile_type not in PROFILE_TYPES:
         fail("Unsupported ICC profile type")
@@ -5073,7 +5900,8 @@ def build(payload, output_dir):
     if calibration_mode not in ("vcgt", "profile", "none"):
         fail("Unsupported calibration mode")
     include_vcgt = calibration_mode == "vcgt"
-    rows = normalize_measurements(payload)
+    with stages.stage("normalize"):
+        rows = normalize_measurements(payload)
     metadata_white_names = ("ICC HDR Metadata White", "ICC Full Frame White")
     metadata_white_rows = [row for row in rows if row["name"] in metadata_white_names]
     profile_rows = [row for row in rows if row["name"] not in metadata_white_names]
@@ -5137,6 +5965,8 @@ def build(payload, output_dir):
     # the same measurements and the same surrounding stages so a hardware
     # comparison isolates exactly one construction difference.
     experiment = payload.get("hdr_experiment") if isinstance(payload.get("hdr_experiment"), dict) else {}
+    # Solve statistics of the opt-in forward-model refinement, when it runs.
+    refine_statistics = {}
     b2a_grid = None
     if (profile_type in ("kde-hdr", "windows-hdr")
             and PROFILE_MODELS[profile_model]["family"] == "clut"):
@@ -5153,12 +5983,13 @@ def build(payload, output_dir):
             fail("HDR B2A cube density must be 33 or 65")
     mhc2_type = profile_type if keeps_mhc2 else (
         "windows-hdr" if profile_type == "kde-hdr" else "windows-sdr")
-    mhc2, matrix, adjustment_luts, calibrated_white = mhc2_payload(
-        mhc2_type, black, white, primaries, profile_rows, target_transfer or "srgb",
-        apply_calibration=calibration_mode != "none",
-        hdr_neutral_headroom=(
-            profile_type == "windows-hdr" and calibration_mode != "none"
-            and PROFILE_MODELS[profile_model]["family"] != "clut"))
+    with stages.stage("mhc2"):
+        mhc2, matrix, adjustment_luts, calibrated_white = mhc2_payload(
+            mhc2_type, black, white, primaries, profile_rows, target_transfer or "srgb",
+            apply_calibration=calibration_mode != "none",
+            hdr_neutral_headroom=(
+                profile_type == "windows-hdr" and calibration_mode != "none"
+                and PROFILE_MODELS[profile_model]["family"] != "clut"))
     calibration = vcgt_from_mhc2(matrix, adjustment_luts, mhc2_wire_matrix(mhc2_type))
     calibration_degenerate = False
     # A calibration is a trim: below the display's knee it must track the
@@ -5217,7 +6048,8 @@ def build(payload, output_dir):
     fit_rows = profile_rows
     if not keeps_mhc2 and calibration_mode == "vcgt" and applied_calibration is None:
         fit_rows = apply_calibration_to_rows(profile_rows, calibration)
-    ti3, _, _ = make_ti3(payload, fit_rows)
+    with stages.stage("ti3"):
+        ti3, _, _ = make_ti3(payload, fit_rows)
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir, 0o755)
     stem = safe_basename(payload.get("name", "PGenerator+ display profile"))
@@ -5240,10 +6072,26 @@ def build(payload, output_dir):
     if raw_hdr_calibration_fit:
         initial_colprof_payload = dict(payload)
         initial_colprof_payload["profile_quality"] = "high"
-    run_colprof(initial_colprof_payload, ti3, output_path, profile_model, patch_set, icc_version)
+    saved_fits = load_saved_fits(payload, output_dir)
+    saved_fit_map = dict((key, fitted) for _, key, fitted in saved_fits)
+    # Where each colprof fit came from ("reused", "hit" or "miss"), and the
+    # fits themselves, kept with reusable measurements for a later re-derive.
+    colprof_cache = {}
+    fits = []
+    if raw_hdr_calibration_fit and applied_calibration is not None:
+        # The calibrated virtual fit below reuses these rows unchanged, so a
+        # Companion with free slots can run it beside the raw fit. Without
+        # applied_calibration its rows come from the raw fit's result.
+        prefetch_colprof(payload, ti3, profile_model, patch_set, icc_version,
+                         saved_fits=saved_fit_map)
+    with stages.stage("colprof"):
+        fit_key, colprof_cache["colprof"] = run_colprof(
+            initial_colprof_payload, ti3, output_path, profile_model, patch_set, icc_version,
+            saved_fits=saved_fit_map)
     mhc2_validation = None
     with open(output_path, "rb") as handle:
         profile = handle.read()
+    fits.append(("colprof", fit_key, profile))
     if (profile_type == "windows-hdr" and calibration_mode != "none"
             and PROFILE_MODELS[profile_model]["family"] == "clut"):
         # The first-pass MHC2 curves use only a primary-axis decomposition and
@@ -5252,9 +6100,10 @@ def build(payload, output_dir):
         # mixed-color characterization row. This prevents non-additive HDR
         # plateaus from producing a one-channel jump at peak white.
         has_active_mhc2_measurements = mhc2_profile_rows is not profile_rows
-        raw_adjustment_luts = windows_hdr_profile_adjustment_luts(
-            profile, profile_rows, calibration, black, white, matrix,
-            raw_measurement_model=not has_active_mhc2_measurements)
+        with stages.stage("mhc2_luts"):
+            raw_adjustment_luts = windows_hdr_profile_adjustment_luts(
+                profile, profile_rows, calibration, black, white, matrix,
+                raw_measurement_model=not has_active_mhc2_measurements)
         raw_mhc2, raw_matrix, raw_adjustment_luts, raw_calibrated_white = mhc2_payload(
             mhc2_type, black, white, primaries, profile_rows,
             target_transfer or "srgb", apply_calibration=True,
@@ -5307,8 +6156,9 @@ def build(payload, output_dir):
     profile = rebuild_icc(profile, {b"vcgt": vcgt_tag(calibration) if include_vcgt else None})
     if (profile_type == "kde-hdr" and PROFILE_MODELS[profile_model]["family"] == "clut"
             and calibration_mode == "vcgt"):
-        profile = reshape_hdr_b2a_for_pq(
-            profile, white["xyz"][1], grid_size=b2a_grid)
+        with stages.stage("reshape"):
+            profile = python_stage(
+                "reshape", profile=profile, white_y=white["xyz"][1], grid_size=b2a_grid)
     if not keeps_mhc2:
         profile = rebuild_icc(profile, {b"MHC2": None})
     profile = rebuild_icc(profile, {b"cicp": cicp_tag(cicp) if icc_version == "4.4" else None})
@@ -5330,25 +6180,10 @@ def build(payload, output_dir):
         # this raw-domain repair, below. This removes the inverse-extrapolation
         # region that read collapsed-to-white without touching the fitted color
         # transform.
-        repair_tool = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "icc_b2a_repair.py")
-        repair_dir = tempfile.mkdtemp(prefix="pgen_b2a_repair_")
-        try:
-            repaired_path = os.path.join(repair_dir, "repaired.icc")
-            repair_env = dict(os.environ)
-            repair_env["PGEN_BALANCE"] = "0"
-            repair_env.pop("PGEN_CAL_JSON", None)
-            completed = subprocess.run(
-                [sys.executable, repair_tool, output_path, repaired_path],
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, timeout=600, env=repair_env)
-            if completed.returncode != 0 or not os.path.isfile(repaired_path):
-                detail = (completed.stdout or "").strip().splitlines()
-                fail("BToA corridor repair failed"
-                     + (": " + detail[-1][:200] if detail else ""))
-            shutil.move(repaired_path, output_path)
-        finally:
-            shutil.rmtree(repair_dir, ignore_errors=True)
+        with stages.stage("b2a_repair"):
+            repaired = repair_b2a_corridor(profile)
+        with open(output_path, "wb") as handle:
+            handle.write(repaired)
     if (profile_type == "kde-hdr" and calibration_mode == "vcgt"
             and PROFILE_MODELS[profile_model]["family"] == "clut"
             and applied_calibration is not None
@@ -5359,25 +6194,10 @@ def build(payload, output_dir):
         # (Bluish Green, 11.8 dE2000) while leaving the measured rolloff no
         # better than the plain fit. The corridor stays available for
         # devices whose calibrated fit still shows inverse artifacts.
-        repair_tool = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "icc_b2a_repair.py")
-        repair_dir = tempfile.mkdtemp(prefix="pgen_b2a_repair_")
-        try:
-            repaired_path = os.path.join(repair_dir, "repaired.icc")
-            repair_env = dict(os.environ)
-            repair_env["PGEN_BALANCE"] = "0"
-            repair_env.pop("PGEN_CAL_JSON", None)
-            completed = subprocess.run(
-                [sys.executable, repair_tool, output_path, repaired_path],
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, timeout=600, env=repair_env)
-            if completed.returncode != 0 or not os.path.isfile(repaired_path):
-                detail = (completed.stdout or "").strip().splitlines()
-                fail("BToA corridor repair failed"
-                     + (": " + detail[-1][:200] if detail else ""))
-            shutil.move(repaired_path, output_path)
-        finally:
-            shutil.rmtree(repair_dir, ignore_errors=True)
+        with stages.stage("b2a_repair"):
+            repaired = repair_b2a_corridor(profile)
+        with open(output_path, "wb") as handle:
+            handle.write(repaired)
     if (calibration_mode == "profile"
             and profile_type in ("kde-hdr", "windows-hdr")
             and PROFILE_MODELS[profile_model]["family"] == "clut"):
@@ -5402,8 +6222,10 @@ def build(payload, output_dir):
                 # dense raw-neutral ramp for the derivations to work from.
                 modeled_calibration = applied_calibration
             else:
-                modeled_calibration = hdr_profile_calibration_from_a2b(
-                    raw_profile, profile_rows, calibration)
+                with stages.stage("hdr_calibration"):
+                    modeled_calibration = python_stage(
+                        "hdr_calibration", profile=raw_profile, rows=profile_rows,
+                        fallback=calibration)
             # Live MHC2 and vcgt stages hold their tail at the measured
             # plateau. Composed builds do not apply these curves, they resample
             # them into the BToA shapers, the composed A2B and the neutral
@@ -5517,10 +6339,13 @@ def build(payload, output_dir):
             virtual_dir = tempfile.mkdtemp(prefix="pgen_hdr_virtual_")
             try:
                 virtual_path = os.path.join(virtual_dir, filename)
-                run_colprof(payload, virtual_ti3, virtual_path, profile_model,
-                            patch_set, icc_version)
+                with stages.stage("colprof_virtual"):
+                    fit_key, colprof_cache["colprof_virtual"] = run_colprof(
+                        payload, virtual_ti3, virtual_path, profile_model,
+                        patch_set, icc_version, saved_fits=saved_fit_map)
                 with open(virtual_path, "rb") as handle:
                     virtual_profile = handle.read()
+                fits.append(("colprof_virtual", fit_key, virtual_profile))
 
                 # applycal owns the forward-transform composition. Preserve
                 # its calibrated A2B, but use the pre-applycal virtual B2A for
@@ -5534,7 +6359,8 @@ def build(payload, output_dir):
                 # Headroom belongs only in the final B2A output shapers below;
                 # putting it into A2B as well moves KWin's derived shadow
                 # colorimetry even when the active B2A table is unchanged.
-                apply_profile_calibration(output_path, fit_calibration)
+                with stages.stage("applycal"):
+                    apply_profile_calibration(output_path, fit_calibration)
                 with open(output_path, "rb") as handle:
                     calibrated_profile = handle.read()
                 if experiment.get("skip_reshape"):
@@ -5560,10 +6386,11 @@ def build(payload, output_dir):
                     # ran, even though the MHC2 and B2A curves were identical.
                     b2a_white = (luminance if keeps_mhc2 and luminance
                                  else white["xyz"][1])
-                    reshaped_profile = reshape_hdr_b2a_for_pq(
-                        virtual_profile, b2a_white,
-                        incorporated_calibration=incorporated,
-                        grid_size=b2a_grid)
+                    with stages.stage("reshape"):
+                        reshaped_profile = python_stage(
+                            "reshape", profile=virtual_profile, white_y=b2a_white,
+                            incorporated_calibration=incorporated,
+                            grid_size=b2a_grid)
                     reshaped_tags = dict(read_icc_tags(reshaped_profile))
                     shaped_signatures = ((b"B2A0", b"B2A1", b"B2A2")
                                          if keeps_mhc2
@@ -5581,8 +6408,15 @@ def build(payload, output_dir):
                         # forward-model refinement worsened ColorChecker dE2000
                         # from 1.58 to 2.72 average and added a -3 dx mid-band
                         # grey cast. Kept as an opt-in for comparisons.
-                        profile = refine_hdr_b2a_from_forward_model(
-                            profile, raw_profile, white["xyz"][1])
+                        # refine_continuation seeds each node from its solved
+                        # neighbour instead of the original B2A.
+                        with stages.stage("refine"):
+                            refined = python_stage(
+                                "refine", profile=profile, forward_profile=raw_profile,
+                                white_y=white["xyz"][1],
+                                continuation=bool(experiment.get("refine_continuation")))
+                        profile = refined["profile"]
+                        refine_statistics.update(refined["statistics"])
                 profile = rebuild_icc(profile, {
                     b"MHC2": mhc2 if keeps_mhc2 else None,
                     b"vcgt": None,
@@ -5603,32 +6437,15 @@ def build(payload, output_dir):
                 # profiling patch sets carry knee-band samples dense enough
                 # for a reliable one-shot solve.
                 raw_ti3_text, _, _ = make_ti3(payload, profile_rows)
-                repair_tool = os.path.join(
-                    os.path.dirname(os.path.abspath(__file__)), "icc_b2a_repair.py")
-                repair_dir = tempfile.mkdtemp(prefix="pgen_b2a_repair_")
-                try:
-                    raw_ti3_path = os.path.join(repair_dir, "raw.ti3")
-                    with io.open(raw_ti3_path, "w", encoding="ascii", errors="replace") as handle:
-                        handle.write(raw_ti3_text)
-                    repaired_path = os.path.join(repair_dir, "repaired.icc")
-                    cal_json_path = os.path.join(repair_dir, "calibration.json")
-                    with io.open(cal_json_path, "w", encoding="ascii") as handle:
-                        handle.write(json.dumps(fit_calibration))
-                    repair_env = dict(os.environ)
-                    repair_env["PGEN_BALANCE"] = "1" if experiment.get("balanced_peak") else "0"
-                    repair_env["PGEN_CAL_JSON"] = cal_json_path
-                    completed = subprocess.run(
-                        [sys.executable, repair_tool, output_path, repaired_path, raw_ti3_path],
-                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                        universal_newlines=True, timeout=600, env=repair_env)
-                    if completed.returncode != 0 or not os.path.isfile(repaired_path):
-                        fail("BToA corridor repair failed: "
-                             + (completed.stdout or "").strip().splitlines()[-1][:200])
-                    shutil.move(repaired_path, output_path)
-                finally:
-                    shutil.rmtree(repair_dir, ignore_errors=True)
+                with stages.stage("b2a_repair"):
+                    repaired = repair_b2a_corridor(
+                        profile, raw_ti3_text, bool(experiment.get("balanced_peak")),
+                        fit_calibration)
+                with open(output_path, "wb") as handle:
+                    handle.write(repaired)
     elif calibration_mode == "profile" and not keeps_mhc2:
-        apply_profile_calibration(output_path, calibration)
+        with stages.stage("applycal"):
+            apply_profile_calibration(output_path, calibration)
 
     if (mhc2_profile_rows is not profile_rows
             and profile_type == "windows-hdr"
@@ -5640,10 +6457,11 @@ def build(payload, output_dir):
         # luminance metadata only; the raw-measurement cLUT remains untouched.
         with open(output_path, "rb") as handle:
             profile = handle.read()
-        mhc2, matrix, adjustment_luts, calibrated_white = (
-            windows_hdr_mhc2_from_active_profile(
-                profile, mhc2_profile_rows, mhc2_black, mhc2_white,
-                mhc2_primaries, target_transfer))
+        with stages.stage("mhc2_refit"):
+            mhc2, matrix, adjustment_luts, calibrated_white = (
+                windows_hdr_mhc2_from_active_profile(
+                    profile, mhc2_profile_rows, mhc2_black, mhc2_white,
+                    mhc2_primaries, target_transfer))
         if metadata_white_rows:
             active_peak = max(
                 mhc2_white["xyz"][1], mhc2_black["xyz"][1] + 0.0001)
@@ -5711,9 +6529,10 @@ def build(payload, output_dir):
                 b2a_corrected_luts, mhc2_profile_rows,
                 final_neutral_gains, calibrated_white,
                 "ICC cLUT Curve Feedback"):
-            profile = windows_hdr_b2a_with_shadow_luts(
-                profile, b2a_reference_luts, b2a_corrected_luts,
-                final_neutral_gains, source_limit=0.45)
+            with stages.stage("shadow_luts"):
+                profile = windows_hdr_b2a_with_shadow_luts(
+                    profile, b2a_reference_luts, b2a_corrected_luts,
+                    final_neutral_gains, source_limit=0.45)
 
         # Windows system handling gets its own measured response solve. Keep
         # the independently fitted active-path curves as its baseline. Cloning
@@ -5827,7 +6646,8 @@ def build(payload, output_dir):
         final_ti3, _, _ = make_ti3(payload, profile_rows)
         validation_rows = profile_rows
     write_text_atomic(ti3_path, final_ti3)
-    validation = run_profcheck(ti3_path, output_path, validation_rows, profile_model, patch_set)
+    with stages.stage("profcheck"):
+        validation = run_profcheck(ti3_path, output_path, validation_rows, profile_model, patch_set)
     validation["profile_quality"] = profile_quality or ("high" if patch_set == "large" or len(profile_rows) > 800 else "medium")
     validation["b2a_grid"] = b2a_grid
     # Fine-tune has to evaluate this profile against the curve it was built
@@ -5838,6 +6658,10 @@ def build(payload, output_dir):
     if mhc2_validation:
         validation["mhc2"] = mhc2_validation
         validation["note"] = "ArgyllCMS checks the saved characterization fit. The MHC2 self-check also verifies the correction tag structure, matrix direction, adjustment curves and luminance metadata."
+    if refine_statistics:
+        validation["refine"] = refine_statistics
+    # Per-stage cost, so slow builds can be compared across releases.
+    validation["timing"] = stages.report()
     write_json_atomic(output_path + ".validation.json", validation)
     # Keep the merged characterization readings with the finished profile.
     # The WebUI can then offer them for a later, larger patch set even after a
@@ -5857,6 +6681,18 @@ def build(payload, output_dir):
                 "Y": row["xyz"][1],
                 "Z": row["xyz"][2],
             })
+        kept_fits = []
+        for stage_name, key, fitted in fits + saved_fits:
+            if (not key or len(kept_fits) >= COLPROF_SAVED_FITS
+                    or any(entry["key"] == key for entry in kept_fits)):
+                continue
+            fit_name = filename + ".fit-" + key[:16]
+            with open(os.path.join(output_dir, fit_name + ".tmp"), "wb") as handle:
+                handle.write(fitted)
+            os.rename(os.path.join(output_dir, fit_name + ".tmp"),
+                      os.path.join(output_dir, fit_name))
+            kept_fits.append({"stage": stage_name, "key": key, "file": fit_name})
+        prune_saved_fits(output_dir, filename, kept_fits)
         write_json_atomic(measurement_path, {
             "created": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
             "profile": filename,
@@ -5889,6 +6725,7 @@ def build(payload, output_dir):
                 "b2a_grid": b2a_grid,
             },
             "status": "ok",
+            "fits": kept_fits,
             "readings": reusable_rows,
             "mhc2_readings": ([{
                 "name": row["name"],
@@ -5937,6 +6774,7 @@ def build(payload, output_dir):
         "mhc2_feedback_contract": (
             MHC2_PROFILE_RESPONSE_CONTRACT
             if mhc2_feedback_profiles is not None else None),
+        "colprof_cache": colprof_cache,
         "validation": validation,
     }
 
@@ -5953,15 +6791,19 @@ def main():
         output_dir = sys.argv[3] if special_mode else sys.argv[2]
         with io.open(input_path, "r", encoding="utf-8") as handle:
             payload = json.load(handle)
+        begin_progress("patches" if patch_mode else "precondition-patches"
+                       if precondition_mode else "build")
         if patch_mode:
             result = generate_patches(payload, output_dir)
         elif precondition_mode:
             result = generate_preconditioned_patches(payload, output_dir)
         else:
             result = build(payload, output_dir)
+        finish_progress("ok")
         print(json.dumps(result, separators=(",", ":")))
         return 0
     except (ValueError, OSError, IOError, subprocess.CalledProcessError) as error:
+        finish_progress("error", str(error))
         print(json.dumps({"status": "error", "message": str(error)}, separators=(",", ":")))
         return 1
 
@@ -0,0 +1,196 @@
+"""Publish the progress of a running ICC build as NDJSON for the WebUI.
+
+A profile build used to be silent until it exited: colprof, targen and
+profcheck were read with communicate(), and the WebUI waited on one request
+for up to four hours with nothing to show but a clock. The builder now opens
+a small status file when it starts, reads each child line by line as it runs
+and appends one JSON object per line whenever the stage, the percentage or
+the message changes. The WebUI polls the last line.
+
+An event carries the build id, the operation ("build", "patches" or
+"precondition-patches"), the time, the stage, the percentage and a
+remaining-time estimate when the tool prints one, where the work runs
+("local" or "companion"), and the latest message. Changes within one stage
+are published at most once per PUBLISH_SECONDS, so a four-hour fit stays a
+few hundred lines; the file is truncated by the next build.
+
+The file lives on tmpfs so progress never wears the SD card.
+PGEN_ICC_PROGRESS names another file, or disables publishing when set to 0.
+Nothing is published before begin(), so a stage run in another process, such
+as a Patch Companion running an offloaded stage, writes nothing.
+"""
+
+import codecs
+import json
+import locale
+import os
+import re
+import subprocess
+import time
+
+
+PROGRESS_PATH = "/tmp/pgen_icc_build.progress.ndjson"
+PUBLISH_SECONDS = 1.0
+# Argyll reports loop progress as "NN%", rewriting the same line with \r.
+PERCENT = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+_state = None
+
+
+def progress_path():
+    path = os.environ.get("PGEN_ICC_PROGRESS", PROGRESS_PATH)
+    return "" if path in ("", "0") else path
+
+
+def _write(event):
+    path = _state["path"]
+    line = (json.dumps(event, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+    try:
+        # One write per event, appended, so a reader sees whole lines.
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass  # Progress is advisory; never fail a build over it.
+
+
+def begin(operation):
+    """Start publishing for this process's build, truncating the file."""
+    global _state
+    path = progress_path()
+    if not path:
+        _state = None
+        return
+    try:
+        with open(path, "w"):
+            pass
+    except (OSError, IOError):
+        _state = None
+        return
+    started = time.time()
+    _state = {
+        "path": path,
+        "build": "%d-%d" % (int(started * 1000), os.getpid()),
+        "operation": operation,
+        "stage": None,
+        "pass_started": started,
+        "percent": None,
+        "published": 0.0,
+        "last": None,
+    }
+    report("start")
+
+
+def report(stage, percent=None, source="local", message=None, force=False):
+    """Publish the state of stage, the current one if None; a no-op unless
+    begin() was called."""
+    if _state is None:
+        return
+    if stage is None:
+        stage = _state["stage"]
+    now = time.time()
+    if stage != _state["stage"]:
+        _state["stage"] = stage
+        _state["pass_started"] = now
+        _state["percent"] = None
+        force = True
+    event = {
+        "build": _state["build"],
+        "operation": _state["operation"],
+        "stage": stage,
+        "source": source,
+    }
+    if percent is not None:
+        percent = max(0.0, min(100.0, float(percent)))
+        # Argyll restarts its percentage for every table it builds, so the
+        # estimate covers the pass under way, not the whole stage.
+        if _state["percent"] is not None and percent < _state["percent"]:
+            _state["pass_started"] = now
+        _state["percent"] = percent
+        event["percent"] = round(percent, 1)
+        elapsed = now - _state["pass_started"]
+        if 1.0 <= percent < 100.0 and elapsed >= 2.0:
+            event["eta_seconds"] = int(elapsed * (100.0 - percent) / percent)
+    if message:
+        event["message"] = message[:160]
+    if event == _state["last"] or (not force and now - _state["published"] < PUBLISH_SECONDS):
+        return
+    _state["last"] = dict(event)
+    _state["published"] = now
+    event["time"] = round(now, 3)
+    _write(event)
+
+
+def finish(status, message=None):
+    """Publish the end of the build: "ok" or "error"."""
+    if _state is None:
+        return
+    event = {
+        "build": _state["build"],
+        "operation": _state["operation"],
+        "stage": "finished",
+        "status": status,
+        "time": round(time.time(), 3),
+    }
+    if message:
+        event["message"] = message[:160]
+    _write(event)
+
+
+def default_percent(line):
+    matches = PERCENT.findall(line)
+    return float(matches[-1]) if matches else None
+
+
+def stream(command, stage, parse=default_percent, env=None):
+    """Run command, publishing its progress as it prints, and return
+    (returncode, output).
+
+    stdout and stderr are read together, as communicate() returned them with
+    universal newlines: output has every \\r and \\r\\n turned into \\n. parse
+    maps one output line to a percentage, or None for a line without one.
+    stage None keeps the stage already published.
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, env=env)
+    encoding = locale.getpreferredencoding(False)
+    # A character split across two reads is decoded once both halves arrive.
+    decoder = codecs.getincrementaldecoder(encoding)("replace")
+    chunks = []
+    pending = ""
+    percent = None
+    message = None
+    report(stage)
+    try:
+        fd = process.stdout.fileno()
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if _state is None:
+                continue
+            pending += decoder.decode(chunk)
+            lines = LINE_BREAK.split(pending)
+            # The last piece is a line still being printed. Argyll writes
+            # "\r NN%" and only ends it with the next one, so its percentage
+            # counts now; it becomes a message once complete.
+            pending = lines.pop()
+            for index, line in enumerate(lines + [pending]):
+                line = line.strip()
+                if not line:
+                    continue
+                value = parse(line)
+                if value is not None:
+                    percent = value
+                elif index < len(lines) and not PERCENT.search(line):
+                    message = line
+            report(stage, percent, message=message)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    output = b"".join(chunks).decode(encoding, "replace")
+    return returncode, LINE_BREAK.sub("\n", output)
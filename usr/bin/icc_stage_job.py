@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Run one of the builder's Python stages as a Patch Companion job.
+
+colprof is not the only slow step of an HDR cLUT build. The neutral
+calibration derivation, the PQ reshape of B2A and the forward-model
+refinement are pure Python and can take minutes on a Pi 4, so the builder can
+hand them to a connected Companion too. A job names the stage and carries its
+arguments, profiles included, in one JSON document. The Companion runs this
+file against its own copy of the stage modules and returns the stage's output
+in a second document.
+
+Two checks keep an offloaded stage equivalent to the local one. The job
+carries the stage revision, a digest of every module the stages execute, and
+run_job() refuses a job whose revision differs from its own, the way colprof
+offload refuses a different ArgyllCMS. The result echoes the digest of the
+job it answers and carries a digest of its own output, and the builder
+rejects any answer whose digests do not match what it sent. Whatever cannot
+be offloaded or fails runs locally.
+
+    icc_stage_job.py --revision          print the stage revision
+    icc_stage_job.py JOB.json RESULT.json run a job
+"""
+
+import base64
+import hashlib
+import json
+import os
+import sys
+
+
+# Job and result document layout; bump on any incompatible change.
+STAGE_FORMAT = 1
+# Every module a stage executes. The builder imports the rest at start-up, so
+# a Companion missing one of them cannot run a stage at all.
+STAGE_MODULES = ("icc_profile_builder.py", "icc_b2a_repair.py", "icc_curves.py",
+                 "icc_dirwatch.py", "icc_mft2.py", "icc_parallel.py", "icc_progress.py",
+                 "icc_stage_job.py")
+
+# Stages a job may name; icc_profile_builder.local_python_stage() runs them.
+STAGES = ("hdr_calibration", "reshape", "refine")
+
+_revision = None
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def stage_revision():
+    """SHA-256 of the stage modules beside this file, or "" if one is missing."""
+    global _revision
+    if _revision is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        try:
+            for name in STAGE_MODULES:
+                with open(os.path.join(directory, name), "rb") as handle:
+                    source = handle.read()
+                digest.update(name.encode("ascii") + b"\0")
+                digest.update(hashlib.sha256(source).digest())
+        except (OSError, IOError):
+            _revision = ""
+        else:
+            _revision = digest.hexdigest()
+    return _revision
+
+
+def _encode(value):
+    # JSON has no bytes or tuples. Both are tagged so the stage sees exactly
+    # the types the local call would; floats survive json's repr round trip.
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return dict((str(key), _encode(item)) for key, item in value.items())
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if set(value) == {"__bytes__"}:
+            return base64.b64decode(value["__bytes__"])
+        if set(value) == {"__tuple__"}:
+            return tuple(_decode(item) for item in value["__tuple__"])
+        return dict((key, _decode(item)) for key, item in value.items())
+    return value
+
+
+def _document(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode("ascii")
+
+
+def encode_job(stage, arguments):
+    """The job document for stage(**arguments) and its digest."""
+    if stage not in STAGES:
+        fail("Unknown Python stage: {}".format(stage))
+    data = _document({
+        "format": STAGE_FORMAT,
+        "revision": stage_revision(),
+        "stage": stage,
+        "arguments": _encode(arguments),
+    })
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def decode_result(data, job_sha256):
+    """The output of the job whose digest is job_sha256, from a result document."""
+    try:
+        result = json.loads(data.decode("ascii"))
+    except (UnicodeDecodeError, ValueError):
+        fail("Python stage result is not a result document")
+    if not isinstance(result, dict) or result.get("format") != STAGE_FORMAT:
+        fail("Python stage result has an unknown format")
+    if result.get("revision") != stage_revision():
+        fail("Python stage result came from a different stage revision")
+    if result.get("job_sha256") != job_sha256:
+        fail("Python stage result answers a different job")
+    output = _document(result.get("output"))
+    if hashlib.sha256(output).hexdigest() != result.get("output_sha256"):
+        fail("Python stage result does not match its digest")
+    return _decode(result["output"])
+
+
+def run_job(data):
+    """Run a job document and return its result document."""
+    job = json.loads(data.decode("ascii"))
+    if not isinstance(job, dict) or job.get("format") != STAGE_FORMAT:
+        fail("Python stage job has an unknown format")
+    revision = stage_revision()
+    if not revision or job.get("revision") != revision:
+        fail("Python stage job needs a different stage revision")
+    stage = job.get("stage")
+    if stage not in STAGES:
+        fail("Unknown Python stage: {}".format(stage))
+    arguments = _decode(job.get("arguments"))
+    if not isinstance(arguments, dict):
+        fail("Python stage arguments are invalid")
+    import icc_profile_builder
+    output = _encode(icc_profile_builder.local_python_stage(stage, arguments))
+    return _document({
+        "format": STAGE_FORMAT,
+        "revision": revision,
+        "job_sha256": hashlib.sha256(data).hexdigest(),
+        "output": output,
+        "output_sha256": hashlib.sha256(_document(output)).hexdigest(),
+    })
+
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1] == "--revision":
+        revision = stage_revision()
+        if not revision:
+            print("Stage modules are incomplete", file=sys.stderr)
+            return 1
+        print(revision)
+        return 0
+    if len(sys.argv) != 3:
+        print("Usage: icc_stage_job.py --revision", file=sys.stderr)
+        print("       icc_stage_job.py JOB.json RESULT.json", file=sys.stderr)
+        return 2
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(sys.argv[1], "rb") as handle:
+            result = run_job(handle.read())
+        temporary = sys.argv[2] + ".tmp"
+        with open(temporary, "wb") as handle:
+            handle.write(result)
+        os.replace(temporary, sys.argv[2])
+        return 0
+    except (ValueError, OSError, KeyError, TypeError) as error:
+        print(str(error)[:240], file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
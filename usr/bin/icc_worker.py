@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Persistent ICC worker for the PGenerator+ WebUI.
+
+Usage: icc_worker.py [SOCKET]
+
+The WebUI used to start a new python3 for every profile build, patch list,
+fine-tune pass and .cube conversion, paying interpreter start, module import
+and profile parsing each time. This worker imports the ICC tools once and
+serves the same command lines over a Unix socket. Each request runs in a
+forked child with the tool's own main(), so output, exit status and timeout
+behaviour match the CLI exactly and a failing tool cannot take the worker
+down. Children inherit the imported modules and the parent's profile caches:
+before forking, the parent reads and decodes the profile a request names.
+
+One JSON request line per connection:
+    {"tool": "builder", "argv": ["--patches", "IN.json", "DIR"],
+     "timeout": 920, "merge_stderr": false}
+The worker answers {"accepted": true} once the request is running, then
+{"exit": N, "output": "..."} where output is what the CLI would print to
+stdout (and stderr with merge_stderr). A request that outlives its timeout
+is killed with its process group and answered with exit 124, as timeout(1)
+does. The worker exits after IDLE_SECONDS without work; PGICCProfile.pm
+starts it again on demand and uses the CLI in the meantime.
+"""
+
+import fcntl
+import io
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+
+import icc_companion_lut
+import icc_finetune
+import icc_mft2
+import icc_profile_builder
+
+
+SOCKET_PATH = "/var/lib/PGenerator/icc-worker.sock"
+IDLE_SECONDS = 1800
+REQUEST_BYTES = 64 * 1024
+TIMEOUT_EXIT = 124
+TOOLS = {
+    "builder": icc_profile_builder,
+    "finetune": icc_finetune,
+    "companion_lut": icc_companion_lut,
+}
+
+
+def send(connection, reply):
+    try:
+        connection.sendall((json.dumps(reply, separators=(",", ":")) + "\n").encode("utf-8"))
+    except OSError:
+        pass  # The WebUI gave up on this request.
+
+
+def read_request(connection):
+    connection.settimeout(5.0)
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > REQUEST_BYTES:
+            raise ValueError("ICC worker request is too large")
+    connection.settimeout(None)
+    request = json.loads(data.decode("utf-8"))
+    if not isinstance(request, dict) or request.get("tool") not in TOOLS:
+        raise ValueError("Unsupported ICC worker tool")
+    argv = request.get("argv")
+    if not isinstance(argv, list) or not all(isinstance(item, str) for item in argv):
+        raise ValueError("ICC worker arguments must be strings")
+    timeout = request.get("timeout")
+    if not isinstance(timeout, int) or timeout <= 0:
+        raise ValueError("ICC worker timeout is invalid")
+    return request["tool"], argv, timeout, bool(request.get("merge_stderr"))
+
+
+def warm(tool, argv):
+    """Load what a request reads so the forked child inherits it."""
+    try:
+        if tool == "builder":
+            # Tool probes and the stage revision are the same for every build;
+            # a re-derive also reads the saved fits of its source profile.
+            builder = icc_profile_builder
+            colprof = os.environ.get("PGEN_COLPROF", "/usr/bin/colprof")
+            builder.argyll_tool_version(colprof)
+            builder.colprof_supports_icc44(colprof)
+            builder.stage_revision()
+            if argv[:1] in (["--patches"], ["--precondition-patches"]):
+                builder.argyll_tool_version(os.environ.get("PGEN_TARGEN", "/usr/bin/targen"))
+            elif len(argv) == 2:
+                with io.open(argv[0], "r", encoding="utf-8") as handle:
+                    payload = json.load(handle)
+                if isinstance(payload, dict) and payload.get("rederive_from"):
+                    builder.load_saved_fits(payload, argv[1])
+        elif tool == "companion_lut" and len(argv) >= 3:
+            transform = icc_companion_lut.make_transform(argv[0], argv[1], argv[2])[0]
+            # One point forces the lazily normalized tables into the cache.
+            transform.apply_many((0.0, 0.0, 0.0))
+        elif tool == "finetune" and len(argv) == 2:
+            with io.open(argv[0], "r", encoding="utf-8") as handle:
+                parent_path = json.load(handle).get("parent_path")
+            if isinstance(parent_path, str):
+                icc_mft2.read_profile(parent_path)
+    except Exception:  # The child reports any real problem exactly as the CLI does.
+        pass
+
+
+def run_child(listener, connection, tool, argv, merge_stderr):
+    listener.close()
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    output = tempfile.TemporaryFile()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(output.fileno(), 1)
+    os.dup2(output.fileno() if merge_stderr else devnull, 2)
+    module = TOOLS[tool]
+    sys.argv = [module.__file__] + argv
+    try:
+        status = module.main()
+    except SystemExit as error:
+        status = error.code
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    if status is None:
+        status = 0
+    elif not isinstance(status, int):
+        print(status, file=sys.stderr)
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    output.seek(0)
+    send(connection, {"exit": status,
+                      "output": output.read().decode("utf-8", "replace")})
+
+
+def reap(children):
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        entry = children.pop(pid, None)
+        if entry is not None:
+            entry[0].close()
+
+
+def serve(listener, lock):
+    children = {}
+    last_activity = time.time()
+    while True:
+        reap(children)
+        now = time.time()
+        for pid, (connection, deadline) in list(children.items()):
+            if now >= deadline:
+                try:
+                    os.killpg(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                send(connection, {"exit": TIMEOUT_EXIT, "output": ""})
+                connection.close()
+                del children[pid]
+        if children:
+            last_activity = now
+        elif now - last_activity > IDLE_SECONDS:
+            return
+        if not select.select([listener], [], [], 1.0)[0]:
+            continue
+        connection = listener.accept()[0]
+        last_activity = time.time()
+        try:
+            tool, argv, timeout, merge_stderr = read_request(connection)
+        except (OSError, ValueError) as error:
+            send(connection, {"accepted": False, "message": str(error)})
+            connection.close()
+            continue
+        warm(tool, argv)
+        send(connection, {"accepted": True})
+        try:
+            pid = os.fork()
+        except OSError:
+            send(connection, {"exit": 1, "output": ""})
+            connection.close()
+            continue
+        if pid == 0:
+            try:
+                # The singleton lock belongs to this process alone; a child
+                # holding it would keep a new worker from starting.
+                lock.close()
+                for other, _ in children.values():
+                    other.close()
+                run_child(listener, connection, tool, argv, merge_stderr)
+            finally:
+                os._exit(0)
+        children[pid] = (connection, time.time() + timeout)
+
+
+def main():
+    if len(sys.argv) > 2:
+        print("Usage: icc_worker.py [SOCKET]", file=sys.stderr)
+        return 2
+    path = sys.argv[1] if len(sys.argv) == 2 else SOCKET_PATH
+    # The lock outlives the socket file, so two WebUI requests that both
+    # found the worker down cannot unlink each other's socket.
+    lock = open(path + ".lock", "w")  # Not inherited across exec (PEP 446).
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return 0
+    os.chdir("/")
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    previous = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(previous)
+    listener.listen(8)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve(listener, lock)
+    finally:
+        listener.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
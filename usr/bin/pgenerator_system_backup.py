@@ -86,8 +86,9 @@ def iter_source_entries(kind, source):
         return
     for root, dirs, files in os.walk(source):
         # Diagnostic-video frame caches are regenerated from the original
-        # uploaded video and can be many times larger than the source file.
-        dirs[:] = sorted([name for name in dirs if name != ".diagseq" and not os.path.islink(os.path.join(root, name))])
+        # uploaded video and can be many times larger than the source file;
+        # LUTs converted from ICC profiles are rebuilt from the profiles.
+        dirs[:] = sorted([name for name in dirs if name not in (".diagseq", ".derived-luts") and not os.path.islink(os.path.join(root, name))])
         for name in sorted(files):
             path = os.path.join(root, name)
             if os.path.isfile(path) and not os.path.islink(path):
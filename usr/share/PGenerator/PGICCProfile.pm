@@ -17,6 +17,49 @@ sub webui_icc_sync_clock_from_build (@) {
  return 1;
 }
 
+# Ask the persistent ICC worker to run one tool. Returns the tool output and a
+# wait()-style status like backticks, or an empty list when the worker is not
+# running or refused the request, in which case nothing was started.
+sub webui_icc_worker_call (@) {
+ my ($tool,$timeout,$merge_stderr,@args)=@_;
+ return () unless(-f $_icc_worker);
+ require IO::Socket::UNIX;
+ require JSON::PP;
+ my $sock=IO::Socket::UNIX->new(Peer=>$_icc_worker_socket);
+ if(!$sock) {
+  # Start the worker for the next request; this one uses the CLI. The
+  # worker holds a lock, so concurrent starts leave a single instance.
+  system("setsid /usr/bin/python3 $_icc_worker '$_icc_worker_socket' </dev/null >/dev/null 2>&1 &");
+  return ();
+ }
+ my $request=JSON::PP->new->canonical(1)->encode({tool=>$tool,argv=>[map { "$_" } @args],timeout=>int($timeout),merge_stderr=>($merge_stderr?JSON::PP::true():JSON::PP::false())});
+ if(!print {$sock} "$request\n") { close($sock); return (); }
+ my $ack=<$sock>;
+ if(!defined($ack) || $ack!~/"accepted"\s*:\s*true/) { close($sock); return (); }
+ # From here the request is running; a lost reply is a failed run, not a
+ # reason to start the same work a second time through the CLI.
+ my $reply=<$sock>;
+ close($sock);
+ my $decoded;
+ eval { $decoded=JSON::PP::decode_json($reply); } if(defined($reply));
+ return ("",1<<8) if(ref($decoded) ne "HASH");
+ return (defined($decoded->{output})?$decoded->{output}:"",(int($decoded->{exit}||0)&255)<<8);
+}
+
+# Run an ICC tool through the worker, or directly when the worker is down.
+# Arguments are fixed or whitelist-constrained by the callers and never carry
+# quotes.
+sub webui_icc_tool_run (@) {
+ my ($tool,$timeout,$merge_stderr,@args)=@_;
+ my @result=&webui_icc_worker_call($tool,$timeout,$merge_stderr,@args);
+ return @result if(@result);
+ my %scripts=(builder=>$_icc_profile_builder,finetune=>$_icc_finetune_tool,companion_lut=>$_icc_companion_lut_builder);
+ my $argv=join(" ",map { "'$_'" } @args);
+ my $redirect=$merge_stderr?"2>&1":"2>/dev/null";
+ my $output=`timeout $timeout /usr/bin/python3 $scripts{$tool} $argv $redirect`;
+ return ($output,$?);
+}
+
 sub webui_icc_profile_list (@) {
  my @out;
  my @profiles;
@@ -162,8 +205,7 @@ sub webui_icc_profile_to_cube (@) {
  my $out_path="$lut_dir/$out";
  # Names are whitelist-constrained above and cannot carry quotes; the profile
  # data itself never enters the shell.
- my $output=`timeout 900 /usr/bin/python3 $_icc_companion_lut_builder '$path' $method $mode '$out_path' $size 2>&1`;
- my $exit=$?;
+ my ($output,$exit)=&webui_icc_tool_run("companion_lut",900,1,$path,$method,$mode,$out_path,$size);
  if($exit!=0 || !-f $out_path) {
   unlink($out_path);
   $output="" if(!defined($output));
@@ -184,12 +226,23 @@ sub webui_icc_profile_to_cube (@) {
  return "{\"status\":\"ok\",\"file\":\"".&_webui_json_escape($out)."\",\"path\":\"".&_webui_json_escape($out_path)."\",\"size\":$bytes,\"nodes\":$nodes,\"lut_size\":$size,\"signal_mode\":\"$mode\",\"method\":\"$method\"}";
 }
 
+# Drop the cached LUTs converted from one profile. Entries are keyed by the
+# profile's content, so this only reclaims space once it is deleted or
+# rewritten under the same name.
+sub webui_icc_derived_lut_drop (@) {
+ my ($file)=@_;
+ return unless(opendir(my $dh,$_icc_derived_lut_dir));
+ foreach my $entry (readdir($dh)) {
+  unlink("$_icc_derived_lut_dir/$entry") if($entry=~/^\Q$file\E\.[0-9a-f]{16}\.(?:cube|pglt)$/);
+ }
+ closedir($dh);
+}
+
 sub webui_icc_profile_finetune (@) {
  my ($body)=@_;
  return '{"status":"error","message":"Fine-tune request is empty"}' if(!defined($body) || $body eq "");
  return '{"status":"error","message":"Fine-tune request is too large"}' if(length($body)>16*1024*1024);
- my $tool="/usr/bin/icc_finetune.py";
- return '{"status":"error","message":"The fine-tune tool is unavailable"}' unless(-f $tool);
+ return '{"status":"error","message":"The fine-tune tool is unavailable"}' unless(-f $_icc_finetune_tool);
  my $file="";
  $file=$1 if($body=~/"file"\s*:\s*"([A-Za-z0-9._()-]+\.icc)"/i);
  return '{"status":"error","message":"Invalid ICC profile name"}' if($file eq "" || $file=~/\.\./);
@@ -219,11 +272,12 @@ sub webui_icc_profile_finetune (@) {
  print {$fh} $payload;
  close($fh);
  chmod(0600,$input);
- my $result=`timeout 1800 /usr/bin/python3 $tool $input $_icc_profile_dir 2>/dev/null`;
- my $exit=$?;
+ my ($result,$exit)=&webui_icc_tool_run("finetune",1800,0,$input,$_icc_profile_dir);
  unlink($input);
  $result=~s/^\s+|\s+$//g;
  return '{"status":"error","message":"Profile fine-tuning failed"}' if($result!~/^\{/);
+ # An iterative session rewrites the same output name on every pass.
+ &webui_icc_derived_lut_drop("$out_name.icc") if($exit==0);
  return $result if($exit==0);
  return $result if($result=~/"status"\s*:\s*"error"/);
  return '{"status":"error","message":"Profile fine-tuning failed"}';
@@ -288,8 +342,7 @@ sub webui_icc_profile_build (@) {
  # Large Ultra cLUT fits can legitimately take more than two hours on a Pi4.
  # Keep this outer guard beyond the builder's four-hour runaway limit so the
  # API cannot terminate colprof or the following profile validation first.
- my $result=`timeout 15000 /usr/bin/python3 $_icc_profile_builder $input $_icc_profile_dir 2>/dev/null`;
- my $exit=$?;
+ my ($result,$exit)=&webui_icc_tool_run("builder",15000,0,$input,$_icc_profile_dir);
  unlink($input);
  $result=~s/^\s+|\s+$//g;
  if($result!~/^\{/) {
@@ -315,8 +368,7 @@ sub webui_icc_patch_generate (@) {
  my $closed=close($fh);
  if(!$wrote || !$closed) { unlink($input); return '{"status":"error","message":"Could not save the patch request"}'; }
  chmod(0600,$input);
- my $result=`timeout 920 /usr/bin/python3 $_icc_profile_builder --patches $input $_icc_profile_dir 2>/dev/null`;
- my $exit=$?;
+ my ($result,$exit)=&webui_icc_tool_run("builder",920,0,"--patches",$input,$_icc_profile_dir);
  unlink($input);
  $result=~s/^\s+|\s+$//g;
  return $result if($result=~/^\{/ && ($exit==0 || $result=~/"status"\s*:\s*"error"/));
@@ -338,14 +390,30 @@ sub webui_icc_precondition_patch_generate (@) {
  my $closed=close($fh);
  if(!$wrote || !$closed) { unlink($input); return '{"status":"error","message":"Could not save the preconditioning measurements"}'; }
  chmod(0600,$input);
- my $result=`timeout 920 /usr/bin/python3 $_icc_profile_builder --precondition-patches $input $_icc_profile_dir 2>/dev/null`;
- my $exit=$?;
+ my ($result,$exit)=&webui_icc_tool_run("builder",920,0,"--precondition-patches",$input,$_icc_profile_dir);
  unlink($input);
  $result=~s/^\s+|\s+$//g;
  return $result if($result=~/^\{/ && ($exit==0 || $result=~/"status"\s*:\s*"error"/));
  return '{"status":"error","message":"ICC preconditioned patch generation failed"}';
 }
 
+# The builder appends one JSON event per line to the progress file while a
+# build or patch generation runs. Answer with the newest complete event; only
+# the tail of the file is read.
+sub webui_icc_build_progress (@) {
+ my $tail="";
+ if(open(my $fh,"<",$_icc_build_progress_file)) {
+  my $size=-s $fh;
+  seek($fh,$size-4096,0) if($size>4096);
+  local $/;
+  $tail=<$fh>||"";
+  close($fh);
+ }
+ my @events=grep { /^\{.*\}$/ } split(/\n/,$tail);
+ return '{"status":"idle"}' unless(@events);
+ return '{"status":"ok","progress":'.$events[-1].'}';
+}
+
 sub webui_icc_profile_validation (@) {
  my ($query)=@_;
  my $file="";
@@ -402,6 +470,14 @@ sub webui_icc_profile_delete (@) {
   unlink($path.".measurements.json");
   (my $ti3=$path)=~s/\.icc$/.ti3/i;
   unlink($ti3);
+  # colprof fits kept for re-deriving: PROFILE.icc.fit-KEY.
+  if(opendir(my $dh,$_icc_profile_dir)) {
+   foreach my $entry (readdir($dh)) {
+    unlink("$_icc_profile_dir/$entry") if($entry=~/^\Q$file\E\.fit-[0-9a-f]{16}$/);
+   }
+   closedir($dh);
+  }
+  &webui_icc_derived_lut_drop($file);
   return '{"status":"ok"}';
  }
  return '{"status":"error","message":"Could not delete the ICC profile"}';
@@ -762,7 +838,16 @@ sub webui_icc_companion_poll (@) {
  my $build_argyll="";
  $build_argyll=$1 if($query=~/(?:^|&)build_argyll=([0-9]+(?:\.[0-9]+){1,3})(?:&|$)/);
  my $build_targen=($build_argyll ne "" && $query=~/(?:^|&)build_targen=1(?:&|$)/)?1:0;
- &webui_icc_companion_build_state($build_argyll,$build_targen);
+ # Companions that run offload jobs on worker threads report how many they
+ # take at once and how many are running; older ones run one synchronously.
+ my ($build_slots,$build_running)=(1,0);
+ $build_slots=$1 if($query=~/(?:^|&)build_jobs=([1-9][0-9]?)(?:&|$)/);
+ $build_running=$1 if($query=~/(?:^|&)build_running=([0-9]{1,2})(?:&|$)/);
+ # The revision of the builder stage modules the Companion can run, if any.
+ my $build_stages="";
+ $build_stages=$1 if($build_argyll ne "" && $query=~/(?:^|&)build_stages=([0-9a-f]{64})(?:&|$)/);
+ &webui_icc_companion_build_state($build_argyll,$build_targen,$build_slots,$build_stages);
+ &webui_icc_companion_build_running($1) if($query=~/(?:^|&)build_ids=([0-9,-]{1,160})(?:&|$)/);
  my $status="{\"client\":\"".&_webui_json_escape($client)."\",\"version\":\"".&_webui_json_escape($version)."\",\"build\":\"".&_webui_json_escape($build)."\",\"renderer\":\"".&_webui_json_escape($renderer)."\",\"platform\":\"".&_webui_json_escape($platform)."\",\"selected_display\":\"".&_webui_json_escape($selected_display)."\",\"swapchain_color_space\":\"".&_webui_json_escape($swapchain_cs)."\",\"presentation_mode\":\"".&_webui_json_escape($presentation)."\",\"output_max_luminance\":".($output_max+0).",\"output_full_frame_luminance\":".($output_full+0).",\"output_bits_per_color\":".($output_bits+0).",\"active_profile\":\"".&_webui_json_escape($active_profile)."\",\"transform_mode\":\"$transform\",\"transform_ready\":".($transform_ready?"true":"false").",\"transform_note\":\"".&_webui_json_escape($transform_note)."\",\"source_rgb\":[".join(",",@patch_values[0..2])."],\"submitted_rgb\":[".join(",",@patch_values[3..5])."],\"hdr_active\":".($hdr?"true":"false").",\"last_seen\":$seen}";
  &webui_icc_companion_write_atomic($_icc_companion_status_file,$status,0600);
  my $command="";
@@ -778,12 +863,27 @@ sub webui_icc_companion_poll (@) {
    return $command;
   }
  }
- # A pending colprof job outranks the idle response: the builder is blocked
- # waiting on it, and the patch path is idle while a fit runs.
- if($build_argyll ne "" && -f $_icc_companion_build_job) {
+ # A queued offload job outranks the idle response: a builder is blocked
+ # waiting on it. A single-slot Companion runs the oldest job synchronously and
+ # is offered that job until it answers. A Companion with several slots keeps
+ # polling while its jobs run, so it is offered the oldest job nobody has
+ # claimed yet, and only while it has a slot free.
+ if($build_argyll ne "") {
+  my @queue=&webui_icc_companion_build_queue();
+  if($build_slots>1) {
+   @queue=($build_running<$build_slots) ? (grep { !-f "$_icc_companion_build_jobs/$_/claim.json" } @queue) : ();
+  }
   my $job="";
-  if(open(my $jf,"<",$_icc_companion_build_job)) { local $/; $job=<$jf>||""; close($jf); }
+  if(@queue && open(my $jf,"<","$_icc_companion_build_jobs/$queue[0]/job.json")) { local $/; $job=<$jf>||""; close($jf); }
   if($job=~/^\s*\{/ && length($job)<64*1024*1024) {
+   # An older single-slot Companion names no job in its requests; they go to
+   # the job it was offered here, which need not stay the oldest queued.
+   if($build_slots==1) {
+    my $offered='{"job":"'.$queue[0].'"}';
+    my $previous="";
+    if(open(my $of,"<",$_icc_companion_build_offered)) { local $/; $previous=<$of>||""; close($of); }
+    &webui_icc_companion_write_atomic($_icc_companion_build_offered,$offered,0600) if($previous ne $offered);
+   }
    $job=~s/\}\s*\z//;
    return $job.',"status":"build",'.&webui_icc_companion_settings_fragment().'}';
   }
@@ -850,13 +950,62 @@ sub webui_icc_companion_shipped_version () {
 # every poll so a Companion that goes away stops being offered work within one
 # poll interval, rather than stalling a build until its timeout.
 sub webui_icc_companion_build_state (@) {
- my ($argyll,$targen)=@_;
- eval { require File::Path; File::Path::make_path($_icc_companion_build_dir,{mode=>0700}); } unless(-d $_icc_companion_build_dir);
+ my ($argyll,$targen,$slots,$stages)=@_;
+ eval { require File::Path; File::Path::make_path($_icc_companion_build_jobs,{mode=>0700}); } unless(-d $_icc_companion_build_jobs);
  my $connected=($argyll ne "") ? "true" : "false";
- my $json='{"connected":'.$connected.',"argyll_version":"'.&_webui_json_escape($argyll).'","targen":'.($targen?'true':'false').',"seen":'.time().'}';
+ my $json='{"connected":'.$connected.',"argyll_version":"'.&_webui_json_escape($argyll).'","targen":'.($targen?'true':'false').',"jobs":'.(($slots||1)+0).',"stages":"'.($stages||"").'","seen":'.time().'}';
  return &webui_icc_companion_write_atomic($_icc_companion_build_state,$json,0600);
 }
 
+# A Companion with build threads keeps polling while its fits run and lists the
+# jobs it is running. A builder that needs to tell a fit still running there
+# from one that stalled (the PGEN_ICC_OFFLOAD_RACE race, a Python stage) queues
+# the job with a progress file, and each claimed one has its mtime refreshed.
+# Only utime: reopening the file for writing would wake the builder's watch on
+# the job directory. At most once every two seconds per job.
+sub webui_icc_companion_build_running (@) {
+ my ($ids)=@_;
+ for my $job_id (split(/,/,$ids||"")) {
+  next unless($job_id=~/\A\d+-\d+\z/ && -f "$_icc_companion_build_jobs/$job_id/claim.json");
+  my $progress="$_icc_companion_build_jobs/$job_id/progress";
+  my $touched=(stat($progress))[9];
+  next if(!defined($touched) || time()-$touched<2);
+  utime(undef,undef,$progress);
+ }
+}
+
+# Offload jobs still waiting for an answer, oldest first. Storing a job's
+# result or error removes its job.json, which takes it out of this list.
+sub webui_icc_companion_build_queue () {
+ my $queue="";
+ if(open(my $fh,"<",$_icc_companion_build_queue)) { local $/; $queue=<$fh>||""; close($fh); }
+ my @jobs=();
+ while($queue=~/"job"\s*:\s*"(\d+-\d+)"/g) {
+  push(@jobs,$1) if(-f "$_icc_companion_build_jobs/$1/job.json");
+ }
+ return @jobs;
+}
+
+# Directory of the job a Companion request names with job=ID. An older
+# single-slot Companion sends no id: its requests belong to the job the poll
+# last offered it. Without that record only a lone queued job is unambiguous.
+sub webui_icc_companion_build_job_dir (@) {
+ my ($query)=@_;
+ my $job_id=&webui_icc_companion_query_value($query,"job");
+ if($job_id eq "") {
+  my $offered="";
+  if(open(my $of,"<",$_icc_companion_build_offered)) { local $/; $offered=<$of>||""; close($of); }
+  if($offered=~/"job"\s*:\s*"(\d+-\d+)"/) {
+   $job_id=$1;
+  } else {
+   my @queue=&webui_icc_companion_build_queue();
+   $job_id=(@queue==1) ? $queue[0] : "";
+  }
+ }
+ return "" unless(defined($job_id) && $job_id=~/\A\d+-\d+\z/);
+ return "$_icc_companion_build_jobs/$job_id";
+}
+
 # Serve the characterization for the pending build. Kept out of the poll
 # response because that buffer is 32 KB on the Companion and a 1000-patch .ti3
 # is around 76 KB.
@@ -865,46 +1014,49 @@ sub webui_icc_companion_build_ti3 (@) {
  my $token=&webui_icc_companion_query_value($query,"token");
  my $expected=&webui_icc_companion_token();
  return (0,'{"status":"unauthorized"}') if($expected eq "" || $token ne $expected);
- return (0,'{"status":"error","message":"No build is pending"}') unless(-f $_icc_companion_build_job && -f $_icc_companion_build_ti3);
+ my $dir=&webui_icc_companion_build_job_dir($query);
+ return (0,'{"status":"error","message":"No build is pending"}') unless($dir ne "" && -f "$dir/job.json" && -f "$dir/job.ti3");
  my $data="";
- if(open(my $fh,"<",$_icc_companion_build_ti3)) { local $/; $data=<$fh>||""; close($fh); }
+ if(open(my $fh,"<","$dir/job.ti3")) { local $/; $data=<$fh>||""; close($fh); }
  return (0,'{"status":"error","message":"Characterization is unavailable"}') if($data eq "");
  my $job="";
- if(open(my $jh,"<",$_icc_companion_build_job)) { local $/; $job=<$jh>||""; close($jh); }
+ if(open(my $jh,"<","$dir/job.json")) { local $/; $job=<$jh>||""; close($jh); }
  my $job_id="";
  $job_id=$1 if($job=~/"job"\s*:\s*"([0-9]+-[0-9]+)"/);
- return (0,'{"status":"error","message":"Build job is invalid"}') if($job_id eq "");
+ return (0,'{"status":"error","message":"Build job is invalid"}') if($job_id eq "" || $dir!~/\/\Q$job_id\E\z/);
  # Fetching the TI3 acknowledges that the Companion started this build. Its
  # poll loop is blocked while synchronous colprof runs, which can exceed the
  # ordinary liveness window without indicating a disconnect.
  my $claim='{"job":"'.$job_id.'","seen":'.time().'}';
  return (0,'{"status":"error","message":"Could not claim the build"}')
-  unless(&webui_icc_companion_write_atomic($_icc_companion_build_claim,$claim,0600));
+  unless(&webui_icc_companion_write_atomic("$dir/claim.json",$claim,0600));
  return (1,$data);
 }
 
-# Serve an optional binary input for a Companion targen job. The file is empty
-# for an ordinary chart and contains the temporary preconditioning ICC when
-# targen -c is requested. Fetching it also claims the synchronous job.
+# Serve the binary input of a Companion targen or Python stage job. For targen
+# the file is empty for an ordinary chart and contains the temporary
+# preconditioning ICC when targen -c is requested; a stage job's input is its
+# JSON job document. Fetching it also claims the job.
 sub webui_icc_companion_build_input (@) {
  my ($query)=@_;
  my $token=&webui_icc_companion_query_value($query,"token");
  my $expected=&webui_icc_companion_token();
  return (0,'{"status":"unauthorized"}') if($expected eq "" || $token ne $expected);
+ my $dir=&webui_icc_companion_build_job_dir($query);
  return (0,'{"status":"error","message":"No chart build is pending"}')
-  unless(-f $_icc_companion_build_job && -f $_icc_companion_build_input);
+  unless($dir ne "" && -f "$dir/job.json" && -f "$dir/job.input");
  my $job="";
- if(open(my $jh,"<",$_icc_companion_build_job)) { local $/; $job=<$jh>||""; close($jh); }
+ if(open(my $jh,"<","$dir/job.json")) { local $/; $job=<$jh>||""; close($jh); }
  my $job_id="";
  $job_id=$1 if($job=~/"job"\s*:\s*"([0-9]+-[0-9]+)"/);
  return (0,'{"status":"error","message":"Chart build job is invalid"}')
-  if($job_id eq "" || $job!~/"operation"\s*:\s*"targen"/);
+  if($job_id eq "" || $dir!~/\/\Q$job_id\E\z/ || $job!~/"operation"\s*:\s*"(?:targen|python-stage)"/);
  my $data="";
- if(open(my $fh,"<:raw",$_icc_companion_build_input)) { local $/; $data=<$fh>; close($fh); }
+ if(open(my $fh,"<:raw","$dir/job.input")) { local $/; $data=<$fh>; close($fh); }
  return (0,'{"status":"error","message":"Chart input is unavailable"}') unless(defined($data));
  my $claim='{"job":"'.$job_id.'","seen":'.time().'}';
  return (0,'{"status":"error","message":"Could not claim the chart build"}')
-  unless(&webui_icc_companion_write_atomic($_icc_companion_build_claim,$claim,0600));
+  unless(&webui_icc_companion_write_atomic("$dir/claim.json",$claim,0600));
  return (1,$data);
 }
 
@@ -914,10 +1066,11 @@ sub webui_icc_companion_build_result (@) {
  my $token=&webui_icc_companion_query_value($query,"token");
  my $expected=&webui_icc_companion_token();
  return '{"status":"unauthorized"}' if($expected eq "" || $token ne $expected);
- return '{"status":"error","message":"No build is pending"}' unless(-f $_icc_companion_build_job);
+ my $dir=&webui_icc_companion_build_job_dir($query);
+ return '{"status":"error","message":"No build is pending"}' unless($dir ne "" && -f "$dir/job.json");
  my $job="";
- if(open(my $jh,"<",$_icc_companion_build_job)) { local $/; $job=<$jh>||""; close($jh); }
- my $operation=($job=~/"operation"\s*:\s*"targen"/)?"targen":"colprof";
+ if(open(my $jh,"<","$dir/job.json")) { local $/; $job=<$jh>||""; close($jh); }
+ my $operation=($job=~/"operation"\s*:\s*"(targen|python-stage)"/)?$1:"colprof";
  # Parsed here rather than through webui_icc_companion_query_value: that parser
  # is deliberately strict because it also reads tokens and client names, and a
  # build failure message needs spaces and punctuation to be worth reporting.
@@ -929,15 +1082,12 @@ sub webui_icc_companion_build_result (@) {
  if($error ne "") {
   $error=~s/[^A-Za-z0-9 ._:\/()\[\]-]+/?/g;
   return '{"status":"error","message":"Could not store the build error"}'
-   unless(&webui_icc_companion_write_atomic($_icc_companion_build_error,substr($error,0,240),0600));
+   unless(&webui_icc_companion_write_atomic("$dir/error.txt",substr($error,0,240),0600));
   # The durable result/error file is the builder's completion signal. Remove
   # the advertised job before replying so the Companion's next poll cannot
   # claim and run the same synchronous colprof job a second time while the
   # builder is still waking up and consuming that signal.
-  unlink($_icc_companion_build_job);
-  unlink($_icc_companion_build_ti3);
-  unlink($_icc_companion_build_input);
-  unlink($_icc_companion_build_claim);
+  unlink("$dir/job.json","$dir/job.ti3","$dir/job.input","$dir/claim.json");
   return '{"status":"ok"}';
  }
  return '{"status":"error","message":"Empty build payload"}' unless(defined($body) && length($body)>32);
@@ -945,6 +1095,10 @@ sub webui_icc_companion_build_result (@) {
  if($operation eq "targen") {
   return '{"status":"error","message":"Payload is not an Argyll TI1 chart"}'
    unless($body=~/\ACTI1[ \t]*\r?\n/ && $body=~/\bBEGIN_DATA_FORMAT\b/ && $body=~/\bBEGIN_DATA\b/);
+ } elsif($operation eq "python-stage") {
+  # The builder checks the digests inside the document; only its shape here.
+  return '{"status":"error","message":"Payload is not a stage result"}'
+   unless($body=~/\A\{"format":/ && $body=~/\}\z/);
  } else {
   # An ICC declares its own byte count in the first four bytes and carries the
   # acsp signature; reject anything else rather than handing the builder a file
@@ -954,11 +1108,8 @@ sub webui_icc_companion_build_result (@) {
    if($declared!=length($body) || substr($body,36,4) ne "acsp");
  }
  return '{"status":"error","message":"Could not store the build result"}'
-  unless(&webui_icc_companion_write_atomic($_icc_companion_build_result,$body,0600));
- unlink($_icc_companion_build_job);
- unlink($_icc_companion_build_ti3);
- unlink($_icc_companion_build_input);
- unlink($_icc_companion_build_claim);
+  unless(&webui_icc_companion_write_atomic("$dir/result.icc",$body,0600));
+ unlink("$dir/job.json","$dir/job.ti3","$dir/job.input","$dir/claim.json");
  return '{"status":"ok"}';
 }
 
@@ -1051,18 +1202,19 @@ sub webui_icc_companion_status (@) {
  my $shipped=&webui_icc_companion_shipped_version();
  my $shipped_json=($shipped ne "") ? ',"shipped_version":"'.&_webui_json_escape($shipped).'"' : "";
  my $pair_requests_json=',"pair_requests":'.&webui_icc_pair_requests_fragment();
- # A Companion running colprof/targen cannot send its normal heartbeat until
- # the child exits. A matching claim proves that it received the current job;
- # expose that busy state separately so the UI does not call it disconnected.
- my ($build_job,$build_claim)=("","");
- if(open(my $jf,"<",$_icc_companion_build_job)) { local $/; $build_job=<$jf>||""; close($jf); }
- if(open(my $cf,"<",$_icc_companion_build_claim)) { local $/; $build_claim=<$cf>||""; close($cf); }
- my ($job_id,$claim_id,$operation)=("","","");
- $job_id=$1 if($build_job=~/"job"\s*:\s*"(\d+-\d+)"/);
- $claim_id=$1 if($build_claim=~/"job"\s*:\s*"(\d+-\d+)"/);
- $operation=$1 if($build_job=~/"operation"\s*:\s*"(colprof|targen)"/);
- my $build_active=($job_id ne "" && $job_id eq $claim_id && $operation ne ""
-                   && !-f $_icc_companion_build_result && !-f $_icc_companion_build_error) ? 1 : 0;
+ # A Companion running colprof/targen synchronously cannot send its normal
+ # heartbeat until the child exits. A matching claim proves that it received a
+ # queued job; expose that busy state separately so the UI does not call it
+ # disconnected. The oldest claimed job names the operation.
+ my ($build_active,$operation)=(0,"");
+ for my $job_id (&webui_icc_companion_build_queue()) {
+  my ($build_job,$build_claim)=("","");
+  if(open(my $jf,"<","$_icc_companion_build_jobs/$job_id/job.json")) { local $/; $build_job=<$jf>||""; close($jf); }
+  if(open(my $cf,"<","$_icc_companion_build_jobs/$job_id/claim.json")) { local $/; $build_claim=<$cf>||""; close($cf); }
+  next unless($build_claim=~/"job"\s*:\s*"\Q$job_id\E"/ && $build_job=~/"operation"\s*:\s*"(colprof|targen|python-stage)"/);
+  ($build_active,$operation)=(1,$1);
+  last;
+ }
  my $build_json=',"build_offload":'.($build_active?'true':'false');
  $build_json.=',"build_operation":"'.$operation.'"' if($build_active);
  return '{"status":"ok","connected":false,'.&webui_icc_companion_settings_fragment().$shipped_json.$pair_requests_json.$build_json.'}' unless($content=~/^\s*\{/);
@@ -110,6 +110,9 @@ static int reap_profile_loader(void *opaque)
 #define APP_BUILD "1"
 #define APP_TITLE "PGenerator+ Patch Companion " APP_VERSION " (build " APP_BUILD ")"
 #define RESPONSE_CAPACITY 32768
+/* Offloaded colprof/targen jobs this Companion runs at once. Each tool is
+ * single-threaded, so the generator's two fits of one build can use two cores. */
+#define COMPANION_BUILD_SLOTS 4
 #define PGEN_UNUSED __attribute__((unused))
 
 #if !defined(_WIN32) && !defined(__APPLE__)
@@ -551,6 +554,10 @@ typedef struct {
     SDL_Mutex *network_mutex;
     SDL_AtomicInt quit_requested;
     SDL_AtomicInt install_in_progress;
+    /* Offload jobs running on build threads, and their ids (under
+     * network_mutex) so a job the generator still lists is not started twice. */
+    SDL_AtomicInt builds_running;
+    char build_jobs[COMPANION_BUILD_SLOTS][32];
     /* Set by the install worker when the Profile Loader finished applying a
      * profile: the loader cycles Advanced Color underneath this process, and
      * a swapchain created before that cycle can survive demoted to composed
@@ -1844,6 +1851,74 @@ static bool companion_targen_available(void)
     return cached != 0;
 }
 
+/* Python interpreter for offloaded builder stages. */
+static const char *companion_python(void)
+{
+    const char *python = SDL_getenv("PGEN_COMPANION_PYTHON");
+    if (python && python[0]) return python;
+#ifdef _WIN32
+    return "python";
+#else
+    return "python3";
+#endif
+}
+
+/* The generator's stage runner, shipped beside this executable. */
+static bool companion_stage_script(char *out, size_t out_size)
+{
+    const char *base = SDL_GetBasePath();
+    if (!base) return false;
+    SDL_snprintf(out, out_size, "%sstages/icc_stage_job.py", base);
+    return true;
+}
+
+/* Revision of the generator's Python stage modules shipped beside this
+ * executable under stages/, as icc_stage_job.py reports it. Empty when the
+ * modules or a Python interpreter are missing, and the generator then keeps
+ * those stages. The generator only offloads a stage to the same revision. */
+static const char *companion_stage_revision(void)
+{
+    static char cached[65];
+    static bool probed = false;
+    char path[1024], command[2400], line[512];
+    FILE *pipe;
+    if (probed) return cached;
+    probed = true;
+    cached[0] = '\0';
+    if (!companion_stage_script(path, sizeof(path))) return cached;
+    {
+        FILE *probe = fopen(path, "rb");
+        if (!probe) return cached;
+        fclose(probe);
+    }
+#ifdef _WIN32
+    SDL_snprintf(command, sizeof(command), "\"\"%s\" \"%s\" --revision\" 2>NUL",
+                 companion_python(), path);
+    pipe = _popen(command, "r");
+#else
+    SDL_snprintf(command, sizeof(command), "\"%s\" \"%s\" --revision 2>/dev/null",
+                 companion_python(), path);
+    pipe = popen(command, "r");
+#endif
+    if (!pipe) return cached;
+    if (fgets(line, sizeof(line), pipe)) {
+        unsigned index = 0;
+        while (index < 64 && ((line[index] >= '0' && line[index] <= '9') ||
+                              (line[index] >= 'a' && line[index] <= 'f')))
+            index++;
+        if (index == 64) {
+            memcpy(cached, line, 64);
+            cached[64] = '\0';
+        }
+    }
+#ifdef _WIN32
+    _pclose(pipe);
+#else
+    pclose(pipe);
+#endif
+    return cached;
+}
+
 static PGEN_UNUSED uint16_t read_be16(const unsigned char *value)
 {
     return (uint16_t)(((uint16_t)value[0] << 8) | value[1]);
@@ -3827,11 +3902,17 @@ static void queue_status(const char *text);
 
 #ifdef _WIN32
 typedef struct {
+    bool active;
+} CompanionBuildConsole;
+
+/* One console serves every build running at once: AllocConsole/FreeConsole
+ * act on the whole process, so the last build to finish closes it. */
+static struct {
+    int users;
     HANDLE previous_output;
     HANDLE previous_error;
     bool allocated;
-    bool active;
-} CompanionBuildConsole;
+} companion_build_console;
 
 static bool companion_build_console_open(CompanionBuildConsole *console)
 {
@@ -3843,35 +3924,46 @@ static bool companion_build_console_open(CompanionBuildConsole *console)
     DWORD written = 0;
 
     memset(console, 0, sizeof(*console));
-    console->previous_output = GetStdHandle(STD_OUTPUT_HANDLE);
-    console->previous_error = GetStdHandle(STD_ERROR_HANDLE);
-    if (GetConsoleWindow() == NULL) {
-        if (!AllocConsole()) return false;
-        console->allocated = true;
+    SDL_LockMutex(app.network_mutex);
+    if (companion_build_console.users == 0) {
+        companion_build_console.previous_output = GetStdHandle(STD_OUTPUT_HANDLE);
+        companion_build_console.previous_error = GetStdHandle(STD_ERROR_HANDLE);
+        companion_build_console.allocated = false;
+        if (GetConsoleWindow() == NULL) {
+            if (!AllocConsole()) {
+                SDL_UnlockMutex(app.network_mutex);
+                return false;
+            }
+            companion_build_console.allocated = true;
+        }
+        SetConsoleTitleA("PGenerator+ ICC Profile Build");
+        output = GetStdHandle(STD_OUTPUT_HANDLE);
+        if (output != NULL && output != INVALID_HANDLE_VALUE)
+            WriteFile(output, message, (DWORD)(sizeof(message) - 1), &written, NULL);
     }
+    companion_build_console.users++;
     console->active = true;
-    SetConsoleTitleA("PGenerator+ ICC Profile Build");
-    output = GetStdHandle(STD_OUTPUT_HANDLE);
-    if (output != NULL && output != INVALID_HANDLE_VALUE)
-        WriteFile(output, message, (DWORD)(sizeof(message) - 1), &written, NULL);
+    SDL_UnlockMutex(app.network_mutex);
     return true;
 }
 
 static void companion_build_console_close(CompanionBuildConsole *console)
 {
     if (!console->active) return;
-    if (console->allocated) {
+    SDL_LockMutex(app.network_mutex);
+    if (--companion_build_console.users == 0 && companion_build_console.allocated) {
         FreeConsole();
-        SetStdHandle(STD_OUTPUT_HANDLE, console->previous_output);
-        SetStdHandle(STD_ERROR_HANDLE, console->previous_error);
+        SetStdHandle(STD_OUTPUT_HANDLE, companion_build_console.previous_output);
+        SetStdHandle(STD_ERROR_HANDLE, companion_build_console.previous_error);
     }
+    SDL_UnlockMutex(app.network_mutex);
     console->active = false;
 }
 #endif
 
 /* Tell the generator the fit failed so it falls back to its own colprof
  * instead of waiting out the build timeout. */
-static void companion_report_build_error(const char *reason)
+static void companion_report_build_error(const char *job, const char *reason)
 {
     char path[768];
     char escaped[240];
@@ -3883,8 +3975,8 @@ static void companion_report_build_error(const char *reason)
             c == '.' || c == '_' || c == '-') { escaped[out++] = c; continue; }
     }
     escaped[out] = '\0';
-    SDL_snprintf(path, sizeof(path), "/api/icc/companion/build-result?token=%s&error=%s",
-                 app.config.token, escaped);
+    SDL_snprintf(path, sizeof(path), "/api/icc/companion/build-result?token=%s&job=%s&error=%s",
+                 app.config.token, job, escaped);
     http_binary(&app.config, "POST", path, "text/plain", (const unsigned char *)"x", 1, NULL, NULL);
 }
 
@@ -3945,7 +4037,7 @@ static bool companion_quote_append(char *destination, size_t capacity, size_t *u
 static void companion_run_targen(const char *poll_response)
 {
     char ti1_path[1200], base_path[1200], input_path[1200], tool[1024];
-    char command[8192], flags[2048], directory[1024];
+    char command[8192], flags[2048], directory[1024], job[32] = "";
     unsigned char *input = NULL;
     size_t input_length = 0;
     FILE *handle;
@@ -3953,9 +4045,10 @@ static void companion_run_targen(const char *poll_response)
     bool built = false;
     bool precondition = strstr(poll_response, "\"precondition\":true") != NULL;
 
+    json_string(poll_response, "job", job, sizeof(job));
     if (!companion_targen_available() ||
         !companion_tool_path("targen", tool, sizeof(tool))) {
-        companion_report_build_error("targen is not available in this Companion package");
+        companion_report_build_error(job, "targen is not available in this Companion package");
         return;
     }
     flags[0] = '\0';
@@ -3973,26 +4066,26 @@ static void companion_run_targen(const char *poll_response)
     {
         const char *base = SDL_GetPrefPath("PGeneratorPlus", "build");
         if (!base) {
-            companion_report_build_error("could not create the chart work directory");
+            companion_report_build_error(job, "could not create the chart work directory");
             return;
         }
         SDL_strlcpy(directory, base, sizeof(directory));
-        SDL_snprintf(base_path, sizeof(base_path), "%schart", directory);
-        SDL_snprintf(ti1_path, sizeof(ti1_path), "%schart.ti1", directory);
-        SDL_snprintf(input_path, sizeof(input_path), "%sprecondition.icc", directory);
+        SDL_snprintf(base_path, sizeof(base_path), "%schart-%s", directory, job);
+        SDL_snprintf(ti1_path, sizeof(ti1_path), "%schart-%s.ti1", directory, job);
+        SDL_snprintf(input_path, sizeof(input_path), "%sprecondition-%s.icc", directory, job);
     }
     remove(ti1_path);
     remove(input_path);
 
-    {   /* Fetching even an empty input claims the synchronous chart job. */
+    {   /* Fetching even an empty input claims the chart job. */
         char path[512];
         SDL_snprintf(path, sizeof(path),
-                     "/api/icc/companion/build-input?token=%s", app.config.token);
+                     "/api/icc/companion/build-input?token=%s&job=%s", app.config.token, job);
         status = http_binary(&app.config, "GET", path, "application/octet-stream",
                              NULL, 0, &input, &input_length);
         if (status != 200) {
             if (input) SDL_free(input);
-            companion_report_build_error("could not claim the chart generation job");
+            companion_report_build_error(job, "could not claim the chart generation job");
             return;
         }
     }
@@ -4000,14 +4093,14 @@ static void companion_run_targen(const char *poll_response)
         if (!input || input_length <= 128 || input_length > 64u * 1024u * 1024u ||
             memcmp(input + 36, "acsp", 4)) {
             if (input) SDL_free(input);
-            companion_report_build_error("the preconditioning profile is invalid");
+            companion_report_build_error(job, "the preconditioning profile is invalid");
             return;
         }
         handle = fopen(input_path, "wb");
         if (!handle || fwrite(input, 1, input_length, handle) != input_length) {
             if (handle) fclose(handle);
             SDL_free(input);
-            companion_report_build_error("could not stage the preconditioning profile");
+            companion_report_build_error(job, "could not stage the preconditioning profile");
             return;
         }
         fclose(handle);
@@ -4039,7 +4132,7 @@ static void companion_run_targen(const char *poll_response)
             }
         }
         if (!out) {
-            companion_report_build_error("the chart arguments could not be read");
+            companion_report_build_error(job, "the chart arguments could not be read");
             remove(input_path);
             return;
         }
@@ -4089,8 +4182,8 @@ static void companion_run_targen(const char *poll_response)
                     unsigned char *reply = NULL;
                     size_t reply_length = 0;
                     SDL_snprintf(path, sizeof(path),
-                                 "/api/icc/companion/build-result?token=%s",
-                                 app.config.token);
+                                 "/api/icc/companion/build-result?token=%s&job=%s",
+                                 app.config.token, job);
                     if (http_binary(&app.config, "POST", path,
                                     "application/octet-stream", ti1, (size_t)size,
                                     &reply, &reply_length) == 200 && reply &&
@@ -4105,13 +4198,105 @@ static void companion_run_targen(const char *poll_response)
     }
     remove(ti1_path);
     remove(input_path);
-    if (!built) companion_report_build_error("targen failed after three chart optimization attempts");
+    if (!built) companion_report_build_error(job, "targen failed after three chart optimization attempts");
+}
+
+/* Run a builder stage the generator handed over as a JSON job document.
+ * icc_stage_job.py checks the stage revision itself and writes a result
+ * document that the generator verifies against the job it sent. */
+static void companion_run_stage(const char *poll_response)
+{
+    char job_path[1200], result_path[1200], script[1024], command[4096];
+    char directory[1024], job[32] = "";
+    unsigned char *input = NULL;
+    size_t input_length = 0;
+    FILE *handle;
+    int status;
+    bool built = false;
+
+    json_string(poll_response, "job", job, sizeof(job));
+    if (!companion_stage_revision()[0] ||
+        !companion_stage_script(script, sizeof(script))) {
+        companion_report_build_error(job, "Python stages are not available in this Companion package");
+        return;
+    }
+    {
+        const char *base = SDL_GetPrefPath("PGeneratorPlus", "build");
+        if (!base) {
+            companion_report_build_error(job, "could not create the stage work directory");
+            return;
+        }
+        SDL_strlcpy(directory, base, sizeof(directory));
+        SDL_snprintf(job_path, sizeof(job_path), "%sstage-%s.json", directory, job);
+        SDL_snprintf(result_path, sizeof(result_path), "%sstage-%s.result.json", directory, job);
+    }
+    remove(result_path);
+    {   /* Fetching the job document claims the job. */
+        char path[512];
+        SDL_snprintf(path, sizeof(path),
+                     "/api/icc/companion/build-input?token=%s&job=%s", app.config.token, job);
+        status = http_binary(&app.config, "GET", path, "application/octet-stream",
+                             NULL, 0, &input, &input_length);
+        if (status != 200 || !input || input_length < 32) {
+            if (input) SDL_free(input);
+            companion_report_build_error(job, "could not fetch the stage job");
+            return;
+        }
+    }
+    handle = fopen(job_path, "wb");
+    if (!handle || fwrite(input, 1, input_length, handle) != input_length) {
+        if (handle) fclose(handle);
+        SDL_free(input);
+        remove(job_path);
+        companion_report_build_error(job, "could not stage the stage job");
+        return;
+    }
+    fclose(handle);
+    SDL_free(input);
+#ifdef _WIN32
+    SDL_snprintf(command, sizeof(command), "\"\"%s\" \"%s\" \"%s\" \"%s\"\"",
+                 companion_python(), script, job_path, result_path);
+#else
+    SDL_snprintf(command, sizeof(command), "\"%s\" \"%s\" \"%s\" \"%s\"",
+                 companion_python(), script, job_path, result_path);
+#endif
+    queue_status("PGenerator+ Patch Companion | Running an ICC profile build stage...");
+    status = system(command);
+    (void)status;
+
+    handle = fopen(result_path, "rb");
+    if (handle) {
+        long size;
+        fseek(handle, 0, SEEK_END);
+        size = ftell(handle);
+        fseek(handle, 0, SEEK_SET);
+        if (size > 32 && size < 64 * 1024 * 1024) {
+            unsigned char *result = (unsigned char *)SDL_malloc((size_t)size);
+            if (result && fread(result, 1, (size_t)size, handle) == (size_t)size) {
+                char path[512];
+                unsigned char *reply = NULL;
+                size_t reply_length = 0;
+                SDL_snprintf(path, sizeof(path), "/api/icc/companion/build-result?token=%s&job=%s",
+                             app.config.token, job);
+                if (http_binary(&app.config, "POST", path, "application/json",
+                                result, (size_t)size, &reply, &reply_length) == 200 &&
+                    reply && strstr((const char *)reply, "\"status\":\"ok\""))
+                    built = true;
+                if (reply) SDL_free(reply);
+            }
+            if (result) SDL_free(result);
+        }
+        fclose(handle);
+    }
+    remove(job_path);
+    remove(result_path);
+    if (!built) companion_report_build_error(job, "the Python stage did not produce a result");
 }
 
 static void companion_run_build(const char *poll_response)
 {
     char ti3_path[1200], icc_path[1200], base_path[1200], tool[1024];
-    char command[8192], flags[2048], directory[1024];
+    char command[8192], flags[2048], directory[1024], job[32] = "";
     unsigned char *ti3 = NULL;
     size_t ti3_length = 0;
     FILE *handle;
@@ -4125,7 +4310,12 @@ static void companion_run_build(const char *poll_response)
         companion_run_targen(poll_response);
         return;
     }
+    if (strstr(poll_response, "\"operation\":\"python-stage\"")) {
+        companion_run_stage(poll_response);
+        return;
+    }
 
+    json_string(poll_response, "job", job, sizeof(job));
     if (!companion_tool_path("colprof", tool, sizeof(tool))) return;
     /* Flags are produced by the generator's builder from its argument list. */
     flags[0] = '\0';
@@ -4145,9 +4335,9 @@ static void companion_run_build(const char *poll_response)
         const char *base = SDL_GetPrefPath("PGeneratorPlus", "build");
         if (!base) return;
         SDL_strlcpy(directory, base, sizeof(directory));
-        SDL_snprintf(base_path, sizeof(base_path), "%sfit", directory);
-        SDL_snprintf(ti3_path, sizeof(ti3_path), "%sfit.ti3", directory);
-        SDL_snprintf(icc_path, sizeof(icc_path), "%sfit.icc", directory);
+        SDL_snprintf(base_path, sizeof(base_path), "%sfit-%s", directory, job);
+        SDL_snprintf(ti3_path, sizeof(ti3_path), "%sfit-%s.ti3", directory, job);
+        SDL_snprintf(icc_path, sizeof(icc_path), "%sfit-%s.icc", directory, job);
     }
     remove(icc_path);
 #ifdef _WIN32
@@ -4156,14 +4346,14 @@ static void companion_run_build(const char *poll_response)
 
     {   /* Fetch the characterization: too large for the poll response buffer. */
         char path[512];
-        SDL_snprintf(path, sizeof(path), "/api/icc/companion/build-ti3?token=%s", app.config.token);
+        SDL_snprintf(path, sizeof(path), "/api/icc/companion/build-ti3?token=%s&job=%s", app.config.token, job);
         status = http_binary(&app.config, "GET", path, "text/plain", NULL, 0, &ti3, &ti3_length);
         if (status != 200 || !ti3 || ti3_length < 32) {
             if (ti3) SDL_free(ti3);
 #ifdef _WIN32
             companion_build_console_close(&build_console);
 #endif
-            companion_report_build_error("could not fetch the characterization");
+            companion_report_build_error(job, "could not fetch the characterization");
             return;
         }
     }
@@ -4174,7 +4364,7 @@ static void companion_run_build(const char *poll_response)
 #ifdef _WIN32
         companion_build_console_close(&build_console);
 #endif
-        companion_report_build_error("could not stage the characterization");
+        companion_report_build_error(job, "could not stage the characterization");
         return;
     }
     fclose(handle);
@@ -4211,7 +4401,7 @@ static void companion_run_build(const char *poll_response)
 #ifdef _WIN32
             companion_build_console_close(&build_console);
 #endif
-            companion_report_build_error("the fit arguments could not be read");
+            companion_report_build_error(job, "the fit arguments could not be read");
             return;
         }
         cleaned[out] = '\0';
@@ -4238,7 +4428,14 @@ static void companion_run_build(const char *poll_response)
                      tool, cleaned, icc_path, base_path);
 #endif
     }
-    queue_status("PGenerator+ Patch Companion | Building ICC profile...");
+    if (SDL_GetAtomicInt(&app.builds_running) > 1) {
+        char title[128];
+        SDL_snprintf(title, sizeof(title), "PGenerator+ Patch Companion | Building %d ICC profile fits...",
+                     SDL_GetAtomicInt(&app.builds_running));
+        queue_status(title);
+    } else {
+        queue_status("PGenerator+ Patch Companion | Building ICC profile...");
+    }
     status = system(command);
     (void)status;
 #ifdef _WIN32
@@ -4257,7 +4454,7 @@ static void companion_run_build(const char *poll_response)
                 char path[512];
                 unsigned char *reply = NULL;
                 size_t reply_length = 0;
-                SDL_snprintf(path, sizeof(path), "/api/icc/companion/build-result?token=%s", app.config.token);
+                SDL_snprintf(path, sizeof(path), "/api/icc/companion/build-result?token=%s&job=%s", app.config.token, job);
                 if (http_binary(&app.config, "POST", path, "application/octet-stream",
                                 icc, (size_t)size, &reply, &reply_length) == 200 &&
                     reply && strstr((const char *)reply, "\"status\":\"ok\""))
@@ -4270,7 +4467,7 @@ static void companion_run_build(const char *poll_response)
     }
     remove(ti3_path);
     remove(icc_path);
-    if (!built) companion_report_build_error("colprof did not produce a profile");
+    if (!built) companion_report_build_error(job, "colprof did not produce a profile");
 }
 
 static void companion_report_install(const char *job, bool ok, const char *message)
@@ -4563,6 +4760,70 @@ static void companion_start_install(const char *poll_response)
     }
 }
 
+/* Offload jobs this Companion accepts at once: one core is left for the
+ * patch window and the network thread. */
+static int companion_build_slots(void)
+{
+    int slots = SDL_GetNumLogicalCPUCores() - 1;
+    if (slots < 1) slots = 1;
+    if (slots > COMPANION_BUILD_SLOTS) slots = COMPANION_BUILD_SLOTS;
+    return slots;
+}
+
+static int companion_build_thread_main(void *data)
+{
+    char *response = (char *)data;
+    char job[32] = "";
+    int slot;
+    json_string(response, "job", job, sizeof(job));
+    companion_run_build(response);
+    SDL_free(response);
+    SDL_LockMutex(app.network_mutex);
+    for (slot = 0; slot < COMPANION_BUILD_SLOTS; slot++)
+        if (!strcmp(app.build_jobs[slot], job)) app.build_jobs[slot][0] = '\0';
+    SDL_UnlockMutex(app.network_mutex);
+    SDL_AddAtomicInt(&app.builds_running, -1);
+    return 0;
+}
+
+/* Run an offload job on its own thread so the poll loop keeps its heartbeat
+ * and can accept the generator's other fit while this one runs. A job that is
+ * already running, or one arriving with every slot busy, is left queued. */
+static void companion_start_build(const char *poll_response)
+{
+    char job[32] = "", *response;
+    SDL_Thread *thread;
+    int slot, free_slot = -1;
+
+    if (!json_string(poll_response, "job", job, sizeof(job)) || !job[0]) return;
+    SDL_LockMutex(app.network_mutex);
+    for (slot = 0; slot < COMPANION_BUILD_SLOTS; slot++) {
+        if (!strcmp(app.build_jobs[slot], job)) {
+            SDL_UnlockMutex(app.network_mutex);
+            return;
+        }
+        if (free_slot < 0 && !app.build_jobs[slot][0]) free_slot = slot;
+    }
+    if (free_slot < 0 || SDL_GetAtomicInt(&app.builds_running) >= companion_build_slots()) {
+        SDL_UnlockMutex(app.network_mutex);
+        return;
+    }
+    SDL_strlcpy(app.build_jobs[free_slot], job, sizeof(app.build_jobs[free_slot]));
+    SDL_AddAtomicInt(&app.builds_running, 1);
+    SDL_UnlockMutex(app.network_mutex);
+    response = SDL_strdup(poll_response);
+    thread = response ? SDL_CreateThread(companion_build_thread_main, "PGen ICC build", response) : NULL;
+    if (thread) {
+        SDL_DetachThread(thread);
+        return;
+    }
+    if (response) SDL_free(response);
+    SDL_LockMutex(app.network_mutex);
+    app.build_jobs[free_slot][0] = '\0';
+    SDL_UnlockMutex(app.network_mutex);
+    SDL_AddAtomicInt(&app.builds_running, -1);
+}
+
 static void acknowledge(uint64_t sequence, bool ok, const char *message,
                         const char *renderer, bool hdr_active)
 {
@@ -4613,6 +4874,7 @@ static void poll_server(void)
      * inventing a placeholder the operator then has to interpret. */
     char swapchain_color_space[32] = "unknown", presentation_mode[32] = "unknown";
     char transform_note[128] = "", transform_note_hex[257] = "";
+    char build_ids[COMPANION_BUILD_SLOTS * 32] = "";
     double sequence_value, r, g, b, input_max, code_min, code_max, poll_ms;
     double max_luma = 1000.0, min_luma = 0.005, max_cll = 1000.0, max_fall = 400.0;
     double settings_revision_value, display_size_value, patch_size_value;
@@ -4621,13 +4883,20 @@ static void poll_server(void)
     bool is_alignment, reported_hdr_active = false;
     double output_maximum_luminance = 0.0, output_full_frame_luminance = 0.0;
     unsigned int output_bits_per_color = 0;
-    int status;
+    int status, slot;
 #ifdef _WIN32
     wchar_t active_profile_path[32768] = L"";
 #endif
     SDL_LockMutex(app.network_mutex);
     if (app.ack_renderer[0]) SDL_strlcpy(reported_renderer, app.ack_renderer, sizeof(reported_renderer));
     reported_hdr_active = app.ack_hdr_active;
+    /* The jobs running on build threads. Listing them on every poll is what
+     * tells a generator racing this Companion that its fit is still alive. */
+    for (slot = 0; slot < COMPANION_BUILD_SLOTS; slot++) {
+        if (!app.build_jobs[slot][0]) continue;
+        if (build_ids[0]) SDL_strlcat(build_ids, ",", sizeof(build_ids));
+        SDL_strlcat(build_ids, app.build_jobs[slot], sizeof(build_ids));
+    }
     SDL_UnlockMutex(app.network_mutex);
 #ifdef _WIN32
     reported_hdr_active = windows_window_hdr_enabled(app.window);
@@ -4719,7 +4988,7 @@ static void poll_server(void)
     profile_name_hex(active_profile, profile_hex, sizeof(profile_hex));
     profile_name_hex(app.selected_display, display_hex, sizeof(display_hex));
     SDL_snprintf(path, sizeof(path),
-                 "/api/icc/companion/poll?token=%s&client=%s&version=%s&build=%s&platform=%s&renderer=%s&hdr=%d&profile_hex=%s&display_hex=%s&swapchain_cs=%s&presentation=%s&output_max=%.3f&output_full=%.3f&output_bits=%u&transform=%s&transform_ready=%d&transform_note_hex=%s&source_r=%.6f&source_g=%.6f&source_b=%.6f&submitted_r=%.6f&submitted_g=%.6f&submitted_b=%.6f&build_argyll=%s&build_targen=%d",
+                 "/api/icc/companion/poll?token=%s&client=%s&version=%s&build=%s&platform=%s&renderer=%s&hdr=%d&profile_hex=%s&display_hex=%s&swapchain_cs=%s&presentation=%s&output_max=%.3f&output_full=%.3f&output_bits=%u&transform=%s&transform_ready=%d&transform_note_hex=%s&source_r=%.6f&source_g=%.6f&source_b=%.6f&submitted_r=%.6f&submitted_g=%.6f&submitted_b=%.6f&build_argyll=%s&build_targen=%d&build_jobs=%d&build_running=%d&build_ids=%s&build_stages=%s",
                  app.config.token, app.config.client, APP_VERSION, APP_BUILD,
                  companion_platform(),
                  reported_renderer, reported_hdr_active ? 1 : 0, profile_hex,
@@ -4730,7 +4999,9 @@ static void poll_server(void)
                  app.correction_ready ? 1 : 0, transform_note_hex,
                  app.source_r, app.source_g, app.source_b,
                  app.submitted_r, app.submitted_g, app.submitted_b,
-                 companion_argyll_version(), companion_targen_available() ? 1 : 0);
+                 companion_argyll_version(), companion_targen_available() ? 1 : 0,
+                 companion_build_slots(), SDL_GetAtomicInt(&app.builds_running),
+                 build_ids, companion_stage_revision());
     status = http_request(&app.config, "GET", path, NULL, response, sizeof(response));
     if (status != 200) {
         char title[256];
@@ -4912,7 +5183,7 @@ static void poll_server(void)
     /* A build job pre-empts the patch path: the generator's builder is blocked
      * and no patch is pending while a fit runs. */
     if (strstr(response, "\"status\":\"build\"")) {
-        companion_run_build(response);
+        companion_start_build(response);
         app.next_poll_ms = SDL_GetTicks() + 250;
         return;
     }
@@ -5568,6 +5839,7 @@ SDL_AppResult SDL_AppInit(void **appstate, int argc, char *argv[])
     app.ack_hdr_active = app.hdr_active;
     SDL_SetAtomicInt(&app.quit_requested, 0);
     SDL_SetAtomicInt(&app.install_in_progress, 0);
+    SDL_SetAtomicInt(&app.builds_running, 0);
     app.network_thread = SDL_CreateThread(network_thread_main, "PGen ICC network", NULL);
     if (!app.network_thread) {
         SDL_ShowSimpleMessageBox(SDL_MESSAGEBOX_ERROR, "PGenerator+ Patch Companion",
@@ -242,8 +242,54 @@ function meterIccEstimatedBuildRange(config,patchCount){
  };
 }
 
+const METER_ICC_BUILD_STAGE_LABELS={
+ normalize:'Reading the measurements',mhc2:'Deriving the MHC2 calibration',ti3:'Writing the characterization',
+ colprof:'Fitting the profile',colprof_virtual:'Fitting the calibrated profile',mhc2_luts:'Building the MHC2 curves',
+ reshape:'Reshaping the HDR B2A table',b2a_repair:'Repairing the B2A table',hdr_calibration:'Deriving the HDR calibration',
+ applycal:'Applying the calibration',refine:'Refining the B2A table',mhc2_refit:'Refitting the MHC2 tag',
+ shadow_luts:'Building the shadow curves',profcheck:'Validating the profile',targen:'Optimizing the patch set'
+};
+
+function meterIccBuildProgressText(event){
+ let text=METER_ICC_BUILD_STAGE_LABELS[event.stage]||'Preparing';
+ if(event.percent!=null&&Number.isFinite(Number(event.percent))) text+=' '+Math.round(Number(event.percent))+'%';
+ if(Number(event.eta_seconds)>0) text+=', about '+meterIccFormatDuration(event.eta_seconds)+' left in this pass';
+ // Argyll's own lines are terse; the Companion's tell where the job stands.
+ if(event.source==='companion'&&event.message) text+=' ('+event.message+')';
+ return text+'.';
+}
+
+// The builder publishes its stage and Argyll's percentage while a build or
+// patch generation runs. Poll it beside the request that waits for the result.
+function meterIccWatchBuildProgress(operation,onProgress){
+ const watch={timer:null,stopped:false};
+ const poll=async()=>{
+  const response=await fetchJSON('/api/icc/progress',{_quiet:true,_timeoutMs:5000});
+  const event=response&&response.status==='ok'?response.progress:null;
+  // A finished event is what the previous run left behind.
+  if(!watch.stopped&&event&&event.operation===operation&&event.stage!=='finished') onProgress(event);
+  if(!watch.stopped) watch.timer=setTimeout(poll,2000);
+ };
+ watch.timer=setTimeout(poll,1000);
+ watch.stop=()=>{
+  watch.stopped=true;
+  if(watch.timer) clearTimeout(watch.timer);
+ };
+ return watch;
+}
+
+function meterIccShowBuildProgress(event){
+ const count=document.getElementById('meterIccProgressCount');
+ const fill=document.getElementById('meterIccProgressFill');
+ if(count) count.textContent=meterIccBuildProgressText(event);
+ if(fill&&event.percent!=null&&Number.isFinite(Number(event.percent))){
+  fill.classList.remove('indeterminate');
+  fill.style.width=Math.max(0,Math.min(100,Number(event.percent)))+'%';
+ }
+}
+
 function meterIccStartBuildClock(status,config,patchCount){
- const clock={startedAt:Date.now(),estimate:meterIccEstimatedBuildRange(config,patchCount),timer:null,config,patchCount};
+ const clock={startedAt:Date.now(),estimate:meterIccEstimatedBuildRange(config,patchCount),timer:null,config,patchCount,progress:null,watch:null};
  const update=()=>{
   if(!status) return;
   const elapsed=Math.max(0,(Date.now()-clock.startedAt)/1000);
@@ -255,10 +301,15 @@ function meterIccStartBuildClock(status,config,patchCount){
    ?('up to '+meterIccFormatDuration(highRemaining)+' remaining')
    :(meterIccFormatDuration(lowRemaining)+' to '+meterIccFormatDuration(highRemaining)+' remaining');
   status.textContent='Measurements complete. Building the ICC profile. Elapsed '+meterIccFormatDuration(elapsed)+'. Estimated '+remaining+'.'
-   +(clock.estimate.learned?' Based on previous builds on this browser.':'');
+   +(clock.estimate.learned?' Based on previous builds on this browser.':'')
+   +(clock.progress?' '+meterIccBuildProgressText(clock.progress):'');
  };
  update();
  clock.timer=setInterval(update,1000);
+ clock.watch=meterIccWatchBuildProgress('build',event=>{
+  clock.progress=event;
+  update();
+ });
  return clock;
 }
 
@@ -302,6 +353,7 @@ function meterIccStopBuildClock(clock,remember){
  if(!clock) return 0;
  if(clock.timer) clearInterval(clock.timer);
  clock.timer=null;
+ if(clock.watch) clock.watch.stop();
  const elapsed=Math.max(0,(Date.now()-clock.startedAt)/1000);
  if(remember&&elapsed>=1) meterIccRememberBuildDuration(clock.config,clock.patchCount,elapsed);
  return elapsed;
@@ -883,9 +935,15 @@ async function meterIccGenerateSteps(profileType,settings,includeMetadataWhite,p
  settings=settings||meterIccPatchSettings();
  const payload=Object.assign({},settings,{profile_type:profileType});
  if(profileModel) payload.profile_model=profileModel;
- const response=await fetchJSON('/api/icc/patches',{
-  method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(payload),_timeoutMs:920000
- });
+ const watch=meterIccWatchBuildProgress('patches',meterIccShowBuildProgress);
+ let response;
+ try{
+  response=await fetchJSON('/api/icc/patches',{
+   method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(payload),_timeoutMs:920000
+  });
+ }finally{
+  watch.stop();
+ }
  if(!response||response.status!=='ok'||!Array.isArray(response.patches)) throw new Error(response&&response.message?response.message:'Could not generate the optimized patch set');
  return meterIccPatchesToSteps(response.patches,profileType,includeMetadataWhite);
 }
@@ -902,9 +960,15 @@ async function meterIccGeneratePreconditionedSteps(readings,runConfig){
   readings,
   patch_settings:runConfig.patch_settings
  };
- const response=await fetchJSON('/api/icc/precondition-patches',{
-  method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(payload),_timeoutMs:930000
- });
+ const watch=meterIccWatchBuildProgress('precondition-patches',meterIccShowBuildProgress);
+ let response;
+ try{
+  response=await fetchJSON('/api/icc/precondition-patches',{
+   method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(payload),_timeoutMs:930000
+  });
+ }finally{
+  watch.stop();
+ }
  if(!response||response.status!=='ok'||!Array.isArray(response.patches)) throw new Error(response&&response.message?response.message:'Could not create the display-aware patch set');
  return meterIccPatchesToSteps(response.patches,runConfig.profile_type);
 }
@@ -2908,6 +2972,9 @@ async function meterIccRetryBuild(){
    icc_version:String((document.getElementById('meterIccVersion')||{}).value||(saved&&saved.icc_version)||'auto'),
    cicp:meterIccCicpSettings(),
    pattern_provider:patternProvider,reuse_signature:reuseSignature,
+   // The builder starts from the saved profile's colprof fit when the
+   // measurements and fit settings are unchanged, and fits again otherwise.
+   rederive_from:String(reusable.savedProfile||'')||undefined,
    patch_settings:(saved&&saved.patch_settings)||null,
    target_transfer:(type==='windows-sdr'||type==='sdr')?String((saved&&saved.target_transfer)||meterIccTargetTransferValue()):undefined,
    code_min:0,code_max:info.mode==='sdr'?255:1023,
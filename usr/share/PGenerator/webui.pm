@@ -408,26 +408,35 @@ our $_icc_profile_builder="/usr/bin/icc_profile_builder.py";
 our $_icc_profile_dir="$var_dir/icc";
 our $_icc_companion_packager="/usr/bin/icc_companion_package.py";
 our $_icc_companion_lut_builder="/usr/bin/icc_companion_lut.py";
+# Converted LUTs cached by icc_companion_lut.py, PROFILE.icc.KEY.cube|pglt.
+our $_icc_derived_lut_dir="$_icc_profile_dir/.derived-luts";
+our $_icc_finetune_tool="/usr/bin/icc_finetune.py";
+# Long-lived ICC worker: the tools above served over a Unix socket, so a
+# request skips interpreter start-up and profile parsing. PGICCProfile.pm
+# falls back to running the tool directly whenever the worker is down.
+our $_icc_worker="/usr/bin/icc_worker.py";
+our $_icc_worker_socket="${var_dir}icc-worker.sock";
 our $_icc_companion_dir="$var_dir/icc-companion";
 our $_icc_companion_token_file="$_icc_companion_dir/pairing.token";
 our $_icc_companion_command_file="$_icc_companion_dir/command.json";
 our $_icc_companion_settings_file="$_icc_companion_dir/display.json";
-# colprof offload: the ICC builder drops a job here and waits for result.icc.
-# The Companion collects the job through its existing poll and posts the built
-# profile back, so no new transport is involved.
+# colprof/targen offload: the ICC builder queues jobs here and waits for each
+# one's result. The Companion collects them through its existing poll and posts
+# the output back, so no new transport is involved. Every job has a directory
+# under jobs/ named by its id, holding job.json, its input (job.ti3 or
+# job.input), claim.json once the Companion has fetched it, and finally
+# result.icc or error.txt. queue.json lists the ids in submission order.
 our $_icc_companion_build_dir="$_icc_companion_dir/build";
-our $_icc_companion_build_job="$_icc_companion_build_dir/job.json";
-our $_icc_companion_build_ti3="$_icc_companion_build_dir/job.ti3";
-our $_icc_companion_build_input="$_icc_companion_build_dir/job.input";
-our $_icc_companion_build_result="$_icc_companion_build_dir/result.icc";
-our $_icc_companion_build_error="$_icc_companion_build_dir/error.txt";
-our $_icc_companion_build_claim="$_icc_companion_build_dir/claim.json";
+our $_icc_companion_build_jobs="$_icc_companion_build_dir/jobs";
+our $_icc_companion_build_queue="$_icc_companion_build_dir/queue.json";
 our $_icc_companion_build_state="$_icc_companion_build_dir/companion.json";
+our $_icc_companion_build_offered="$_icc_companion_build_dir/offered.json";
 our $_icc_companion_install_dir="$_icc_companion_dir/install";
 our $_icc_companion_install_job="$_icc_companion_install_dir/job.json";
 our $_icc_companion_install_status="$_icc_companion_install_dir/status.json";
 our $_icc_companion_ack_file="/tmp/pgen_icc_companion.ack.json";
 our $_icc_companion_status_file="/tmp/pgen_icc_companion.status.json";
+our $_icc_build_progress_file="/tmp/pgen_icc_build.progress.ndjson";
 # Pairing handshake for a Companion that arrived from the public GitHub
 # release rather than the paired-download packager: it has no token yet, so it
 # asks here, a human approves it in the WebUI, and only then does it get one.
@@ -785,6 +794,9 @@ sub webui_route_is_concurrent_safe (@) {
  # /api/stats reads /proc/sysfs plus a 2s response cache; its cross-call CPU
  # delta baseline is :shared, so the pool does not corrupt the percentage.
  return 1 if($path eq "/api/stats" || $path eq "/api/info");
+ # Build progress reads the tail of one small file the builder appends to,
+ # and is polled exactly while the compute lane is busy with that build.
+ return 1 if($path eq "/api/icc/progress");
  # Companion traffic is authenticated and touches only its own atomic files.
  # It must not take the global WebUI mutex four times per second while a
  # measurement series and its status polling are active. The three pairing
@@ -1843,6 +1855,11 @@ sub webui_handle_request (@) {
     my $len=length($result);
     print $client "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: $len\r\n$cors\r\n$result";
    }
+   elsif($path eq "/api/icc/progress") {
+    my $result=&webui_icc_build_progress();
+    my $len=length($result);
+    print $client "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: $len\r\n$cors\r\n$result";
+   }
    elsif($path eq "/api/icc/validation") {
     my $result=&webui_icc_profile_validation($request_query);
     my $len=length($result);